@@ -2,53 +2,251 @@ import csv
 import re
 import random
 
-from fieldmap import translateIn, translateOut
+from fieldmap import translateIn, incoming_filter
+import lookupcache
+from csvindex import IndexedCSV
+from exceptions import LookupBackendException
 from filelinks import lookup_file
+from record import record_class
+
+
+class FirstlineTemplate:
+    """
+    first line of an address, parsed once into literal text and numeric slots,
+    so that obfuscating it is just filling in the slots with new numbers:
+
+    house number (the last number in the line): chosen from a larger range, odd and even
+    end of a house number range ('12-15 Collins Street'): kept the same distance from the
+    house number, so the range stays the same size
+    every other number (flat, shop, Level etc.): a small number
+    ordinals ('1st Floor') are left alone
+    """
+
+    HOUSE = 'house'
+    RANGE_END = 'range_end'
+    SMALL = 'small'
+    ORDINAL_SUFFIXES = ('st', 'nd', 'rd', 'th')
+
+    def __init__(self, line):
+        self.line = line
+        numbers = [m for m in re.finditer('[0-9]+', line) if not self._is_ordinal(line, m)]
+        kinds = [self.SMALL] * len(numbers)
+        spans = [0] * len(numbers)
+        if numbers:
+            kinds[-1] = self.HOUSE
+            if len(numbers) > 1 and line[numbers[-2].end():numbers[-1].start()].strip() == '-':
+                # a range: the earlier number is the house number
+                kinds[-2:] = [self.HOUSE, self.RANGE_END]
+                spans[-1] = abs(int(numbers[-1].group()) - int(numbers[-2].group()))
+        self.literals = []
+        self.slots = []
+        position = 0
+        for number, kind, span in zip(numbers, kinds, spans):
+            self.literals.append(line[position:number.start()])
+            self.slots.append((kind, span))
+            position = number.end()
+        self.literals.append(line[position:])
+        self.small_slots = kinds.count(self.SMALL)
+
+    @classmethod
+    def _is_ordinal(cls, line, number):
+        suffix = line[number.end():number.end() + 3]
+        return suffix[:2].lower() in cls.ORDINAL_SUFFIXES and not suffix[2:].isalpha()
+
+    @staticmethod
+    def house_number(rng=random):
+        # TODO: normal distribution?
+        return rng.randint(0, 75) * 3 + 1
+
+    @staticmethod
+    def house_numbers(draws, rows=None):
+        """house_number() for each record of a CounterBatch (or those at the positions in rows)"""
+        return [r * 3 + 1 for r in draws.randints(0, 75, rows)]
+
+    def fill(self, rng=random, house=None):
+        """obfuscated line: slots filled with new numbers (house: a house number drawn already)"""
+        if not self.slots:
+            return self.line
+        if house is None:
+            house = self.house_number(rng)
+        return self.filled(house, [rng.randint(1, 5) for i in range(self.small_slots)])
+
+    def filled(self, house, smalls):
+        """line with its slots filled: house number house, then the small numbers smalls, in order"""
+        smalls = iter(smalls)
+        parts = [self.literals[0]]
+        for (kind, span), literal in zip(self.slots, self.literals[1:]):
+            if kind == self.HOUSE:
+                parts.append(str(house))
+            elif kind == self.RANGE_END:
+                parts.append(str(house + span))
+            else:
+                parts.append(str(next(smalls)))
+            parts.append(literal)
+        return "".join(parts)
 
 
 class AddressBuilder:
 
-    def __init__(self, filename=lookup_file("Addresses.csv")):
+    BACKENDS = ('memory', 'indexed')
+    # picks tried before deciding an indexed file has no first lines of address
+    MAX_INDEXED_TRIES = 1000
+
+    def __init__(self, filename=lookup_file("Addresses.csv"), encoding='cp1252', cache=True, backend='memory'):
+        """
+        encoding: Outlook exports its CSV files in the Windows codepage
+        cache: load the translated addresses from (and save them to) a binary cache
+        beside filename (see lookupcache.py); for the indexed backend, the row index
+        backend: 'memory' loads every address up front (fastest picks);
+        'indexed' reads the file in place (see csvindex.py), parsing and translating only
+        the rows picked, so memory stays flat however large the file (e.g. a national
+        address file). Encodings must be ASCII-compatible
+        """
+        if backend not in self.BACKENDS:
+            raise LookupBackendException("Unknown address lookup backend '{0}' (expected one of {1})".format(
+                backend, ', '.join(self.BACKENDS)))
         self.address_generator = self._address()
         self.firstline_field = "street"
+        self.filename = filename
+        self.encoding = encoding
+        self.backend = backend
+        if backend == 'indexed':
+            self.rows = IndexedCSV(filename, encoding=encoding, cache=cache)
+            self.addresses = self.firstline_addresses = self.firstline_templates = None
+            return
+        self.rows = None
         # load in all addresses for random-access
-        addresses = tuple(csv.DictReader(open(filename)))
-        self.addresses = tuple(translateIn(address) for address in addresses)
+        key = 'AddressBuilder:{0}:{1!r}'.format(encoding, sorted(incoming_filter('OutlookCSV').items()))
+        table = lookupcache.load(filename, key=key, build=self._parse, use_cache=cache)
+        # keep the lookup rows as compact records rather than a dict apiece
+        address_record = record_class(table.fields, name='AddressRecord')
+        self.addresses = tuple(address_record(address) for address in table.rows)
+        # rows worth obfuscating: those with a first line of address
+        self.firstline_addresses = tuple(address for address in self.addresses
+                                         if address[self.firstline_field])
+        # each of their first lines, parsed once
+        self.firstline_templates = tuple(FirstlineTemplate(address[self.firstline_field])
+                                         for address in self.firstline_addresses)
+
+    def _parse(self):
+        """read and translate the source addresses"""
+        with open(self.filename, encoding=self.encoding) as f:
+            addresses = [translateIn(address) for address in csv.DictReader(f)]
+        return lookupcache.LookupTable(addresses[0].keys() if addresses else (), addresses)
 
-    def _address(self):
+    def _address(self, rng=random):
         """generator returning a random address"""
         while True:
-            yield random.choice(self.addresses)
+            if self.rows is not None:
+                yield translateIn(self.rows[rng.randrange(len(self.rows))])
+            else:
+                yield rng.choice(self.addresses)
 
-    def obfuscated_address(self):
-        while 1:
-            address = next(self._address())
-            if address[self.firstline_field]:
-                break
-        address[self.firstline_field] = self.obfuscated_firstline(address)
+    def _indexed_firstline_address(self, rng):
+        """(translated address, first line template) for a random row with a first line of address"""
+        if len(self.rows):
+            for i in range(self.MAX_INDEXED_TRIES):
+                address = translateIn(self.rows[rng.randrange(len(self.rows))])
+                if address.get(self.firstline_field):
+                    return address, FirstlineTemplate(address[self.firstline_field])
+        raise LookupBackendException("No addresses with a first line found in {0}".format(self.filename))
+
+    def obfuscated_address(self, rng=random, record_type=dict):
+        """
+        rng: source of random numbers (the random module or a random.Random instance)
+        record_type: type of the address returned, e.g. dict or a compact record class
+        """
+        if self.rows is not None:
+            address, template = self._indexed_firstline_address(rng)
+            address = record_type(address)
+            address[self.firstline_field] = template.fill(rng)
+            yield address
+            return
+        # any row with a first line of address, equally likely
+        i = rng.randrange(len(self.firstline_addresses))
+        # obfuscate a copy: the lookup row must stay as loaded for the next pick
+        address = record_type(self.firstline_addresses[i])
+        address[self.firstline_field] = self.firstline_templates[i].fill(rng)
         yield address
-        # return address
-
-    def obfuscated_firstline(self, person):
-        # TODO: deal with '12-15 Collins Street' where numbers should be similar in size
-        # (not translated into 5-143 Collins Street)
-        firstline = re.split('(^[0-9]+)', person[self.firstline_field])
-        if len(firstline) != 1:
-            for el in firstline:
-                # every number that isn't a house number (street no, Level, flat etc.) is
-                # replaced by a small number
-                if el.isdigit(): el = str(random.randint(1, 5))
-            if firstline[0] == '':
-                # Initial number: choose from larger range for house numbers, including odd and even
-                # TODO: normal distribution?
-                firstline[1] = str(random.randint(0, 75) * 3 + 1)
-        return "".join(firstline)
+
+    def obfuscated_addresses(self, n, rng=None, start=0):
+        """
+        n obfuscated addresses in one batch, as a dict of columns (one list per field)
+        Rows are picked in a single draw and the shared lookup rows are left untouched
+
+        rng: a CounterRandom to draw from, making the batch repeatable: row i then holds
+        the address obfuscated_address(rng) gives record start + i
+        """
+        if rng is not None:
+            return self._seeded_obfuscated_addresses(n, rng, start)
+        if self.rows is not None:
+            picked = [self._indexed_firstline_address(random) for i in range(n)]
+            fields = picked[0][0].keys() if picked else ()
+            columns = {field: [address[field] for address, template in picked] for field in fields}
+            columns[self.firstline_field] = [template.fill(random) for address, template in picked]
+            return columns
+        picked = random.choices(range(len(self.firstline_addresses)), k=n)
+        houses = [FirstlineTemplate.house_number() for i in range(n)]
+        fields = self.firstline_addresses[0].keys() if self.firstline_addresses else ()
+        columns = {field: [self.firstline_addresses[i][field] for i in picked] for field in fields}
+        templates = self.firstline_templates
+        columns[self.firstline_field] = [templates[i].fill(random, house) for i, house in zip(picked, houses)]
+        return columns
+
+    def _seeded_obfuscated_addresses(self, n, rng, start):
+        # each stage of obfuscated_address() as a column: the picks, then house numbers, then small numbers
+        draws = rng.batch(start, n)
+        if self.rows is not None:
+            picked = self._drawn_indexed_addresses(draws)
+            fields = picked[0][0].keys() if picked else ()
+            columns = {field: [address[field] for address, template in picked] for field in fields}
+            templates = [template for address, template in picked]
+        else:
+            picked = draws.randbelow(len(self.firstline_addresses))
+            fields = self.firstline_addresses[0].keys() if self.firstline_addresses else ()
+            columns = {field: [self.firstline_addresses[i][field] for i in picked] for field in fields}
+            templates = [self.firstline_templates[i] for i in picked]
+        numbered = [j for j, template in enumerate(templates) if template.slots]
+        houses = FirstlineTemplate.house_numbers(draws, numbered)
+        smalls = {j: [] for j in numbered}
+        for slot in range(max((template.small_slots for template in templates), default=0)):
+            rows = [j for j in numbered if templates[j].small_slots > slot]
+            for j, small in zip(rows, draws.randints(1, 5, rows)):
+                smalls[j].append(small)
+        lines = [template.line for template in templates]
+        for j, house in zip(numbered, houses):
+            lines[j] = templates[j].filled(house, smalls[j])
+        columns[self.firstline_field] = lines
+        return columns
+
+    def _drawn_indexed_addresses(self, draws):
+        """
+        _indexed_firstline_address() for each record of a CounterBatch:
+        all the rows are picked at once, then only the records whose row had no first line pick again
+        """
+        picked = [None] * len(draws)
+        pending = list(range(len(draws)))
+        for attempt in range(self.MAX_INDEXED_TRIES if len(self.rows) else 0):
+            if not pending:
+                break
+            rejected = []
+            for j, i in zip(pending, draws.randbelow(len(self.rows), pending)):
+                address = translateIn(self.rows[i])
+                if address.get(self.firstline_field):
+                    picked[j] = address, FirstlineTemplate(address[self.firstline_field])
+                else:
+                    rejected.append(j)
+            pending = rejected
+        if pending:
+            raise LookupBackendException("No addresses with a first line found in {0}".format(self.filename))
+        return picked
+
+    def obfuscated_firstline(self, person, rng=random):
+        """first line of person's address, with its numbers obfuscated"""
+        return FirstlineTemplate(person[self.firstline_field]).fill(rng)
 
 
 if __name__ == '__main__':
     n = AddressBuilder()
     for i in range(5):
         print(n.obfuscated_address())
-
-
-
@@ -0,0 +1,321 @@
+"""
+Benchmarks
+
+Records per second and peak memory for each stage of generation and each output format
+(and, for output, bytes on disk), plus cold-start time (importing and constructing RandomContact).
+
+    python -m benchmark                                  run everything, print a table
+    python -m benchmark --sizes 1000 100000              choose the sizes
+    python -m benchmark --only contact save_csv          choose the benchmarks
+    python -m benchmark --output results.json            save results
+    python -m benchmark --baseline baseline.json         compare against saved results:
+                                                         exits 1 on a regression
+
+Each benchmark runs in a fresh process, so peak memory (max RSS) belongs to that
+benchmark alone and earlier runs can't warm caches for later ones.
+A regression is a throughput or cold-start time more than --tolerance (default 25%)
+worse than the baseline, or a rise in memory of more than the tolerance plus 1 MB.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import importlib.util
+import subprocess
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows: memory is not measured
+    resource = None
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+DEFAULT_TOLERANCE = 0.25
+COLD_START_RUNS = 5
+MEMORY_SLACK_KB = 1024
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """
+    register a benchmark: a function taking a record count n that does any setup
+    and returns a function generating (or translating, or writing) n records
+    """
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+@benchmark('weighted_name')
+def weighted_name(n):
+    from weighted import WeightedChoice
+    from filelinks import lookup_file
+    surnames = WeightedChoice(lookup_file("surnames.csv"), name_field="surname")
+
+    def run():
+        for i in range(n):
+            surnames.name()
+    return run
+
+
+@benchmark('birthday')
+def birthday(n):
+    from dates import birthday
+
+    def run():
+        for i in range(n):
+            birthday()
+    return run
+
+
+@benchmark('obfuscated_address')
+def obfuscated_address(n):
+    from addressbuilder import AddressBuilder
+    address_builder = AddressBuilder()
+
+    def run():
+        for i in range(n):
+            next(address_builder.obfuscated_address())
+    return run
+
+
+@benchmark('obfuscated_address_indexed')
+def obfuscated_address_indexed(n):
+    from addressbuilder import AddressBuilder
+    address_builder = AddressBuilder(backend='indexed')
+
+    def run():
+        for i in range(n):
+            next(address_builder.obfuscated_address())
+    return run
+
+
+@benchmark('contact')
+def contact(n):
+    from randomcontact import RandomContact
+    contacts = RandomContact(seed=1).contact()
+
+    def run():
+        for i in range(n):
+            next(contacts)
+    return run
+
+
+@benchmark('records')
+def records(n):
+    from randomcontact import RandomContact
+    random_contact = RandomContact(seed=1)
+
+    def run():
+        for person in random_contact.records(0, n):
+            pass
+    return run
+
+
+@benchmark('contact_batch')
+def contact_batch(n):
+    from randomcontact import RandomContact
+    random_contact = RandomContact(seed=1)
+
+    def run():
+        # the same contacts as records(0, n), a column at a time
+        random_contact.contact_batch(n, start=0)
+    return run
+
+
+@benchmark('translate_in')
+def translate_in(n):
+    import csv
+    from fieldmap import translateIn
+    from filelinks import lookup_file
+    with open(lookup_file("Addresses.csv"), encoding='cp1252') as f:
+        rows = list(csv.DictReader(f))
+
+    def run():
+        for i in range(n):
+            translateIn(rows[i % len(rows)])
+    return run
+
+
+@benchmark('translate_out')
+def translate_out(n):
+    from fieldmap import translateOut
+    from randomcontact import RandomContact
+    people = list(RandomContact(seed=1).records(0, 1000))
+
+    def run():
+        for i in range(n):
+            translateOut(people[i % len(people)])
+    return run
+
+
+def save(output_filetype, suffix, compression=None):
+    def setup(n):
+        from output import Output
+
+        def run():
+            """returns the bytes written"""
+            fd, output_filename = tempfile.mkstemp(suffix=suffix)
+            os.close(fd)
+            files = [output_filename]
+            try:
+                files = Output.save(n, output_filename, output_filetype=output_filetype, seed=1,
+                                    compression=compression)
+                return sum(os.path.getsize(filename) for filename in files)
+            finally:
+                for filename in set(files) | {output_filename}:
+                    if os.path.exists(filename):
+                        os.unlink(filename)
+        return run
+    return setup
+
+
+benchmark('save_csv')(save('csv', '.csv'))
+benchmark('save_yaml')(save('django_yaml_fixture', '.yaml'))
+benchmark('save_sqlite')(save('sqlite', '.db'))
+benchmark('save_postgres_copy')(save('postgres_copy', '.sql'))
+benchmark('save_columnar')(save('columnar', '.dgc'))
+benchmark('save_csv_gzip')(save('csv', '.csv', 'gzip'))
+benchmark('save_yaml_gzip')(save('django_yaml_fixture', '.yaml', 'gzip'))
+if importlib.util.find_spec('zstandard'):
+    benchmark('save_csv_zstd')(save('csv', '.csv', 'zstd'))
+
+
+@benchmark('schema_order')
+def schema_order(n):
+    import schema
+    plan = schema.compile_schema(schema.load_schemas()['order'], 'order', seed=1)
+
+    def run():
+        for row in plan.rows(n):
+            pass
+    return run
+
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def run_one(name, n):
+    """run one benchmark in this process; returns its measurements"""
+    run = BENCHMARKS[name](n)
+    start_rss = max_rss_kb()
+    start = time.perf_counter()
+    bytes_written = run()
+    elapsed = time.perf_counter() - start
+    peak_rss = max_rss_kb()
+    return {'seconds': elapsed,
+            'records_per_second': n / elapsed if elapsed else None,
+            'peak_rss_kb': peak_rss,
+            'rss_growth_kb': None if peak_rss is None else peak_rss - start_rss,
+            'bytes_written': bytes_written}
+
+
+def child(args):
+    """run a child process; returns its (JSON) output"""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__)] + args,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode())
+
+
+def cold_start():
+    """median time to import RandomContact and to construct one, each in a fresh process"""
+    code = ("import time; start = time.perf_counter(); "
+            "from randomcontact import RandomContact; imported = time.perf_counter(); "
+            "RandomContact(); constructed = time.perf_counter(); "
+            "print('[%r, %r]' % (imported - start, constructed - imported))")
+    runs = [json.loads(subprocess.check_output([sys.executable, '-c', code],
+                                               cwd=os.path.dirname(os.path.abspath(__file__))).decode())
+            for i in range(COLD_START_RUNS)]
+    imports = sorted(r[0] for r in runs)
+    constructs = sorted(r[1] for r in runs)
+    return {'import_seconds': imports[len(imports) // 2],
+            'construct_seconds': constructs[len(constructs) // 2]}
+
+
+def run_all(names, sizes, report=print):
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'results': {},
+               'cold_start': None}
+    for name in names:
+        results['results'][name] = {}
+        for n in sizes:
+            measured = child(['--child', name, str(n)])
+            results['results'][name][str(n)] = measured
+            report("{0:20s} {1:>9d} {2:>12.0f} rec/s {3:>10} KB peak{4}".format(
+                name, n, measured['records_per_second'] or 0, measured['peak_rss_kb'],
+                '' if measured.get('bytes_written') is None else
+                " {0:>12d} bytes".format(measured['bytes_written'])))
+    results['cold_start'] = cold_start()
+    report("cold start: import {0:.1f} ms, RandomContact() {1:.1f} ms".format(
+        results['cold_start']['import_seconds'] * 1000, results['cold_start']['construct_seconds'] * 1000))
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """list of regressions (as messages) in results against baseline"""
+    regressions = []
+    for name, by_size in results['results'].items():
+        for n, measured in by_size.items():
+            base = baseline.get('results', {}).get(name, {}).get(n)
+            if not base:
+                continue
+            if (base['records_per_second'] and measured['records_per_second'] is not None
+                    and measured['records_per_second'] < base['records_per_second'] * (1 - tolerance)):
+                regressions.append("{0} ({1}): {2:.0f} records/s, baseline {3:.0f}".format(
+                    name, n, measured['records_per_second'], base['records_per_second']))
+            if (base.get('rss_growth_kb') is not None and measured.get('rss_growth_kb') is not None
+                    and measured['rss_growth_kb'] > base['rss_growth_kb'] * (1 + tolerance) + MEMORY_SLACK_KB):
+                regressions.append("{0} ({1}): memory grew {2} KB, baseline {3} KB".format(
+                    name, n, measured['rss_growth_kb'], base['rss_growth_kb']))
+    base_start = baseline.get('cold_start') or {}
+    for measure in ('import_seconds', 'construct_seconds'):
+        if measure in base_start and results.get('cold_start'):
+            if results['cold_start'][measure] > base_start[measure] * (1 + tolerance):
+                regressions.append("cold start {0}: {1:.1f} ms, baseline {2:.1f} ms".format(
+                    measure, results['cold_start'][measure] * 1000, base_start[measure] * 1000))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataGen benchmarks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--output', help="save results to this JSON file")
+    parser.add_argument('--baseline', help="compare with results saved in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--child', nargs=2, metavar=('BENCHMARK', 'N'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        print(json.dumps(run_one(args.child[0], int(args.child[1]))))
+        return 0
+    results = run_all(args.only, args.sizes)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            return 1
+        print("no regressions against " + args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+"""
+Checkpointed generation
+
+A long job (hundreds of millions of records) is written as a series of part files
+of part_rows records each, with a manifest beside them recording, for each finished
+part, its range of records, the seed and its checksum. If the job dies, resume_job
+picks up after the last finished part: parts whose file is missing or doesn't match
+its checksum are made again, from there on.
+
+    run_job(500000000, 'people.csv', 'csv', part_rows=1000000, seed=42)
+    resume_job('people.csv.manifest.json')
+
+    python -m checkpoint run 500000000 people.csv --format csv --seed 42
+    python -m checkpoint resume people.csv.manifest.json
+
+Records are a function of the seed and their record number (see randomcontact.py), so
+a part made again, or made on resume, is the same as in an uninterrupted run; merged
+(merge_parts=True, as Output.merge), the parts are the file Output.save(n, seed=seed)
+writes. part_bytes sizes parts by bytes instead: part_rows is worked out once from a
+sample, and kept in the manifest, so parts break at the same records on resume.
+Parts are only approximately part_bytes long: they are cut at record boundaries, after
+the number of records the sample suggests, so a part can come out a little over or under.
+
+compression ('gzip' or 'zstd', as for Output.save) is kept in the manifest and applies
+to every part: text formats are compressed as the part is written, SQLite and columnar
+parts once it is finished. part_bytes then counts compressed bytes.
+
+Progress (records and parts done, records per second, time to go) is passed to
+progress(report) after each part; the command line prints it.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+import multiprocessing
+
+from output import Output
+import compressed
+from fileio import atomic_write
+from exceptions import NegSampleSizeException
+
+MANIFEST_VERSION = 1
+DEFAULT_PART_ROWS = 1000000
+# records written to estimate part_rows from part_bytes
+SAMPLE_ROWS = 1000
+
+
+def manifest_filename(output_filename):
+    return output_filename + '.manifest.json'
+
+
+def file_checksum(filename):
+    """'sha256:' and the hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return 'sha256:' + digest.hexdigest()
+
+
+def read_manifest(filename):
+    with open(filename) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("{0} is not a version {1} job manifest".format(filename, MANIFEST_VERSION))
+    return manifest
+
+
+def write_manifest(filename, manifest):
+    """write the manifest whole or not at all, so a job dying mid-write leaves the last one"""
+    with atomic_write(filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def split_compression(output_filetype, compression):
+    """(compression as parts are written, compression once they are finished), as Output.save does"""
+    if output_filetype in Output.COMPRESSED_AFTER:
+        return None, compression
+    return compression, None
+
+
+def sample_part_rows(output_filetype, part_bytes, seed, yaml_entity, sql_table, compression=None,
+                     compression_level=None):
+    """records per part making parts of about part_bytes (compressed, if compression), from the size of a sample"""
+    streamed, compress_after = split_compression(output_filetype, compression)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filename = compressed.compressed_filename(os.path.join(tmp_dir, 'sample'), streamed)
+        filename, checksum, size = _make_part(((0, SAMPLE_ROWS, filename, output_filetype, yaml_entity, 1, 1, seed,
+                                                None, sql_table, streamed, compression_level),
+                                               compress_after, compression_level))
+    return max(1, int(part_bytes * SAMPLE_ROWS / float(size)))
+
+
+def new_manifest(no_of_people, output_filename, output_filetype='csv', part_rows=DEFAULT_PART_ROWS,
+                 part_bytes=None, seed=None, yaml_entity='Customer', id_start=1, id_step=1, sql_table='customer',
+                 compression=None, compression_level=None):
+    """the manifest of a job not yet started: its parameters, and no parts done"""
+    if no_of_people <= 0:
+        raise NegSampleSizeException("Can't generate zero or negative sample sizes! (n = %d)" % (no_of_people))
+    Output.require_filetype(output_filetype)
+    if compression:
+        compressed.require_compression(compression)
+        output_filename = compressed.uncompressed_filename(output_filename, compression)
+    if seed is None:
+        # the seed is kept in the manifest, so resumed parts match
+        seed = random.SystemRandom().getrandbits(64)
+    if part_bytes:
+        part_rows = sample_part_rows(output_filetype, part_bytes, seed, yaml_entity, sql_table, compression,
+                                     compression_level)
+    return {'version': MANIFEST_VERSION,
+            'output_filename': os.path.abspath(output_filename),
+            'output_filetype': output_filetype,
+            'rows': no_of_people,
+            'part_rows': part_rows,
+            'seed': seed,
+            'yaml_entity': yaml_entity,
+            'id_start': id_start,
+            'id_step': id_step,
+            'sql_table': sql_table,
+            'compression': compression,
+            'compression_level': compression_level,
+            'parts': [],
+            'complete': False,
+            'merged': False}
+
+
+def part_jobs(manifest, first_part):
+    """
+    the parts from first_part on, as (Output._save_shard spec, compression once written,
+    compression level) for _make_part
+    """
+    part_rows = manifest['part_rows']
+    # manifests written before compression was recorded have none
+    compression_level = manifest.get('compression_level')
+    streamed, compress_after = split_compression(manifest['output_filetype'], manifest.get('compression'))
+    jobs = []
+    for part_no in range((manifest['rows'] + part_rows - 1) // part_rows):
+        first_record = part_no * part_rows
+        if part_no < first_part:
+            continue
+        filename = compressed.compressed_filename(Output.part_filename(manifest['output_filename'], part_no),
+                                                  streamed)
+        jobs.append(((first_record, min(part_rows, manifest['rows'] - first_record), filename,
+                      manifest['output_filetype'], manifest['yaml_entity'],
+                      manifest['id_start'] + first_record * manifest['id_step'], manifest['id_step'],
+                      manifest['seed'], None, manifest['sql_table'], streamed, compression_level),
+                     compress_after, compression_level))
+    return jobs
+
+
+def finished_parts(manifest):
+    """the parts recorded as done whose files are still there and intact, up to the first that isn't"""
+    parts = []
+    for part in manifest['parts']:
+        if not os.path.isfile(part['file']) or file_checksum(part['file']) != part['checksum']:
+            break
+        parts.append(part)
+    return parts
+
+
+def _make_part(job):
+    spec, compress_after, compression_level = job
+    filename, shard_stats = Output._save_shard(spec)
+    if compress_after:
+        filename = compressed.compress_file(filename, compress_after, compression_level)
+    return filename, file_checksum(filename), os.path.getsize(filename)
+
+
+def merge_parts_of(manifest):
+    """merge a job's finished parts into its output file; returns the file's name"""
+    files = [part['file'] for part in manifest['parts']]
+    compression_level = manifest.get('compression_level')
+    streamed, compress_after = split_compression(manifest['output_filetype'], manifest.get('compression'))
+    if compress_after:
+        # binary formats are merged table to table: the parts must be uncompressed first
+        files = [compressed.decompress_file(filename, compress_after) for filename in files]
+    output_filename = compressed.compressed_filename(manifest['output_filename'], streamed)
+    Output.merge(files, output_filename, manifest['output_filetype'], manifest['sql_table'], streamed,
+                 compression_level)
+    if compress_after:
+        output_filename = compressed.compress_file(output_filename, compress_after, compression_level)
+    return output_filename
+
+
+def run_manifest(filename, manifest, processes=1, progress=None, merge_parts=False):
+    """
+    make the parts of a job not yet done, recording each in the manifest as it finishes
+    returns the manifest
+    """
+    if manifest['merged']:
+        # done, and the parts merged away
+        return manifest
+    manifest['parts'] = finished_parts(manifest)
+    manifest['complete'] = False
+    write_manifest(filename, manifest)
+    jobs = part_jobs(manifest, len(manifest['parts']))
+    total_parts = len(manifest['parts']) + len(jobs)
+    rows_before = sum(part['rows'] for part in manifest['parts'])
+    started = time.perf_counter()
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        # parts come back in order, so the manifest only ever records an unbroken run of parts
+        made = pool.imap(_make_part, jobs) if pool else map(_make_part, jobs)
+        for (spec, compress_after, compression_level), (part_file, checksum, size) in zip(jobs, made):
+            first_record, rows = spec[:2]
+            manifest['parts'].append({'part': len(manifest['parts']),
+                                      'first_record': first_record,
+                                      'rows': rows,
+                                      'seed': manifest['seed'],
+                                      'file': part_file,
+                                      'bytes': size,
+                                      'checksum': checksum})
+            write_manifest(filename, manifest)
+            if progress is not None:
+                progress(progress_report(manifest, total_parts, rows_before, started))
+    except BaseException:
+        if pool is not None:
+            # don't wait for the parts still being made: they'd be made again on resume anyway
+            pool.terminate()
+        raise
+    if pool is not None:
+        pool.close()
+        pool.join()
+    manifest['complete'] = True
+    write_manifest(filename, manifest)
+    if merge_parts and not manifest['merged']:
+        manifest['merged_file'] = merge_parts_of(manifest)
+        manifest['merged'] = True
+        write_manifest(filename, manifest)
+    return manifest
+
+
+def progress_report(manifest, total_parts, rows_before, started):
+    """how far a job has got; rates are of this run (since it started or resumed)"""
+    rows_done = sum(part['rows'] for part in manifest['parts'])
+    elapsed = time.perf_counter() - started
+    rate = (rows_done - rows_before) / elapsed if elapsed > 0 else 0.0
+    return {'rows_done': rows_done,
+            'rows': manifest['rows'],
+            'parts_done': len(manifest['parts']),
+            'parts': total_parts,
+            'bytes_written': sum(part['bytes'] for part in manifest['parts']),
+            'elapsed_seconds': elapsed,
+            'rows_per_second': rate,
+            'eta_seconds': (manifest['rows'] - rows_done) / rate if rate else None}
+
+
+def run_job(no_of_people, output_filename, output_filetype='csv', part_rows=DEFAULT_PART_ROWS, part_bytes=None,
+            seed=None, processes=1, progress=None, merge_parts=False, yaml_entity='Customer', id_start=1, id_step=1,
+            sql_table='customer', compression=None, compression_level=None):
+    """
+    start a checkpointed job (any job already recorded for output_filename is started again)
+    output_filetype, compression etc.: as for Output.save
+    part_rows: records per part file; or part_bytes: about this many bytes per part file
+    (approximately: parts are cut at record boundaries)
+    progress: called with a progress report (a dict) after each part
+    merge_parts: merge the parts into output_filename at the end (as Output.save does)
+
+    returns the manifest (also saved as manifest_filename(output_filename), less any compression suffix)
+    """
+    manifest = new_manifest(no_of_people, output_filename, output_filetype, part_rows, part_bytes, seed,
+                            yaml_entity, id_start, id_step, sql_table, compression, compression_level)
+    return run_manifest(manifest_filename(manifest['output_filename']), manifest, processes, progress, merge_parts)
+
+
+def resume_job(filename, processes=1, progress=None, merge_parts=False):
+    """carry on with the job recorded in the manifest filename; returns the manifest"""
+    return run_manifest(filename, read_manifest(filename), processes, progress, merge_parts)
+
+
+def print_progress(report, out=sys.stdout):
+    eta = report['eta_seconds']
+    out.write("part {parts_done}/{parts}: {rows_done}/{rows} records, {rate:.0f} records/s, {eta}\n".format(
+        rate=report['rows_per_second'], eta='done' if eta is None or not eta else '{0:.0f}s to go'.format(eta),
+        **report))
+    out.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate contacts as checkpointed, resumable part files")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="start a job")
+    run.add_argument('rows', type=int)
+    run.add_argument('output', help="output file: parts are numbered from it (people-0000.csv...)")
+    run.add_argument('--format', default='csv', help="output file type, as for Output.save (default csv)")
+    run.add_argument('--part-rows', type=int, default=DEFAULT_PART_ROWS)
+    run.add_argument('--part-bytes', type=int, help="size parts by (about this many) bytes instead of records")
+    run.add_argument('--seed', type=int)
+    run.add_argument('--compression', choices=sorted(compressed.SUFFIXES))
+    run.add_argument('--compression-level', type=int)
+    resume = commands.add_parser('resume', help="carry on with a job after its last finished part")
+    resume.add_argument('manifest')
+    for command in (run, resume):
+        command.add_argument('--processes', type=int, default=1)
+        command.add_argument('--merge', action='store_true', help="merge the parts into one file at the end")
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run_job(args.rows, args.output, args.format, args.part_rows, args.part_bytes, args.seed, args.processes,
+                print_progress, args.merge, compression=args.compression, compression_level=args.compression_level)
+    else:
+        resume_job(args.manifest, args.processes, print_progress, args.merge)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
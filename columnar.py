@@ -0,0 +1,290 @@
+"""
+Columnar output
+
+Names, suburbs, states and postcodes are drawn from small lookup tables, so most cells of
+a generated file repeat one of a few thousand strings. A columnar file stores each distinct
+value of a column once per row group and each cell as a small integer code, so files are
+several times smaller than CSV, and quicker to write and to read back.
+
+Two formats:
+
+'columnar' (native, no dependencies): ColumnarWriter / ColumnarReader
+'parquet' (needs pyarrow): ParquetWriter / parquet_row_groups; dictionary-encoded columns
+
+Readers stream: a row group at a time (as columns), or a row at a time (as dicts).
+
+Native file layout (little-endian):
+
+    magic           b'DGCOLS01'
+    header          uint32 length, then JSON: {"columns": [...], "pk_column": "id"}
+    row groups      until the end of the file, each:
+        b'RG', uint32 number of rows, uint32 length of the body, then the body,
+        zlib-compressed:
+            primary keys        int64 per row
+            for each column:
+                dictionary      uint32 number of values, uint32 offsets of each value in the
+                                text (plus an end offset), then the values' UTF-8 text
+                codes           uint8 code width (1, 2 or 4 bytes), then a code per row:
+                                0 for a missing value (None), i for the ith dictionary value
+
+Each row group is self-contained (its own dictionaries), so files made in parts (e.g. by
+parallel shards) are merged by appending the row groups of one to another.
+"""
+
+import json
+import zlib
+import struct
+import itertools
+from array import array
+
+from fileio import little_endian, from_little_endian
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet output is not available
+    pyarrow = None
+
+MAGIC = b'DGCOLS01'
+GROUP_TAG = b'RG'
+GROUP_HEADER = struct.Struct('<2sII')
+UINT32 = struct.Struct('<I')
+DEFAULT_GROUP_ROWS = 10000
+# array typecodes for each code width
+CODE_TYPES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+class ColumnarWriter:
+    """
+    write records to an open binary file in the native columnar format, e.g.
+
+        writer = ColumnarWriter(outputfile, ['First name', 'Last Name', ...])
+        writer.write(pk, fields)
+        ...
+        writer.close()
+
+    Same interface as FixtureWriter; a row group is written every group_rows records.
+    Fields missing from a record are stored as missing (read back as None)
+    """
+
+    def __init__(self, outputfile, columns, pk_column='id', group_rows=DEFAULT_GROUP_ROWS, compression_level=1):
+        self.outputfile = outputfile
+        self.columns = tuple(columns)
+        self.group_rows = group_rows
+        self.compression_level = compression_level
+        self.rows_written = 0
+        self._start_group()
+        header = json.dumps({'columns': list(self.columns), 'pk_column': pk_column}).encode()
+        self.outputfile.write(MAGIC + UINT32.pack(len(header)) + header)
+
+    def _start_group(self):
+        self.pks = array('q')
+        # values in column order, a tuple per record
+        self.rows = []
+
+    def write(self, pk, fields):
+        """add one record: pk (primary key) and a dict of field values"""
+        self.pks.append(pk)
+        self.rows.append(tuple(map(fields.get, self.columns)))
+        if len(self.rows) >= self.group_rows:
+            self.flush()
+
+    def flush(self):
+        """write the records so far as a row group"""
+        n = len(self.rows)
+        if not n:
+            return
+        body = [little_endian(self.pks)]
+        for values in zip(*self.rows):
+            # distinct values in order of first appearance, then each value's code
+            distinct = dict.fromkeys(values)
+            distinct.pop(None, None)
+            codes = {value: code for code, value in enumerate(distinct, 1)}
+            codes[None] = 0
+            encoded = [str(value).encode('utf-8') for value in distinct]
+            offsets = array('I', itertools.accumulate(map(len, encoded), initial=0))
+            body.append(UINT32.pack(len(encoded)))
+            body.append(little_endian(offsets))
+            body.append(b''.join(encoded))
+            width = 1 if len(codes) <= 0xff else 2 if len(codes) <= 0xffff else 4
+            body.append(bytes([width]))
+            body.append(little_endian(array(CODE_TYPES[width], map(codes.__getitem__, values))))
+        compressed = zlib.compress(b''.join(body), self.compression_level)
+        self.outputfile.write(GROUP_HEADER.pack(GROUP_TAG, n, len(compressed)) + compressed)
+        self.rows_written += n
+        self._start_group()
+
+    def close(self):
+        """write out any buffered records (the file is left open)"""
+        self.flush()
+
+    @staticmethod
+    def merge(part_files, outputfile):
+        """append the row groups of part_files in order to an open binary file (the first part's header is kept)"""
+        for part_no, part_file in enumerate(part_files):
+            with open(part_file, 'rb') as part:
+                header = part.read(len(MAGIC) + UINT32.size)
+                header += part.read(UINT32.unpack_from(header, len(MAGIC))[0])
+                if not part_no:
+                    outputfile.write(header)
+                for block in iter(lambda: part.read(1 << 20), b''):
+                    outputfile.write(block)
+
+
+class ColumnarReader:
+    """
+    read a native columnar file as it streams in:
+
+        with ColumnarReader(filename) as reader:
+            for row in reader:                          # a dict per record, primary key included
+                ...
+            for pks, columns in reader.row_groups():    # or a row group at a time, as columns
+                ...
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'rb')
+        magic = self.file.read(len(MAGIC))
+        if magic != MAGIC:
+            self.file.close()
+            raise ValueError("{0} is not a columnar file".format(filename))
+        header = json.loads(self.file.read(UINT32.unpack(self.file.read(UINT32.size))[0]).decode())
+        self.columns = tuple(header['columns'])
+        self.pk_column = header['pk_column']
+
+    def row_groups(self):
+        """(primary keys, dict of column: values) for each row group in turn"""
+        while True:
+            group_header = self.file.read(GROUP_HEADER.size)
+            if not group_header:
+                return
+            tag, n, length = GROUP_HEADER.unpack(group_header)
+            if tag != GROUP_TAG:
+                raise ValueError("corrupt columnar file: bad row group at byte {0}".format(
+                    self.file.tell() - GROUP_HEADER.size))
+            body = memoryview(zlib.decompress(self.file.read(length)))
+            position = 8 * n
+            pks = from_little_endian('q', body[:position]).tolist()
+            columns = {}
+            for column in self.columns:
+                n_values = UINT32.unpack_from(body, position)[0]
+                position += UINT32.size
+                offsets = from_little_endian('I', body[position:position + 4 * (n_values + 1)])
+                position += 4 * (n_values + 1)
+                text = bytes(body[position:position + offsets[-1]])
+                position += offsets[-1]
+                values = [None] + [text[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(n_values)]
+                width = body[position]
+                position += 1
+                codes = from_little_endian(CODE_TYPES[width], body[position:position + width * n])
+                position += width * n
+                columns[column] = [values[code] for code in codes]
+            yield pks, columns
+
+    def __iter__(self):
+        names = (self.pk_column,) + self.columns
+        for pks, columns in self.row_groups():
+            for row in zip(pks, *[columns[column] for column in self.columns]):
+                yield dict(zip(names, row))
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_columnar(filename):
+    """each record of a native columnar file, as a dict"""
+    with ColumnarReader(filename) as reader:
+        for row in reader:
+            yield row
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("Parquet output needs pyarrow (pip install pyarrow)")
+
+
+class ParquetWriter:
+    """
+    write records to a Parquet file with pyarrow: string columns, dictionary-encoded,
+    a row group every group_rows records. Same interface as ColumnarWriter, but takes a filename
+    """
+
+    def __init__(self, filename, columns, pk_column='id', group_rows=DEFAULT_GROUP_ROWS):
+        require_pyarrow()
+        self.columns = tuple(columns)
+        self.pk_column = pk_column
+        self.group_rows = group_rows
+        self.schema = pyarrow.schema([(pk_column, pyarrow.int64())] +
+                                     [(column, pyarrow.string()) for column in self.columns])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, use_dictionary=True)
+        self.rows_written = 0
+        self._start_group()
+
+    def _start_group(self):
+        self.pks = []
+        self.values = [[] for column in self.columns]
+
+    def write(self, pk, fields):
+        self.pks.append(pk)
+        get = fields.get
+        for column, values in zip(self.columns, self.values):
+            values.append(get(column))
+        if len(self.pks) >= self.group_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.pks:
+            return
+        self.write_table(pyarrow.table([self.pks] + self.values, schema=self.schema))
+        self.rows_written += len(self.pks)
+        self._start_group()
+
+    def write_table(self, table):
+        self.writer.write_table(table, row_group_size=self.group_rows)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    @staticmethod
+    def merge(part_files, filename):
+        """copy the row groups of part_files in order into one Parquet file"""
+        require_pyarrow()
+        writer = None
+        try:
+            for part_file in part_files:
+                part = pyarrow.parquet.ParquetFile(part_file)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(filename, part.schema_arrow, use_dictionary=True)
+                for group in range(part.num_row_groups):
+                    writer.write_table(part.read_row_group(group))
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+def parquet_row_groups(filename):
+    """(primary keys, dict of column: values) for each row group of a Parquet file written by ParquetWriter"""
+    require_pyarrow()
+    parquet_file = pyarrow.parquet.ParquetFile(filename)
+    pk_column = parquet_file.schema_arrow.names[0]
+    for group in range(parquet_file.num_row_groups):
+        columns = parquet_file.read_row_group(group).to_pydict()
+        yield columns.pop(pk_column), columns
+
+
+def read_parquet(filename):
+    """each record of a Parquet file written by ParquetWriter, as a dict"""
+    require_pyarrow()
+    pk_column = pyarrow.parquet.ParquetFile(filename).schema_arrow.names[0]
+    for pks, columns in parquet_row_groups(filename):
+        names = [pk_column] + list(columns)
+        for row in zip(pks, *columns.values()):
+            yield dict(zip(names, row))
@@ -0,0 +1,184 @@
+"""
+Compressed output
+
+Generated files are large and repetitive, so they compress well, and compressing them
+saves more time in writing than it costs, if it doesn't hold up generation.
+CompressedFile cuts what is written into blocks (block_size bytes, default 1 MB) and
+compresses them on a pool of threads, as independent gzip members or zstd frames, while
+generation carries on. zlib and zstd release the GIL while they work, so compression
+runs alongside the generating thread. The blocks are written in order.
+
+A file of gzip members is an ordinary .gz file: gzip, zcat and Python's gzip module read
+it whole. So is a file of zstd frames (zstd needs the zstandard package), and files can be
+joined just by concatenating them.
+
+    with open_output('people.csv.gz', 'gzip') as f:     # text, like open(..., 'w', newline='')
+        f.write(...)
+    with open_input('people.csv.gz', 'gzip') as f:
+        ...
+    compress_file('people.db', 'zstd')                  # people.db.zst; people.db is removed
+    decompress_file('people.db.zst', 'zstd')            # and back
+"""
+
+import io
+import os
+import gzip
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    # zstd compression is not available
+    zstandard = None
+
+# compression: file name suffix
+SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+def require_compression(compression):
+    if compression not in SUFFIXES:
+        raise ValueError("Unknown compression '{0}' (expected one of {1})".format(
+            compression, ', '.join(sorted(SUFFIXES))))
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression needs zstandard (pip install zstandard)")
+
+
+def compressed_filename(filename, compression):
+    """filename with the compression's suffix (if it hasn't one already)"""
+    if not compression:
+        return filename
+    suffix = SUFFIXES[compression]
+    return filename if filename.endswith(suffix) else filename + suffix
+
+
+def uncompressed_filename(filename, compression):
+    """filename without the compression's suffix"""
+    if compression and filename.endswith(SUFFIXES[compression]):
+        return filename[:-len(SUFFIXES[compression])]
+    return filename
+
+
+def default_threads():
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+class CompressedFile(io.BufferedIOBase):
+    """
+    binary file, written through a thread pool a block at a time as independent
+    gzip members or zstd frames; at most 2 blocks per thread are held waiting
+    """
+
+    def __init__(self, filename, compression='gzip', level=None, block_size=DEFAULT_BLOCK_SIZE, threads=None):
+        require_compression(compression)
+        self.file = open(filename, 'wb')
+        self.block_size = block_size
+        self.level = DEFAULT_LEVELS[compression] if level is None else level
+        self.compress = getattr(self, '_' + compression)
+        self.threads = threads or default_threads()
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.in_flight = collections.deque()
+        self.pending = []
+        self.pending_size = 0
+        # zstd compressors can't be shared between threads
+        self.local = threading.local()
+
+    def _gzip(self, data):
+        # mtime=0: the same data always compresses to the same bytes
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def _zstd(self, data):
+        compressor = getattr(self.local, 'compressor', None)
+        if compressor is None:
+            compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor.compress(data)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.pending.append(bytes(data))
+        self.pending_size += len(data)
+        if self.pending_size >= self.block_size:
+            self._submit()
+        return len(data)
+
+    def _submit(self):
+        if not self.pending_size:
+            return
+        block = b''.join(self.pending)
+        self.pending = []
+        self.pending_size = 0
+        self.in_flight.append(self.executor.submit(self.compress, block))
+        while len(self.in_flight) > 2 * self.threads:
+            self.file.write(self.in_flight.popleft().result())
+
+    def flush(self):
+        # blocks are only cut at block_size (and on close): small blocks would compress badly
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._submit()
+            while self.in_flight:
+                self.file.write(self.in_flight.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True)
+            self.file.close()
+            super().close()
+
+
+def open_output(filename, compression=None, level=None, binary=False, encoding=None, threads=None):
+    """
+    a file to write filename with: if compression ('gzip' or 'zstd') is given, a CompressedFile;
+    text (newline='', as the writers expect) unless binary
+    """
+    if not compression:
+        return open(filename, 'wb') if binary else open(filename, 'w', encoding=encoding, newline='')
+    compressed = CompressedFile(filename, compression, level, threads=threads)
+    return compressed if binary else io.TextIOWrapper(compressed, encoding=encoding, newline='')
+
+
+def open_input(filename, compression=None, binary=False, encoding=None):
+    """a file to read filename (compressed with compression) with"""
+    if not compression:
+        return open(filename, 'rb') if binary else open(filename, encoding=encoding, newline='')
+    require_compression(compression)
+    if compression == 'gzip':
+        raw = gzip.open(filename, 'rb')
+    else:
+        raw = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(filename, 'rb'),
+                                                                           read_across_frames=True,
+                                                                           closefd=True))
+    return raw if binary else io.TextIOWrapper(raw, encoding=encoding, newline='')
+
+
+def compress_file(filename, compression, level=None, remove=True):
+    """compress filename to filename plus the compression's suffix (removing filename); returns the new name"""
+    target = compressed_filename(filename, compression)
+    with open(filename, 'rb') as source, open_output(target, compression, level, binary=True) as destination:
+        for block in iter(lambda: source.read(DEFAULT_BLOCK_SIZE), b''):
+            destination.write(block)
+    if remove:
+        os.unlink(filename)
+    return target
+
+
+def decompress_file(filename, compression, remove=True):
+    """decompress filename to filename without the compression's suffix (removing filename); returns the new name"""
+    target = uncompressed_filename(filename, compression)
+    if target == filename:
+        raise ValueError("{0} has no {1} suffix".format(filename, SUFFIXES[compression]))
+    with open_input(filename, compression, binary=True) as source, open(target, 'wb') as destination:
+        for block in iter(lambda: source.read(DEFAULT_BLOCK_SIZE), b''):
+            destination.write(block)
+    if remove:
+        os.unlink(filename)
+    return target
@@ -0,0 +1,265 @@
+"""
+Contact server
+
+Streams generated contacts to any number of clients (load-test agents, say) from one
+warm generator, so none of them pays the start-up cost of loading the lookups.
+
+    python -m contactserver                       serve on 127.0.0.1:8765
+    python -m contactserver --host 0.0.0.0 --port 9000
+
+One port speaks both plain TCP and HTTP. A TCP client sends one request line and
+reads rows until the server closes the connection:
+
+    rows=1000&format=csv&seed=42
+
+An HTTP client asks for /contacts with the same parameters, and gets a chunked response:
+
+    curl 'http://127.0.0.1:8765/contacts?rows=1000&format=jsonl&rate=200'
+
+Parameters (all optional):
+    format  'jsonl' (default: one JSON object per line) or 'csv' (with a heading row);
+            fields are those of the outgoing filter, as in Output.save
+    rows    number of contacts to send (default: no limit, until the client hangs up)
+    rate    contacts per second (default: as fast as the client reads them)
+    seed    contacts are a repeatable function of seed and record number: the same as
+            RandomContact(seed=seed).records(start, start + rows)
+            (HTTP responses report the seed used in an X-Seed header)
+    start   record number of the first contact (default 0); record numbers stay below
+            2**40, within which usernames are unique (see uniquesuffix.py)
+
+Contacts are generated and serialised in batches on a worker thread, off the event loop,
+one batch ahead of the connection. A client that reads slowly holds up only its own stream:
+nothing more is generated for it until it has taken what was sent.
+"""
+
+import io
+import csv
+import json
+import math
+import random
+import asyncio
+import argparse
+from urllib.parse import parse_qsl, urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+import fieldmap
+from randomcontact import RandomContact
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+FORMATS = ('jsonl', 'csv')
+# record numbers must be below this: usernames are unique only within it (see uniquesuffix.py)
+RECORD_LIMIT = 1 << 40
+
+
+class BadRequest(Exception):
+    pass
+
+
+class StreamRequest:
+    """what a client asked for"""
+
+    def __init__(self, query):
+        params = dict(parse_qsl(query, keep_blank_values=True))
+        unknown = set(params) - {'format', 'rows', 'rate', 'seed', 'start'}
+        if unknown:
+            raise BadRequest("unknown parameter(s): " + ', '.join(sorted(unknown)))
+        self.format = params.get('format', 'jsonl')
+        if self.format not in FORMATS:
+            raise BadRequest("format must be one of " + ', '.join(FORMATS))
+        self.rows = self._number(params, 'rows', int)
+        self.rate = self._number(params, 'rate', float)
+        self.seed = self._number(params, 'seed', int)
+        if self.seed is None:
+            self.seed = random.SystemRandom().getrandbits(64)
+        self.start = self._number(params, 'start', int) or 0
+        if self.start >= RECORD_LIMIT:
+            raise BadRequest("start must be below 2**40")
+        if self.rows is not None and self.start + self.rows > RECORD_LIMIT:
+            raise BadRequest("start + rows must be at most 2**40")
+
+    @staticmethod
+    def _number(params, name, convert):
+        if not params.get(name):
+            return None
+        try:
+            value = convert(params[name])
+        except ValueError:
+            raise BadRequest("{0} must be a number".format(name))
+        if not math.isfinite(value):
+            raise BadRequest("{0} must be finite".format(name))
+        if value < 0:
+            raise BadRequest("{0} can't be negative".format(name))
+        return value
+
+
+class ContactServer:
+    """
+    asyncio server streaming contacts; see the module docstring for the protocol
+
+        server = ContactServer(port=0)
+        await server.start()            # server.port is the port listened on
+        ...
+        await server.stop()
+    """
+
+    # RandomContacts kept ready, by seed
+    MAX_GENERATORS = 64
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, batch_rows=500):
+        self.host = host
+        self.port = port
+        self.batch_rows = batch_rows
+        self.contacts = RandomContact()
+        self.generators = {}
+        self.translator = fieldmap.outgoing_translator(fieldmap.DEFAULT_FILTER)
+        self.csv_header = [external for external in fieldmap.outgoing_filter(fieldmap.DEFAULT_FILTER).values()
+                           if external]
+        # a single worker: RandomContacts aren't shared between threads, and generating
+        # is CPU-bound, so more threads would only contend for the GIL
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    def generator(self, seed):
+        """RandomContact for seed, sharing the warm generator's lookups (called on the worker thread)"""
+        generator = self.generators.pop(seed, None)
+        if generator is None:
+            generator = self.contacts.reseeded(seed)
+            if len(self.generators) >= self.MAX_GENERATORS:
+                del self.generators[next(iter(self.generators))]
+        # most recently used last
+        self.generators[seed] = generator
+        return generator
+
+    def encode_batch(self, request, start, n):
+        """contacts start to start + n - 1 for request, serialised (called on the worker thread)"""
+        people = self.generator(request.seed).records(start, start + n)
+        translator = self.translator
+        rows = [translator.schema(person)(person) for person in people]
+        if request.format == 'jsonl':
+            return ''.join([json.dumps(row) + '\n' for row in rows]).encode()
+        buffer = io.StringIO(newline='')
+        writer = csv.DictWriter(buffer, self.csv_header, extrasaction='ignore')
+        if start == request.start:
+            writer.writeheader()
+        writer.writerows(rows)
+        return buffer.getvalue().encode()
+
+    async def handle(self, reader, writer):
+        try:
+            line = (await reader.readline()).decode('latin-1').strip()
+            http = line.startswith('GET ')
+            try:
+                if http:
+                    while (await reader.readline()).strip():
+                        # HTTP headers: nothing needed from them
+                        pass
+                    url = urlsplit(line.split()[1])
+                    if url.path.rstrip('/') not in ('', '/contacts'):
+                        await self.http_error(writer, '404 Not Found', 'no such path: ' + url.path)
+                        return
+                    query = url.query
+                else:
+                    query = line
+                request = StreamRequest(query)
+            except (BadRequest, IndexError) as e:
+                if http:
+                    await self.http_error(writer, '400 Bad Request', str(e) or 'malformed request')
+                else:
+                    writer.write("ERROR {0}\n".format(e).encode())
+                    await writer.drain()
+                return
+            if http:
+                content_type = 'application/x-ndjson' if request.format == 'jsonl' else 'text/csv'
+                writer.write(("HTTP/1.1 200 OK\r\nContent-Type: {0}\r\nTransfer-Encoding: chunked\r\n"
+                              "X-Seed: {1}\r\nConnection: close\r\n\r\n").format(content_type, request.seed).encode())
+            await self.stream(request, writer, http)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # the client hung up
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def http_error(writer, status, message):
+        body = (message + '\n').encode()
+        writer.write("HTTP/1.1 {0}\r\nContent-Type: text/plain\r\nContent-Length: {1}\r\nConnection: close\r\n\r\n"
+                     .format(status, len(body)).encode() + body)
+        await writer.drain()
+
+    async def stream(self, request, writer, chunked=False):
+        """send request's contacts, one batch generating while the last is sent"""
+        loop = asyncio.get_running_loop()
+        batch_rows = self.batch_rows
+        if request.rate:
+            # at low rates, smaller batches so rows arrive steadily
+            batch_rows = max(1, min(batch_rows, int(request.rate / 10)))
+        end = RECORD_LIMIT if request.rows is None else request.start + request.rows
+        started = loop.time()
+
+        def next_batch(first):
+            n = min(batch_rows, end - first)
+            if n <= 0:
+                return None, first
+            return loop.run_in_executor(self.executor, self.encode_batch, request, first, n), first + n
+
+        first = request.start
+        pending, following = next_batch(first)
+        while pending is not None:
+            data = await pending
+            sent = first - request.start
+            first = following
+            pending, following = next_batch(following)
+            if request.rate:
+                # not before the rows already sent have had their time
+                delay = started + sent / request.rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            if chunked:
+                data = b'%x\r\n' % len(data) + data + b'\r\n'
+            writer.write(data)
+            # backpressure: wait until the client has taken enough of what was sent
+            await writer.drain()
+        if chunked:
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream generated contacts over TCP or HTTP")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--batch-rows', type=int, default=500)
+    args = parser.parse_args(argv)
+    server = ContactServer(args.host, args.port, args.batch_rows)
+
+    async def serve():
+        await server.start()
+        print("serving contacts on {0}:{1}".format(args.host, server.port))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    main()
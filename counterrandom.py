@@ -0,0 +1,180 @@
+"""
+Counter-based random numbers
+
+Every draw is a hash of (seed, field, record number, draw number), so any record's
+random numbers can be produced directly, without generating the records before it.
+Makes runs repeatable from a seed, lets ranges of records be generated independently
+(e.g. in parallel) and lets a single record be regenerated exactly.
+"""
+
+import math
+import random
+import hashlib
+
+MASK64 = (1 << 64) - 1
+TWO_POW_MINUS_53 = 1.0 / (1 << 53)
+
+
+def splitmix64(x):
+    """SplitMix64 finaliser: scrambles a 64-bit integer into a well-mixed 64-bit integer"""
+    x = (x + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def stable_hash(value):
+    """
+    64-bit hash of a seed or field name that is the same in every process
+    (the builtin hash() of a string changes from run to run)
+    """
+    if isinstance(value, int):
+        return value & MASK64
+    return int(hashlib.blake2b(str(value).encode(), digest_size=8).hexdigest(), 16)
+
+
+class CounterRandom(random.Random):
+    """
+    random.Random whose draws for record k depend only on (seed, field, k)
+
+    All the usual methods (random, uniform, randint, choice, normalvariate etc.) are available.
+    Call seek(k) before generating record k. Different fields (e.g. 'dob', 'address')
+    get independent streams, so adding a draw to one field leaves the others unchanged
+    """
+
+    def __init__(self, seed=None, field=''):
+        self.field_key = stable_hash(field)
+        self.record = 0
+        super().__init__(seed)
+
+    def seed(self, a=None, version=2):
+        if a is None:
+            a = random.SystemRandom().getrandbits(64)
+        self.seed_key = splitmix64(stable_hash(a))
+        self.seek(self.record)
+
+    def seek(self, record):
+        """position the stream at the first draw of record number 'record'"""
+        self.record = record
+        self.key = splitmix64(self.seed_key ^ splitmix64(self.field_key ^ splitmix64(record)))
+        self.counter = 0
+        self.gauss_next = None
+
+    def next64(self):
+        self.counter += 1
+        return splitmix64(self.key ^ (self.counter * 0xD1B54A32D192ED03 & MASK64))
+
+    def random(self):
+        return (self.next64() >> 11) * TWO_POW_MINUS_53
+
+    def getrandbits(self, k):
+        if k <= 64:
+            return self.next64() >> (64 - k)
+        bits = 0
+        for shift in range(0, k, 64):
+            bits |= self.next64() << shift
+        return bits & ((1 << k) - 1)
+
+    def batch(self, start, n):
+        """the streams of records start to start + n - 1, for drawing a column at a time (see CounterBatch)"""
+        return CounterBatch(self, start, n)
+
+    def getstate(self):
+        return self.seed_key, self.field_key, self.record, self.counter
+
+    def setstate(self, state):
+        self.seed_key, self.field_key, record, counter = state
+        self.seek(record)
+        self.counter = counter
+
+
+class CounterBatch:
+    """
+    the streams of a run of records, drawn a column at a time
+
+    Each call draws once for every record (or just those at the positions in rows),
+    moving each record on through its own stream. So a record gets exactly the numbers
+    it would from seek() and the matching CounterRandom calls, in the same order, but
+    without a method call (or a seek) per record and draw.
+    The splitmix64 steps are written out inline: that is where the time goes
+    """
+
+    def __init__(self, rng, start, n):
+        seed_key, field_key = rng.seed_key, rng.field_key
+        # the key seek(k) sets: splitmix64(seed_key ^ splitmix64(field_key ^ splitmix64(k)))
+        self.keys = keys = []
+        for x in range(start, start + n):
+            for salt in (field_key, seed_key):
+                x = x + 0x9E3779B97F4A7C15 & MASK64
+                x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+                x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK64
+                x = salt ^ x ^ (x >> 31)
+            keys.append(splitmix64(x))
+        self.counters = [0] * n
+
+    def __len__(self):
+        return len(self.keys)
+
+    def next64s(self, rows=None):
+        """the next 64-bit draw of each record (as CounterRandom.next64)"""
+        keys, counters = self.keys, self.counters
+        drawn = []
+        append = drawn.append
+        for i in (range(len(keys)) if rows is None else rows):
+            counter = counters[i] + 1
+            counters[i] = counter
+            x = (keys[i] ^ (counter * 0xD1B54A32D192ED03 & MASK64)) + 0x9E3779B97F4A7C15 & MASK64
+            x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK64
+            x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK64
+            append(x ^ (x >> 31))
+        return drawn
+
+    def randoms(self, rows=None):
+        """random() for each record"""
+        return [(x >> 11) * TWO_POW_MINUS_53 for x in self.next64s(rows)]
+
+    def uniforms(self, a, b, rows=None):
+        """uniform(a, b) for each record"""
+        return [a + (b - a) * r for r in self.randoms(rows)]
+
+    def randbelow(self, n, rows=None):
+        """
+        randrange(n) for each record: as random.Random, k-bit draws until one is below n,
+        redrawing only for the records whose draw was rejected
+        """
+        if n <= 0:
+            raise ValueError("empty range for randbelow")
+        shift = 64 - n.bit_length()
+        drawn = [x >> shift for x in self.next64s(rows)]
+        rejected = [j for j, r in enumerate(drawn) if r >= n]
+        while rejected:
+            redrawn = self.next64s([j if rows is None else rows[j] for j in rejected])
+            for j, x in zip(rejected, redrawn):
+                drawn[j] = x >> shift
+            rejected = [j for j in rejected if drawn[j] >= n]
+        return drawn
+
+    def randints(self, a, b, rows=None):
+        """randint(a, b) for each record"""
+        return [a + r for r in self.randbelow(b - a + 1, rows)]
+
+    def normals(self, mu, sigma, rows=None):
+        """normalvariate(mu, sigma) for each record (Kinderman and Monahan, as random.Random)"""
+        positions = list(range(len(self.keys))) if rows is None else list(rows)
+        drawn = [0.0] * len(positions)
+        pending = list(range(len(positions)))
+        log = math.log
+        while pending:
+            streams = [positions[j] for j in pending]
+            u1s = self.randoms(streams)
+            u2s = self.randoms(streams)
+            rejected = []
+            for j, u1, u2 in zip(pending, u1s, u2s):
+                u2 = 1.0 - u2
+                z = random.NV_MAGICCONST * (u1 - 0.5) / u2
+                if z * z / 4.0 <= -log(u2):
+                    drawn[j] = mu + z * sigma
+                else:
+                    rejected.append(j)
+            pending = rejected
+        return drawn
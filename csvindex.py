@@ -0,0 +1,133 @@
+"""
+Offset-indexed CSV files
+
+A lookup too big to load (a national address file, say) is read in place instead:
+the CSV is memory-mapped, and an index of where each row starts, built once and saved
+beside it (e.g. addresses.csv.index), is memory-mapped too. Reading row i parses just
+that row. Nothing is held per row in Python objects, so memory stays flat however big
+the file, and processes reading the same file share the operating system's page cache.
+
+An index is rebuilt when the CSV's modification time or size changes.
+
+Encodings must keep '"', ',' and newlines as single bytes (UTF-8, cp1252, Latin-1 and
+so on; not UTF-16).
+
+Index file layout (little-endian):
+    header      magic, CSV modification time (ns), CSV size, number of rows
+    offsets     uint64 byte offset of the start of each data row
+"""
+
+import io
+import os
+import sys
+import csv
+import mmap
+import struct
+from array import array
+
+from fileio import atomic_write, little_endian
+
+MAGIC = b'DGCSVIX1'
+HEADER = struct.Struct('<8sqqQ')
+
+
+def index_filename(filename):
+    return filename + '.index'
+
+
+class IndexedCSV:
+    """
+    a CSV file read in place, as a sequence of rows (dicts keyed by the heading row):
+
+        addresses = IndexedCSV('addresses.csv', encoding='cp1252')
+        len(addresses)
+        addresses[i]
+    """
+
+    def __init__(self, filename, encoding='utf-8', cache=True):
+        """cache: save the index beside filename, and use it next time if the file hasn't changed"""
+        self.filename = filename
+        self.encoding = encoding
+        with open(filename, 'rb') as f:
+            # an empty file can't be mapped
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        self.offsets = (cache and self.read_index()) or self.build_index(cache)
+        first_row = self.offsets[0] if len(self.offsets) else len(self.buf)
+        self.fields = tuple(next(csv.reader(io.StringIO(self.buf[:first_row].decode(encoding))), ()))
+
+    def read_index(self):
+        """offsets from the saved index (memory-mapped), or None if there's no up-to-date index"""
+        try:
+            with open(index_filename(self.filename), 'rb') as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(index) < HEADER.size or sys.byteorder != 'little':
+            # (offsets are mapped as they are, so only on little-endian machines)
+            return None
+        magic, mtime_ns, size, n_rows = HEADER.unpack_from(index)
+        source = os.stat(self.filename)
+        if (magic, mtime_ns, size) != (MAGIC, source.st_mtime_ns, source.st_size) \
+                or len(index) != HEADER.size + 8 * n_rows:
+            return None
+        self.index_buf = index
+        return memoryview(index)[HEADER.size:].cast('Q')
+
+    def build_index(self, save=True):
+        """scan the file for row offsets (and save them, if save and the index can be written)"""
+        source = os.stat(self.filename)
+        offsets = self._scan()
+        if save:
+            try:
+                with atomic_write(index_filename(self.filename)) as f:
+                    f.write(HEADER.pack(MAGIC, source.st_mtime_ns, source.st_size, len(offsets)))
+                    f.write(little_endian(offsets))
+            except OSError:
+                pass
+        return offsets
+
+    def _scan(self):
+        offsets = array('Q')
+        position = 0
+        row_start = 0
+        quotes = 0
+        seen_header = False
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                position += len(line)
+                # a newline inside quotes is part of the row, not the end of it
+                quotes += line.count(b'"')
+                if quotes % 2:
+                    continue
+                quotes = 0
+                if not seen_header:
+                    seen_header = True
+                elif position - row_start > len(line) or line.strip():
+                    offsets.append(row_start)
+                row_start = position
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def raw_row(self, i):
+        """values of data row i, as a list"""
+        if i < 0:
+            i += len(self.offsets)
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else len(self.buf)
+        return next(csv.reader(io.StringIO(self.buf[start:end].decode(self.encoding))), [])
+
+    def __getitem__(self, i):
+        """data row i, as a dict keyed by the heading row (like csv.DictReader: short rows get None)"""
+        if not -len(self.offsets) <= i < len(self.offsets):
+            raise IndexError(i)
+        values = self.raw_row(i)
+        row = dict(zip(self.fields, values))
+        for field in self.fields[len(values):]:
+            row[field] = None
+        return row
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
\ No newline at end of file
@@ -1,29 +1,219 @@
+import math
 import random
+import datetime
 
+try:
+    import numpy
+except ImportError:
+    # batch draws fall back to pure Python
+    numpy = None
 
-def birthday():
-    """Return random birthdays (string, dd/mm/yyyy). Attempts to distribute birthdays realistically."""
-    # Normal Distribution by default
-    # See http://en.wikipedia.org/wiki/Median_age for population models
+# birth years are kept within the range covered by the date tables
+MIN_YEAR = 1850
+MAX_YEAR = 2099
+
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+# two-digit day and month strings, indexed by day / month number
+DAY_STRINGS = tuple("{0:02d}".format(day) for day in range(32))
+MONTH_STRINGS = DAY_STRINGS[:13]
+
+# year -> 12 tuples (one per month) of 'dd/mm/yyyy' strings, one per day of the month
+_year_tables = {}
+
+
+def year_table(year):
+    """
+    every date of a year, preformatted: year_table(y)[month - 1][day - 1] is 'dd/mm/yyyy'
+    Built the first time each year is asked for, then shared
+    """
+    table = _year_tables.get(year)
+    if table is None:
+        leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+        table = _year_tables[year] = tuple(
+            tuple("{0}/{1}/{2}".format(DAY_STRINGS[day], MONTH_STRINGS[month], year)
+                  for day in range(1, length + (leap and month == 2) + 1))
+            for month, length in enumerate(MONTH_DAYS, 1))
+    return table
+
+
+def clamp_year(year):
+    return MIN_YEAR if year < MIN_YEAR else MAX_YEAR if year > MAX_YEAR else year
+
+
+class NormalAges:
+    """
+    birth years normally distributed around mean_year
+    See http://en.wikipedia.org/wiki/Median_age for population models
+    """
+
+    def __init__(self, mean_year=1960, sd=15):
+        self.mean_year = mean_year
+        self.sd = sd
+
+    def year(self, rng=random):
+        return clamp_year(int(rng.normalvariate(self.mean_year, self.sd)))
+
+    def years(self, n, rng=None, start=0):
+        """
+        n birth years in one batch (vectorised if numpy is installed)
+        rng: a CounterRandom to draw from, making the batch repeatable: year i is then
+        the one year(rng) gives record start + i
+        """
+        if rng is not None:
+            return self.drawn_years(rng.batch(start, n))
+        if numpy is not None:
+            drawn = numpy.random.normal(self.mean_year, self.sd, n).astype(int)
+            return numpy.clip(drawn, MIN_YEAR, MAX_YEAR).tolist()
+        normalvariate = random.normalvariate
+        return [clamp_year(int(normalvariate(self.mean_year, self.sd))) for i in range(n)]
+
+    def drawn_years(self, draws):
+        """year() for each record of a CounterBatch"""
+        return [clamp_year(int(z)) for z in draws.normals(self.mean_year, self.sd)]
+
+    def distribution(self):
+        """probability of each birth year (year: probability), as drawn (truncated, then clamped)"""
+        def below(year):
+            return 0.5 * (1.0 + math.erf((year - self.mean_year) / (self.sd * math.sqrt(2.0))))
+        probabilities = {year: below(year + 1) - below(year) for year in range(MIN_YEAR + 1, MAX_YEAR)}
+        probabilities[MIN_YEAR] = below(MIN_YEAR + 1)
+        probabilities[MAX_YEAR] = 1.0 - below(MAX_YEAR)
+        return dict(sorted(probabilities.items()))
+
+
+class EmpiricalAges:
+    """
+    birth years following a histogram of ages read from a CSV, e.g. census figures:
+
+        age,rn_weight
+        0-4,1510
+        5-9,1590
+        ...
+        85,490
+
+    An age is a single age or an inclusive band ('20-24', ages spread evenly within it).
+    Weights are as for any weighted lookup (rn_weight or rn_expweight, see weighted.py).
+    reference_year: year the ages are counted from (default: this year)
+    """
+
+    def __init__(self, filename, age_field='age', reference_year=None, engine='cumulative', cache=True):
+        from weighted import WeightedChoice
+        if reference_year is None:
+            reference_year = datetime.date.today().year
+        self.reference_year = reference_year
+        self.ages = WeightedChoice(filename, name_field=age_field, engine=engine, cache=cache)
+        # for each row of the histogram: latest birth year, and how many years the band spans
+        self.bands = []
+        for age in self.ages.name_list:
+            youngest, _, oldest = age.partition('-')
+            youngest = int(youngest)
+            oldest = int(oldest) if oldest else youngest
+            self.bands.append((reference_year - youngest, oldest - youngest + 1))
+
+    def year(self, rng=random):
+        latest, span = self.bands[self.ages._select(rng)]
+        return clamp_year(latest - int(rng.random() * span) if span > 1 else latest)
+
+    def years(self, n, rng=None, start=0):
+        """n birth years in one batch (rng, start: as for NormalAges.years)"""
+        if rng is not None:
+            return self.drawn_years(rng.batch(start, n))
+        bands = self.bands
+        rand = random.random
+        return [clamp_year(latest - int(rand() * span)) for latest, span in
+                (bands[i] for i in self.ages.indices(n))]
+
+    def drawn_years(self, draws):
+        """year() for each record of a CounterBatch"""
+        picked = [self.bands[i] for i in self.ages.drawn_indices(draws)]
+        # only records in a band of several years draw again
+        spread = [j for j, (latest, span) in enumerate(picked) if span > 1]
+        years = [latest for latest, span in picked]
+        for j, r in zip(spread, draws.randoms(spread)):
+            years[j] -= int(r * picked[j][1])
+        return [clamp_year(year) for year in years]
+
+    def distribution(self):
+        """probability of each birth year (year: probability)"""
+        ceilings = self.ages.weight_ceiling
+        probabilities = {}
+        floor = 0.0
+        for (latest, span), ceiling in zip(self.bands, ceilings):
+            for year in range(latest - span + 1, latest + 1):
+                year = clamp_year(year)
+                probabilities[year] = probabilities.get(year, 0.0) + (ceiling - floor) / ceilings[-1] / span
+            floor = ceiling
+        return dict(sorted(probabilities.items()))
+
+
+# used unless another age distribution is given
+DEFAULT_AGES = NormalAges()
+
+
+def birthday(rng=random, ages=None):
+    """
+    Return random birthdays (string, dd/mm/yyyy). Attempts to distribute birthdays realistically.
+    rng: source of random numbers (the random module or a random.Random instance)
+    ages: distribution of birth years (NormalAges, EmpiricalAges; default DEFAULT_AGES)
+    """
     # TODO-- sex differences
-    year = int(random.normalvariate(1960, 15))
-    month = random.randint(1, 12)
-    monthdays = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
-    # lists are 0-indexed but months are 1-indexed
-    lastdayofmonth = monthdays[month - 1]
-    # take leap year into account: allow 29 days in some Febs
-    if (month == 2
-        and year % 4 == 0
-        and (year % 100 != 0 or year % 400 == 0)):
-        lastdayofmonth = 29
-    # choose day of month
-    day = int(random.uniform(1.0, 31.0) * (float(lastdayofmonth) / 31) + 1.0)
-    return date_fields('dob', day, month, year)
+    year = (ages or DEFAULT_AGES).year(rng)
+    month = int(rng.random() * 12)
+    month_dates = year_table(year)[month]
+    day = int(rng.random() * len(month_dates))
+    return {
+        'dob': month_dates[day],
+        'dob_day': DAY_STRINGS[day + 1],
+        'dob_month': MONTH_STRINGS[month + 1],
+        'dob_year': str(year)
+    }
+
+
+def birthdays(n, ages=None, rng=None, start=0):
+    """
+    n random birthdays in one batch, as a dict of columns (same keys as birthday())
+    Same distribution as birthday(). Years, months and days are drawn for the whole batch,
+    then looked up in the preformatted date tables: nothing is formatted per row
+
+    rng: a CounterRandom to draw from, making the batch repeatable: row i then holds
+    the birthday birthday(rng) gives record start + i
+    """
+    ages = ages or DEFAULT_AGES
+    if rng is not None:
+        # the same draws, in the same order, as birthday(): a column of each for every record
+        draws = rng.batch(start, n)
+        years = ages.drawn_years(draws)
+        months = [int(r * 12) for r in draws.randoms()]
+        fractions = draws.randoms()
+    elif numpy is not None:
+        years = ages.years(n)
+        months = numpy.random.randint(0, 12, n).tolist()
+        fractions = numpy.random.random(n).tolist()
+    else:
+        years = ages.years(n)
+        rand = random.random
+        months = [int(rand() * 12) for i in range(n)]
+        fractions = [rand() for i in range(n)]
+    tables = {year: year_table(year) for year in set(years)}
+    dates = []
+    days = []
+    for year, month, fraction in zip(years, months, fractions):
+        month_dates = tables[year][month]
+        day = int(fraction * len(month_dates))
+        dates.append(month_dates[day])
+        days.append(DAY_STRINGS[day + 1])
+    year_strings = {year: str(year) for year in tables}
+    return {
+        'dob': dates,
+        'dob_day': days,
+        'dob_month': [MONTH_STRINGS[month + 1] for month in months],
+        'dob_year': [year_strings[year] for year in years]
+    }
 
 
 def date_fields(name, day, month, year):
-    day = "{0:02d}".format(day),
-    month = "{0:02d}".format(month),
+    day = "{0:02d}".format(day)
+    month = "{0:02d}".format(month)
     year = str(year)
     return {
         name: "{day}/{month}/{year}".format(day=day, month=month, year=year),
@@ -19,6 +19,11 @@ class MissingPopularityException(RandomNameException):
     pass
 
 
+class SamplingEngineException(RandomNameException):
+    """unknown sampling engine requested for a weighted lookup"""
+    pass
+
+
 class NegSampleSizeException(RandomContactException):
     """
     Negative or zero sample size passed to .save_csv
@@ -26,3 +31,6 @@ class NegSampleSizeException(RandomContactException):
     pass
 
 
+class LookupBackendException(RandomContactException):
+    """unknown lookup backend requested, or a lookup file it can't use"""
+    pass
@@ -9,43 +9,18 @@ translates internal record into a format to suit the output
 """
 
 import os
-
-import yaml
+import marshal
+import hashlib
+import operator
 
 import filelinks
+from fileio import atomic_write
 
 
 class FilterDefaultException(Exception):
     pass
 
 
-# master list of field names used internally
-cfgpath = os.path.join(filelinks.base_dir(), "translations.yaml")
-cfg = yaml.load(open(cfgpath, 'r').read())
-INTERNAL_NAMES = cfg['Internal_fields']
-INCOMING_FILTERS = cfg['Incoming']
-OUTGOING_FILTERS = cfg['Outgoing']
-# If no outgoing filter exists for a corresponding incoming filter
-# auto-generate one by reversing field mappings
-autofilters = {fm: {v: k for k, v in INCOMING_FILTERS[fm].items() if v}
-               for fm in INCOMING_FILTERS
-               if fm not in OUTGOING_FILTERS}
-autofilters = {k: v for k, v in autofilters.items() if v}
-OUTGOING_FILTERS.update(autofilters)
-# for filt in autofilters_for:
-#     print 'filt: ', filt
-#
-#
-#     for k, v in filt.items():
-#         print 'v: ', v
-#         if v:
-#             OUTGOING_FILTERS.update(autofilters_for[filt])
-# print 'Outgoing filters:\n', OUTGOING_FILTERS
-DEFAULT_FILTER = cfg['Default_filter']
-if DEFAULT_FILTER not in INCOMING_FILTERS:
-    raise FilterDefaultException("Default filter '{}' could not be found".format(DEFAULT_FILTER))
-
-
 # TODO-- optional data
 #   -- File As
 #   -- full name in one field
@@ -57,14 +32,114 @@ class BadTranslationTable(Exception):
     pass
 
 
-# # check that internal names match incoming translations
+# translations.yaml is only read when a translation is first needed, not at import.
+# The parsed tables are cached beside it (translations.yaml.cache), keyed by the hash
+# of the YAML, so most processes never import or run the YAML parser at all.
+# Each filter is checked against the internal field names when it is first used.
 #
-for filt in INCOMING_FILTERS:
-    # print filt, ":"
-    # print INCOMING_FILTERS[filt]
-    fieldcheck = [(filt, k, v, v in INTERNAL_NAMES)
-                  for k, v in INCOMING_FILTERS[filt].items() if v]
-    # print "Check {0}---\n {1}".format(filt, fieldcheck)
+# INTERNAL_NAMES (master list of field names used internally), INCOMING_FILTERS,
+# OUTGOING_FILTERS, DEFAULT_FILTER, INCOMING_TRANSLATORS and OUTGOING_TRANSLATORS
+# are still available as module attributes, loaded on first use
+cfgpath = os.path.join(filelinks.base_dir(), "translations.yaml")
+# bumped when what the cache holds changes
+CACHE_VERSION = 2
+_config = None
+_incoming_filters = {}
+_outgoing_filters = {}
+_incoming_translators = {}
+_outgoing_translators = {}
+
+
+def config():
+    """parsed translation tables (loaded on first use; filters are checked as they are used)"""
+    global _config
+    if _config is None:
+        _config = load_tables(cfgpath)
+    return _config
+
+
+def load_config(path):
+    """validated translation tables from the YAML file at path: every filter checked"""
+    return compile_config(load_tables(path))
+
+
+def load_tables(path):
+    """parsed translation tables from the YAML file at path, via its cache if up to date"""
+    with open(path, 'rb') as f:
+        source = f.read()
+    digest = hashlib.sha256(source).hexdigest()
+    cache_path = path + '.cache'
+    try:
+        with open(cache_path, 'rb') as f:
+            cache_version, cached_digest, cfg = marshal.load(f)
+        if cache_version == CACHE_VERSION and cached_digest == digest:
+            return cfg
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    cfg = parse_tables(source)
+    try:
+        with atomic_write(cache_path) as f:
+            marshal.dump((CACHE_VERSION, digest, cfg), f)
+    except OSError:
+        pass
+    return cfg
+
+
+def parse_tables(source):
+    """parse translation tables (the filters themselves are not checked)"""
+    import yaml
+    cfg = yaml.safe_load(source)
+    default_filter = cfg['Default_filter']
+    if default_filter not in cfg['Incoming']:
+        raise FilterDefaultException("Default filter '{}' could not be found".format(default_filter))
+    return {'Internal_fields': cfg['Internal_fields'],
+            'Incoming': cfg['Incoming'],
+            'Outgoing': cfg['Outgoing'],
+            'Default_filter': default_filter}
+
+
+def compile_config(cfg):
+    """check every filter of parsed translation tables; adds the auto-generated outgoing filters"""
+    return {'Internal_fields': cfg['Internal_fields'],
+            'Incoming': {filt: checked_incoming(cfg, filt) for filt in cfg['Incoming']},
+            'Outgoing': {filt: checked_outgoing(cfg, filt) for filt in outgoing_filter_names(cfg)},
+            'Default_filter': cfg['Default_filter']}
+
+
+def reversed_filter(fieldmapping):
+    """outgoing filter reversing an incoming filter's field mappings"""
+    return {v: k for k, v in fieldmapping.items() if v}
+
+
+def outgoing_filter_names(cfg):
+    """
+    the outgoing filters: those declared, and (if no outgoing filter exists for a
+    corresponding incoming filter) one auto-generated by reversing its field mappings
+    """
+    return list(cfg['Outgoing']) + [filt for filt, fieldmapping in cfg['Incoming'].items()
+                                    if filt not in cfg['Outgoing'] and reversed_filter(fieldmapping)]
+
+
+def checked_incoming(cfg, filt):
+    fieldmapping = cfg['Incoming'][filt]
+    check_incoming(filt, fieldmapping, cfg['Internal_fields'])
+    return fieldmapping
+
+
+def checked_outgoing(cfg, filt):
+    if filt in cfg['Outgoing']:
+        fieldmapping = cfg['Outgoing'][filt]
+    else:
+        fieldmapping = reversed_filter(cfg['Incoming'][filt])
+        if not fieldmapping:
+            raise KeyError(filt)
+    check_outgoing(filt, fieldmapping, cfg['Internal_fields'])
+    return fieldmapping
+
+
+def check_incoming(filt, fieldmapping, internal_names):
+    fieldcheck = [(filt, k, v, v in internal_names)
+                  for k, v in fieldmapping.items() if v]
     errors = [f for f in fieldcheck if not f[3]]
     if errors:
         print("\n".join([
@@ -74,10 +149,11 @@ for filt in INCOMING_FILTERS:
                             in errors]))
         raise BadTranslationTable('Fault in Incoming Translation Table')
 
-for filt in OUTGOING_FILTERS:
-    fieldcheck = [(filt, k, v, k in INTERNAL_NAMES)
+
+def check_outgoing(filt, fieldmapping, internal_names):
+    fieldcheck = [(filt, k, v, k in internal_names)
                   for k, v
-                  in OUTGOING_FILTERS[filt].items() if v is not None]
+                  in fieldmapping.items() if v is not None]
     errors = [f for f in fieldcheck if not f[3]]
     if errors:
         print("\n".join(["'{0}' is not an internal field ('from' field in outgoing filter '{1}' is '{2}')".format(
@@ -87,8 +163,56 @@ for filt in OUTGOING_FILTERS:
         raise BadTranslationTable('Fault in Outgoing Translation Table')
 
 
+def incoming_filter(filt='OutlookCSV'):
+    """one incoming filter (checked on first request)"""
+    fieldmapping = _incoming_filters.get(filt)
+    if fieldmapping is None:
+        fieldmapping = _incoming_filters[filt] = checked_incoming(config(), filt)
+    return fieldmapping
+
+
+def outgoing_filter(filt='OutlookCSV'):
+    """one outgoing filter (checked on first request)"""
+    fieldmapping = _outgoing_filters.get(filt)
+    if fieldmapping is None:
+        fieldmapping = _outgoing_filters[filt] = checked_outgoing(config(), filt)
+    return fieldmapping
+
+
+def incoming_translator(filt='OutlookCSV'):
+    """compiled Translator for one incoming filter (compiled on first request)"""
+    translator = _incoming_translators.get(filt)
+    if translator is None:
+        translator = _incoming_translators[filt] = Translator(incoming_filter(filt))
+    return translator
+
+
+def outgoing_translator(filt='OutlookCSV'):
+    """compiled Translator for one outgoing filter (compiled on first request)"""
+    translator = _outgoing_translators.get(filt)
+    if translator is None:
+        translator = _outgoing_translators[filt] = Translator(outgoing_filter(filt))
+    return translator
+
+
+def __getattr__(name):
+    """module attributes loaded on first use"""
+    if name == 'INTERNAL_NAMES':
+        return config()['Internal_fields']
+    if name == 'INCOMING_FILTERS':
+        return {filt: incoming_filter(filt) for filt in config()['Incoming']}
+    if name == 'OUTGOING_FILTERS':
+        return {filt: outgoing_filter(filt) for filt in outgoing_filter_names(config())}
+    if name == 'DEFAULT_FILTER':
+        return config()['Default_filter']
+    if name == 'INCOMING_TRANSLATORS':
+        return {filt: incoming_translator(filt) for filt in config()['Incoming']}
+    if name == 'OUTGOING_TRANSLATORS':
+        return {filt: outgoing_translator(filt) for filt in outgoing_filter_names(config())}
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
 # TODO-- output field order at least for csv
-# TODO-- convert translation mechanisms into a class
 
 def transform(p, fieldmapping, passthru=False):
     """
@@ -111,9 +235,90 @@ def transform(p, fieldmapping, passthru=False):
     return trans
 
 
+class Translator:
+    """
+    A field mapping compiled once, for use record after record.
+    Same results as transform(p, fieldmapping, passthru)
+
+    translator(p) translates one record (a dict)
+    translator.schema(input_fields) compiles a projection for records that all share
+    one set of fields, by position rather than by lookup
+    translator.columns(block) translates a column-oriented block in one call
+    """
+
+    def __init__(self, fieldmapping):
+        self.fieldmapping = fieldmapping
+        # mappings that survive translation (those to a blank or None fieldname are dropped)
+        self.pairs = tuple((k, v) for k, v in fieldmapping.items() if v)
+        self.mapped = frozenset(fieldmapping)
+        self.schemas = {}
+
+    def __call__(self, p, passthru=False):
+        if passthru:
+            trans = {k: v for k, v in p.items() if k not in self.mapped}
+        else:
+            trans = {}
+        trans.update({v: p[k] for k, v in self.pairs if k in p})
+        return trans
+
+    def schema(self, input_fields, passthru=False):
+        """projection from records with exactly these fields (compiled once, then cached)"""
+        key = (tuple(input_fields), passthru)
+        projection = self.schemas.get(key)
+        if projection is None:
+            projection = self.schemas[key] = Projection(self, key[0], passthru)
+        return projection
+
+    def columns(self, block, passthru=False):
+        """
+        translate a column-oriented block (dict of field name: column)
+        The columns themselves are shared with the block, not copied
+        """
+        return self(block, passthru)
+
+
+class Projection:
+    """
+    translation from one fixed input schema (field names, in order) to the output schema
+    Use translator.schema() to get one
+    """
+
+    def __init__(self, translator, input_fields, passthru=False):
+        self.input_fields = input_fields
+        present = set(input_fields)
+        pairs = []
+        if passthru:
+            pairs.extend((k, k) for k in input_fields if k not in translator.mapped)
+        pairs.extend((k, v) for k, v in translator.pairs if k in present)
+        self.output_fields = tuple(v for k, v in pairs)
+        self.source_fields = tuple(k for k, v in pairs)
+        position = {k: i for i, k in enumerate(input_fields)}
+        self.positions = tuple(position[k] for k in self.source_fields)
+        self.by_key = self._getter(self.source_fields)
+        self.by_position = self._getter(self.positions)
+
+    @staticmethod
+    def _getter(items):
+        """like operator.itemgetter, but always returns a tuple"""
+        if len(items) == 1:
+            getter = operator.itemgetter(items[0])
+            return lambda record: (getter(record),)
+        if not items:
+            return lambda record: ()
+        return operator.itemgetter(*items)
+
+    def __call__(self, p):
+        """translate a record (dict) with the input fields"""
+        return dict(zip(self.output_fields, self.by_key(p)))
+
+    def row(self, values):
+        """translate a record given as values in input field order; returns output values in order"""
+        return self.by_position(values)
+
+
 def translateIn(p, passthru=False):
-    return transform(p, fieldmapping=INCOMING_FILTERS['OutlookCSV'], passthru=passthru)
+    return incoming_translator('OutlookCSV')(p, passthru=passthru)
 
 
 def translateOut(p, passthru=False):
-    return transform(p, fieldmapping=OUTGOING_FILTERS['OutlookCSV'], passthru=passthru)
+    return outgoing_translator('OutlookCSV')(p, passthru=passthru)
@@ -0,0 +1,49 @@
+"""
+Helpers for the files written beside lookups and outputs (caches, indexes, manifests)
+
+atomic_write: write a file whole or not at all
+little_endian, from_little_endian: arrays in the little-endian layout the binary formats use
+"""
+
+import os
+import sys
+import tempfile
+from array import array
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(filename, mode='wb'):
+    """
+    open a temporary file beside filename for writing; at the end of the with block it
+    replaces filename, so processes starting together never see half a file, and a writer
+    dying mid-write leaves the old one. If the block raises, the temporary file is removed
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_name, filename)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def little_endian(values):
+    """bytes of an array, little-endian whatever the platform"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode, data):
+    """array of typecode from little-endian bytes"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
@@ -0,0 +1,151 @@
+"""
+Streaming Django fixture writer
+
+Writes Django fixtures (YAML or JSON) and JSON Lines without going through
+yaml.dump for every record. Each record layout is compiled once into a text template,
+and rows are buffered and written in blocks.
+
+Every value is written as a JSON scalar. A JSON string is also a valid YAML
+double-quoted scalar, so the YAML output loads to exactly what yaml.dump would
+have produced. The one exception is a character outside the Basic Multilingual
+Plane (e.g. an emoji): JSON escapes it as a surrogate pair, which YAML reads back as
+two lone surrogates, so YAML gets a \\UXXXXXXXX escape instead.
+"""
+
+import re
+import json
+from json.encoder import encode_basestring_ascii
+
+NON_BMP = re.compile('([\U00010000-\U0010FFFF])')
+
+
+def scalar(value):
+    """a value as JSON text (which is also valid YAML flow text)"""
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def yaml_scalar(value):
+    """a value as YAML flow text: JSON text, with characters beyond U+FFFF as \\UXXXXXXXX escapes"""
+    text = scalar(value)
+    # any surrogate pair is escaped '\ud8..' to '\udb..': most strings have none
+    if '\\ud' not in text or not NON_BMP.search(value):
+        return text
+    return '"' + ''.join(encode_basestring_ascii(part)[1:-1] if i % 2 == 0 else '\\U{0:08X}'.format(ord(part))
+                         for i, part in enumerate(NON_BMP.split(value))) + '"'
+
+
+class FixtureWriter:
+    """
+    write records for one model to an open text file, e.g.
+
+        writer = FixtureWriter(outputfile, 'harv2.Customer', output_format='yaml')
+        writer.write(pk, fields)
+        ...
+        writer.close()
+
+    output_format is 'yaml' (Django YAML fixture), 'json' (Django JSON fixture) or
+    'jsonl' (one fixture object per line)
+    """
+
+    FORMATS = ('yaml', 'json', 'jsonl')
+
+    def __init__(self, outputfile, model, output_format='yaml', buffer_rows=1000):
+        if output_format not in self.FORMATS:
+            raise ValueError("Unknown fixture format '{0}' (expected one of {1})".format(
+                output_format, ', '.join(self.FORMATS)))
+        self.outputfile = outputfile
+        self.model = model
+        self.output_format = output_format
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        # templates compiled so far, by field names (records normally all share one layout)
+        self.templates = {}
+        self.rows_written = 0
+        self.scalar = yaml_scalar if output_format == 'yaml' else scalar
+        if output_format == 'json':
+            self.outputfile.write('[\n')
+
+    def compile_template(self, field_names):
+        """
+        text template for one record with these fields, in str.format style:
+        {0} is the primary key, {1}... the field values, already converted to JSON text
+        """
+        model = self.scalar(self.model)
+        keys = [self.scalar(name).replace('{', '{{').replace('}', '}}') for name in field_names]
+        if self.output_format == 'yaml':
+            fields = ''.join('    {0}: {{{1}}}\n'.format(key, i + 1) for i, key in enumerate(keys))
+            return ('- model: ' + model.replace('{', '{{').replace('}', '}}') +
+                    '\n  pk: {0}\n  fields:' + (' {{}}\n' if not keys else '\n') + fields)
+        fields = ', '.join('{0}: {{{1}}}'.format(key, i + 1) for i, key in enumerate(keys))
+        return ('{{"model": ' + model.replace('{', '{{').replace('}', '}}') +
+                ', "pk": {0}, "fields": {{' + fields + '}}}}')
+
+    def write(self, pk, fields):
+        """add one record: pk (primary key) and a dict of field values"""
+        field_names = tuple(fields)
+        template = self.templates.get(field_names)
+        if template is None:
+            template = self.templates[field_names] = self.compile_template(field_names)
+        scalar = self.scalar
+        self.buffer.append(template.format(scalar(pk), *[scalar(v) for v in fields.values()]))
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        if self.output_format == 'yaml':
+            text = ''.join(self.buffer)
+        elif self.output_format == 'jsonl':
+            text = '\n'.join(self.buffer) + '\n'
+        else:
+            text = (',\n' if self.rows_written else '') + ',\n'.join(self.buffer)
+        self.outputfile.write(text)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """write out any buffered records and finish the fixture (the file is left open)"""
+        self.flush()
+        if self.output_format == 'json':
+            self.outputfile.write('\n]\n' if self.rows_written else ']\n')
+
+
+if __name__ == '__main__':
+    """
+    benchmark: streaming writer against one yaml.dump per record
+    """
+    import io
+    import time
+    import yaml
+    import fieldmap
+    from randomcontact import RandomContact
+
+    no_of_people = 5000
+    people = [fieldmap.translateOut(p) for p in RandomContact(seed=1).records(0, no_of_people)]
+
+    start = time.perf_counter()
+    dumped = io.StringIO()
+    for pk, p in enumerate(people, 1):
+        dumped.write(yaml.dump([{'model': 'Customer', 'pk': pk, 'fields': p}]))
+    per_record_dump = time.perf_counter() - start
+
+    timings = {}
+    for output_format in FixtureWriter.FORMATS:
+        start = time.perf_counter()
+        streamed = io.StringIO()
+        writer = FixtureWriter(streamed, 'Customer', output_format=output_format)
+        for pk, p in enumerate(people, 1):
+            writer.write(pk, p)
+        writer.close()
+        timings[output_format] = time.perf_counter() - start
+        if output_format == 'yaml':
+            assert yaml.safe_load(streamed.getvalue()) == yaml.safe_load(dumped.getvalue())
+
+    print("{0} records".format(no_of_people))
+    print("yaml.dump per record: {0:10.0f} records/s".format(no_of_people / per_record_dump))
+    for output_format, elapsed in timings.items():
+        print("FixtureWriter {0:6s}: {1:10.0f} records/s ({2:.0f}x)".format(
+            output_format, no_of_people / elapsed, per_record_dump / elapsed))
@@ -0,0 +1,106 @@
+"""
+Instrumentation
+
+Where does a slow job spend its time? Pass a Stats object to RandomContact or
+Output.save and it collects, stage by stage (address picking, birthdays, names,
+usernames, field translation, serialisation), how many times each stage ran and how
+long it took, plus records and bytes written.
+
+Only one record in every sample_every is timed, so leaving Stats on costs little:
+times for the other records are estimated from the sample.
+"""
+
+from time import perf_counter
+
+# stages of RandomContact.record, in order
+CONTACT_STAGES = ('address', 'birthday', 'names', 'username')
+# stages of writing a record in Output.save, in order
+OUTPUT_STAGES = ('contact', 'translate', 'serialize')
+
+
+class Stats:
+    """
+    per-stage counts and (sampled) timings for a job
+
+    stats.calls[stage]      number of times the stage ran
+    stats.timed[stage]      number of those that were timed
+    stats.seconds[stage]    total time of the timed calls
+    stats.estimated_seconds(stage)   estimated time of all calls
+    stats.records           contacts generated
+    stats.rows_written, stats.bytes_written
+    """
+
+    def __init__(self, sample_every=100):
+        self.sample_every = sample_every
+        self.calls = {}
+        self.timed = {}
+        self.seconds = {}
+        self.records = 0
+        self.rows_written = 0
+        self.bytes_written = 0
+        self.countdowns = {}
+
+    def sample(self, pipeline):
+        """
+        count one more run of a pipeline ('contact' or 'output'); True if this run is
+        to be timed (one in every sample_every, starting with the first)
+        """
+        countdown = self.countdowns.get(pipeline, 1) - 1
+        if countdown <= 0:
+            self.countdowns[pipeline] = self.sample_every
+            return True
+        self.countdowns[pipeline] = countdown
+        return False
+
+    def add_calls(self, stages, calls=1):
+        for stage in stages:
+            self.calls[stage] = self.calls.get(stage, 0) + calls
+
+    def lap(self, stage, started):
+        """add the time since started to stage; returns now, to start the next stage's lap"""
+        now = perf_counter()
+        self.timed[stage] = self.timed.get(stage, 0) + 1
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + now - started
+        return now
+
+    def estimated_seconds(self, stage):
+        timed = self.timed.get(stage, 0)
+        if not timed:
+            return 0.0
+        return self.seconds[stage] * self.calls.get(stage, timed) / float(timed)
+
+    def merge(self, other):
+        """add in the stats of another job (e.g. a shard run in another process)"""
+        for counts, other_counts in ((self.calls, other.calls), (self.timed, other.timed),
+                                     (self.seconds, other.seconds)):
+            for stage, value in other_counts.items():
+                counts[stage] = counts.get(stage, 0) + value
+        self.records += other.records
+        self.rows_written += other.rows_written
+        self.bytes_written += other.bytes_written
+        return self
+
+    def as_dict(self):
+        stages = [stage for stage in CONTACT_STAGES + OUTPUT_STAGES if stage in self.calls]
+        stages += sorted(stage for stage in self.calls if stage not in stages)
+        return {
+            'records': self.records,
+            'rows_written': self.rows_written,
+            'bytes_written': self.bytes_written,
+            'stages': {stage: {'calls': self.calls.get(stage, 0),
+                               'timed': self.timed.get(stage, 0),
+                               'mean_seconds': (self.seconds.get(stage, 0.0) / self.timed[stage]
+                                                if self.timed.get(stage) else None),
+                               'estimated_seconds': self.estimated_seconds(stage)}
+                       for stage in stages}
+        }
+
+    def __str__(self):
+        summary = self.as_dict()
+        lines = ["{0} records, {1} rows / {2} bytes written".format(
+            summary['records'], summary['rows_written'], summary['bytes_written'])]
+        for stage, stage_stats in summary['stages'].items():
+            lines.append("  {0:10s} {1:>10d} calls {2:>10.1f} us/call {3:>10.3f} s (est.)".format(
+                stage, stage_stats['calls'], (stage_stats['mean_seconds'] or 0.0) * 1e6,
+                stage_stats['estimated_seconds']))
+        return "\n".join(lines)
@@ -0,0 +1,223 @@
+"""
+Binary lookup cache
+
+Parsing every lookup CSV (and recomputing weights, translating address rows) each time
+a generator starts up is slow for short-lived processes. A lookup table, once parsed,
+is saved in a compact binary file next to its CSV (e.g. surnames.csv.1a2b3c4d5e6f.cache) and
+memory-mapped when next loaded: the weights and row offsets are used in place, rows are
+decoded when picked, and processes loading the same cache share its pages. Name columns
+(see WeightedChoice) are decoded into a list once at load, so draws don't pay for decoding.
+
+A cache is used only if it was built from the same source file for the same purpose
+(the 'key', e.g. which name field or translation). The source counts as the same if its
+modification time and size both match those recorded: that pair is trusted, and the file
+isn't hashed. If either differs, the source is hashed, and the cache is still used when
+the size and SHA-256 hash match (the file was touched but not changed). Otherwise it is
+rebuilt. Each key has its own cache
+file (named with a hash of the key), so lookups reading the same CSV for different
+purposes don't overwrite each other's caches.
+
+Build caches for every lookup ahead of time with:
+
+    python lookupcache.py
+
+File layout (little-endian):
+    header      magic, source mtime (ns), source size, source SHA-256, key SHA-256,
+                number of rows, number of fields, number of weights
+    weights     float64 cumulative weights (one per row, or none)
+    offsets     uint64 offsets of each string in the string area: field names first,
+                then row by row, plus a final end offset
+    strings     UTF-8 text
+"""
+
+import os
+import mmap
+import struct
+import hashlib
+from array import array
+
+from fileio import atomic_write
+
+MAGIC = b'DGLKUP01'
+HEADER = struct.Struct('<8sqq32s32sQQQ')
+
+
+class LookupTable:
+    """
+    a lookup table: field names, rows and optional cumulative weights
+
+    rows and columns are sequences decoded on demand, so a table loaded from
+    a memory-mapped cache costs (almost) nothing until it is used
+    """
+
+    def __init__(self, fields, rows, weight_ceiling=None):
+        self.fields = tuple(fields)
+        self.rows = rows
+        self.weight_ceiling = weight_ceiling
+
+    def __len__(self):
+        return len(self.rows)
+
+    def column(self, field):
+        return [row[field] for row in self.rows]
+
+
+class MappedTable(LookupTable):
+    """LookupTable read straight out of a memory-mapped cache file"""
+
+    def __init__(self, buf, n_rows, n_fields, n_weights):
+        self.buf = buf
+        position = HEADER.size
+        self.weight_ceiling = memoryview(buf)[position:position + 8 * n_weights].cast('d')
+        position += 8 * n_weights
+        n_offsets = n_fields * (n_rows + 1) + 1
+        self.offsets = memoryview(buf)[position:position + 8 * n_offsets].cast('Q')
+        self.strings_start = position + 8 * n_offsets
+        self.n_fields = n_fields
+        self.fields = tuple(self.string(i) for i in range(n_fields))
+        self.rows = MappedRows(self, n_rows)
+
+    def string(self, i):
+        start = self.strings_start + self.offsets[i]
+        end = self.strings_start + self.offsets[i + 1]
+        return self.buf[start:end].decode('utf-8')
+
+    def value(self, row, col):
+        return self.string(self.n_fields * (row + 1) + col)
+
+    def column(self, field):
+        """
+        one field of every row, decoded into a list in a single pass: lookups draw from
+        their name column over and over, so it is decoded once rather than on every draw
+        """
+        col = self.fields.index(field)
+        buf, offsets, start = self.buf, self.offsets, self.strings_start
+        return [buf[start + offsets[i]:start + offsets[i + 1]].decode('utf-8')
+                for i in range(self.n_fields + col, self.n_fields * (len(self.rows) + 1), self.n_fields)]
+
+
+class MappedRows:
+    """sequence of a mapped table's rows, each decoded into a dict when accessed"""
+
+    def __init__(self, table, n_rows):
+        self.table = table
+        self.n_rows = n_rows
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n_rows))]
+        if i < 0:
+            i += self.n_rows
+        if not 0 <= i < self.n_rows:
+            raise IndexError(i)
+        table = self.table
+        return {field: table.value(i, col) for col, field in enumerate(table.fields)}
+
+
+def cache_filename(filename, key):
+    """the cache of filename's table for key"""
+    return "{0}.{1}.cache".format(filename, key_hash(key).hex()[:12])
+
+
+def file_hash(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def key_hash(key):
+    return hashlib.sha256(key.encode('utf-8')).digest()
+
+
+def load(filename, key, build, use_cache=True):
+    """
+    lookup table for filename, from its cache if that is up to date
+
+    key: what the table was built for (e.g. name field, translation); a cache
+    built for a different key is rebuilt
+    build: function returning a LookupTable parsed from filename, called when
+    the cache is missing or stale (its result is cached for next time)
+    """
+    if not use_cache:
+        return build()
+    table = read_cache(filename, key)
+    if table is None:
+        table = build()
+        write_cache(filename, key, table)
+    return table
+
+
+def read_cache(filename, key):
+    """MappedTable from filename's cache, or None if there is no usable cache"""
+    try:
+        with open(cache_filename(filename, key), 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        source = os.stat(filename)
+    except (OSError, ValueError):
+        # missing cache, or an empty one (which can't be mapped)
+        return None
+    if len(buf) < HEADER.size:
+        return None
+    magic, mtime_ns, size, source_hash, cached_key, n_rows, n_fields, n_weights = HEADER.unpack_from(buf)
+    if magic != MAGIC or cached_key != key_hash(key):
+        return None
+    if (mtime_ns, size) != (source.st_mtime_ns, source.st_size):
+        # touched, but perhaps not changed
+        if size != source.st_size or source_hash != file_hash(filename):
+            return None
+    return MappedTable(buf, n_rows, n_fields, n_weights)
+
+
+def write_cache(filename, key, table):
+    """save table as filename's cache for key (quietly gives up if the cache can't be written)"""
+    source = os.stat(filename)
+    strings = list(table.fields)
+    for row in table.rows:
+        # short CSV rows leave None in the missing fields
+        strings.extend('' if row.get(field) is None else row[field] for field in table.fields)
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = array('Q', [0])
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    weights = array('d', table.weight_ceiling or ())
+    header = HEADER.pack(MAGIC, source.st_mtime_ns, source.st_size, file_hash(filename), key_hash(key),
+                         len(table.rows), len(table.fields), len(weights))
+    try:
+        with atomic_write(cache_filename(filename, key)) as f:
+            f.write(header)
+            f.write(weights.tobytes())
+            f.write(offsets.tobytes())
+            f.write(b''.join(encoded))
+    except OSError:
+        pass
+
+
+if __name__ == '__main__':
+    """
+    build caches for the standard lookups
+    """
+    import time
+    import filelinks
+    from namebuilder import NameBuilder
+    from addressbuilder import AddressBuilder
+
+    start = time.perf_counter()
+    NameBuilder(cache=False)
+    AddressBuilder(cache=False)
+    uncached = time.perf_counter() - start
+    for lookup in os.listdir(filelinks.lookup_root()):
+        if lookup.endswith('.cache'):
+            os.unlink(filelinks.lookup_file(lookup))
+    NameBuilder()
+    AddressBuilder()
+    start = time.perf_counter()
+    NameBuilder()
+    AddressBuilder()
+    cached = time.perf_counter() - start
+    print("lookups loaded from CSV:   {0:.1f} ms".format(uncached * 1000))
+    print("lookups loaded from cache: {0:.1f} ms".format(cached * 1000))
@@ -1,6 +1,6 @@
 from weighted import WeightedChoice
 from filelinks import lookup_file
-from random import randint
+import random
 
 
 class NameBuilder:
@@ -11,33 +11,99 @@ class NameBuilder:
         without skewing the overall numbers of male and female names generated
     """
 
-    def __init__(self):
-        self.female_forename = WeightedChoice(lookup_file("female_forenames.csv"), name_field="forename")
-        self.male_forename = WeightedChoice(lookup_file("male_forenames.csv"), name_field="forename")
-        self.surname_generator = WeightedChoice(lookup_file("surnames.csv"), name_field="surname")
+    def __init__(self, cache=True):
+        """cache: use binary caches of the lookup tables (see lookupcache.py)"""
+        self.female_forename = WeightedChoice(lookup_file("female_forenames.csv"), name_field="forename",
+                                              cache=cache)
+        self.male_forename = WeightedChoice(lookup_file("male_forenames.csv"), name_field="forename",
+                                            cache=cache)
+        self.surname_generator = WeightedChoice(lookup_file("surnames.csv"), name_field="surname",
+                                                cache=cache)
 
-    def gendered_name(self):
+    def gendered_name(self, rng=random):
         """
         generate forenames, surname and gender
         Forenames must match in gender
         e.g. "Sarah Jane" and "Robert James" are okay
         but not "Alice Brett" or "Brian Rose"
+
+        rng: source of random numbers (the random module or a random.Random instance)
         """
         while True:
             # Flip between male and female name generators at statistically credible rate
             # see http://en.wikipedia.org/wiki/Sex_ratio (CIA estimate)
-            sex_female = randint(0, 1986) > 986
+            sex_female = rng.randint(0, 1986) > 986
             # Generate same-sex first and middle names
             forename_generator = self.female_forename if sex_female else self.male_forename
             yield {
-                "first_name": forename_generator.name(),
-                "middle_name": forename_generator.name(),
-                "last_name": self.surname_generator.name(),
+                "first_name": forename_generator.name(rng),
+                "middle_name": forename_generator.name(rng),
+                "last_name": self.surname_generator.name(rng),
                 "sex": 'female' if sex_female else 'male',
                 'sex_female': sex_female,
                 'sex_male': not sex_female
             }
 
+    def gendered_names(self, n, rng=None, start=0):
+        """
+        generate n sets of names in one batch, as columns
+        Returns a dict of lists (same keys as gendered_name), each n long.
+        Forenames still match in gender, row by row
+
+        rng: a CounterRandom to draw from, making the batch repeatable: row i then holds
+        the names gendered_name(rng) gives record start + i
+        """
+        if rng is not None:
+            return self._seeded_gendered_names(n, rng, start)
+        sexes_female = [random.randint(0, 1986) > 986 for i in range(n)]
+        females = sum(sexes_female)
+        males = n - females
+        # draw forenames for each sex in bulk, then deal them out in row order
+        female_firsts = iter(self.female_forename.names(females))
+        female_middles = iter(self.female_forename.names(females))
+        male_firsts = iter(self.male_forename.names(males))
+        male_middles = iter(self.male_forename.names(males))
+        first_names = []
+        middle_names = []
+        for sex_female in sexes_female:
+            if sex_female:
+                first_names.append(next(female_firsts))
+                middle_names.append(next(female_middles))
+            else:
+                first_names.append(next(male_firsts))
+                middle_names.append(next(male_middles))
+        return {
+            "first_name": first_names,
+            "middle_name": middle_names,
+            "last_name": self.surname_generator.names(n),
+            "sex": ['female' if sex_female else 'male' for sex_female in sexes_female],
+            'sex_female': sexes_female,
+            'sex_male': [not sex_female for sex_female in sexes_female]
+        }
+
+    def _seeded_gendered_names(self, n, rng, start):
+        # each stage of gendered_name() as a column: sexes, then each name, for the whole batch
+        draws = rng.batch(start, n)
+        sexes_female = [r > 986 for r in draws.randints(0, 1986)]
+        females = [j for j, sex_female in enumerate(sexes_female) if sex_female]
+        males = [j for j, sex_female in enumerate(sexes_female) if not sex_female]
+        columns = {}
+        for field in ("first_name", "middle_name"):
+            column = columns[field] = [None] * n
+            for rows, generator in ((females, self.female_forename), (males, self.male_forename)):
+                name_list = generator.name_list
+                for j, i in zip(rows, generator.drawn_indices(draws, rows)):
+                    column[j] = name_list[i]
+        surnames = self.surname_generator.name_list
+        return {
+            "first_name": columns["first_name"],
+            "middle_name": columns["middle_name"],
+            "last_name": [surnames[i] for i in self.surname_generator.drawn_indices(draws)],
+            "sex": ['female' if sex_female else 'male' for sex_female in sexes_female],
+            'sex_female': sexes_female,
+            'sex_male': [not sex_female for sex_female in sexes_female]
+        }
+
 
 if __name__ == '__main__':
     n = NameBuilder()
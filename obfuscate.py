@@ -0,0 +1,291 @@
+"""
+Obfuscating existing contact files
+
+Rewrites a real contact export with its people's personal details replaced: names,
+birthdays, house numbers, phone numbers and emails (which give names away). The result
+has the same columns, the same number of rows and a realistic spread of suburbs,
+states and so on.
+
+It is not anonymised: every column not listed here stays real. For Outlook that is
+Company, Title, Suburb, State, Postcode and Website; for Google, among others, Name Prefix,
+Group Membership, the email, phone and address Types, Address 1 - City, Region, Postal Code,
+Country, PO Box and Extended Address, Organization 1 (Name, Title etc.) and Website 1.
+Check those before handing the result on.
+
+    python -m obfuscate contacts.csv obfuscated.csv
+    python -m obfuscate google.csv obfuscated.csv --filter "Google Contacts" --processes 4
+
+The source is read in chunks of chunk_rows, so files of any size are handled in bounded
+memory. Each row goes through the incoming filter (translateIn), has its fields replaced,
+and goes back out through the matching outgoing filter (translateOut). Only fields
+the source row actually fills are replaced: blanks stay blank. Birthdays keep the
+source's format (dd/mm/yyyy, or yyyy-mm-dd as Google writes them).
+
+Phone numbers (PHONE_FIELDS: Outlook's Phone, Fax and Mobile, Google's Phone n - Value)
+keep their layout and first two digits (the trunk or area code: '03', '04'); the other
+digits are redrawn. Some layouts repeat the address outside the mapped fields
+(FORMATTED_ADDRESS_FIELDS: Google's 'Address 1 - Formatted'); those copies are rebuilt
+with the new street, or blanked if the street can't be found in them. Fields that can't
+be obfuscated (BLANKED_FIELDS: Google's second address, nicknames and other names,
+second and third emails, IM and notes) are blanked.
+
+With processes > 1, chunks are obfuscated in a process pool, a few chunks ahead of
+the writer, and written in their original order. With a seed, the output is the same
+whatever the chunk size or number of processes: row k is always obfuscated from
+the seed and k.
+
+Files starting with a UTF-16 byte order mark (as Google Contacts exports do) are read
+and written as UTF-16; others in the given encoding (default cp1252, as Outlook writes).
+"""
+
+import re
+import csv
+import codecs
+import random
+import argparse
+import itertools
+import collections
+import multiprocessing
+from functools import lru_cache
+
+import fieldmap
+from dates import birthday
+from addressbuilder import FirstlineTemplate
+from counterrandom import CounterRandom
+from randomcontact import RandomContact
+
+DEFAULT_CHUNK_ROWS = 5000
+# incoming filter: source fields holding a formatted copy of the (first) address
+FORMATTED_ADDRESS_FIELDS = {
+    'Google Contacts': ('Address 1 - Formatted',),
+}
+# incoming filter: source fields blanked, as they hold addresses with no mapped fields,
+# or other names, contact details and notes that would give the person away
+BLANKED_FIELDS = {
+    'Google Contacts': tuple('Address 2 - ' + field for field in (
+        'Type', 'Formatted', 'Street', 'City', 'PO Box', 'Region', 'Postal Code', 'Country',
+        'Extended Address')) + (
+        'Yomi Name', 'Given Name Yomi', 'Additional Name Yomi', 'Family Name Yomi', 'Name Suffix',
+        'Initials', 'Nickname', 'Short Name', 'Maiden Name', 'Notes',
+        'E-mail 2 - Value', 'E-mail 3 - Value', 'IM 1 - Value'),
+}
+# incoming filter: source fields holding phone numbers
+PHONE_FIELDS = {
+    'OutlookCSV': ('Phone', 'Fax', 'Mobile'),
+    'Google Contacts': ('Phone 1 - Value', 'Phone 2 - Value', 'Phone 3 - Value'),
+}
+# digits kept at the start of a phone number: the trunk or area code
+PHONE_PREFIX_DIGITS = 2
+# separator between the values of a multi-valued Google field
+MULTI_VALUE_SEPARATOR = ' ::: '
+ISO_DATE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+@lru_cache(maxsize=65536)
+def firstline_template(line):
+    """parsed first line of address (the same streets recur, so they are parsed once)"""
+    return FirstlineTemplate(line)
+
+
+class Obfuscator:
+    """
+    obfuscates rows (dicts keyed by the source file's field names) for one incoming filter
+
+    obfuscator.row(source_row, k): obfuscated copy of the source file's row number k
+    """
+
+    def __init__(self, seed=None, input_filter='OutlookCSV', ages=None):
+        self.contacts = RandomContact(seed=seed, ages=ages)
+        self.phone_rng = CounterRandom(self.contacts.seed, field='phone')
+        self.translate_in = fieldmap.incoming_translator(input_filter)
+        self.translate_out = fieldmap.outgoing_translator(input_filter)
+        self.formatted_address_fields = FORMATTED_ADDRESS_FIELDS.get(input_filter, ())
+        self.blanked_fields = BLANKED_FIELDS.get(input_filter, ())
+        self.phone_fields = PHONE_FIELDS.get(input_filter, ())
+
+    def row(self, source_row, k):
+        contacts = self.contacts
+        for rng in (contacts.address_rng, contacts.dob_rng, contacts.name_rng):
+            rng.seek(k)
+        person = self.translate_in(source_row)
+        source_dob = person.get('dob')
+        source_street = person.get('street')
+        person.update(next(contacts.name_builder.gendered_name(contacts.name_rng)))
+        person['full_name'] = "{0} {1}".format(person['first_name'], person['last_name'])
+        person.update(birthday(contacts.dob_rng, contacts.ages))
+        if source_dob:
+            person['dob'] = formatted_like(source_dob, person)
+        if source_street:
+            person['street'] = firstline_template(source_street).fill(contacts.address_rng)
+        person['email'] = contacts.email_from_username(contacts.username(person, k))
+        obfuscated = dict(source_row)
+        obfuscated.update((field, value) for field, value in self.translate_out(person).items()
+                          if source_row.get(field))
+        for field in self.formatted_address_fields:
+            if source_row.get(field):
+                obfuscated[field] = rebuilt_address(source_row[field], source_street, person.get('street'))
+        self.phone_rng.seek(k)
+        for field in self.phone_fields:
+            if source_row.get(field):
+                obfuscated[field] = redrawn_phone(source_row[field], self.phone_rng)
+        for field in self.blanked_fields:
+            if field in obfuscated:
+                obfuscated[field] = ''
+        return obfuscated
+
+    def chunk(self, header, first_row, rows):
+        """obfuscate a list of CSV rows (lists in header order), numbered from first_row"""
+        width = len(header)
+        obfuscated = []
+        for k, values in enumerate(rows, first_row):
+            if len(values) < width:
+                # short rows: missing fields are blank
+                values = values + [''] * (width - len(values))
+            source_row = dict(zip(header, values))
+            new_row = self.row(source_row, k)
+            obfuscated.append([new_row[field] for field in header] + values[width:])
+        return obfuscated
+
+
+def formatted_like(source_dob, person):
+    """person's birthday, written like source_dob: yyyy-mm-dd, --mm-dd (no year) or dd/mm/yyyy"""
+    if ISO_DATE.match(source_dob):
+        return "{0}-{1}-{2}".format(person['dob_year'], person['dob_month'], person['dob_day'])
+    if source_dob.startswith('--'):
+        return "--{0}-{1}".format(person['dob_month'], person['dob_day'])
+    return person['dob']
+
+
+def rebuilt_address(formatted, source_street, street):
+    """
+    formatted address with each (multi-valued) part of source_street replaced by the new street's;
+    blank if a part can't be found in it and it has numbers that might be house numbers
+    """
+    if source_street and street:
+        old_parts = source_street.split(MULTI_VALUE_SEPARATOR)
+        new_parts = street.split(MULTI_VALUE_SEPARATOR)
+        if len(old_parts) == len(new_parts) and all(part in formatted for part in old_parts):
+            for old, new in zip(old_parts, new_parts):
+                formatted = formatted.replace(old, new, 1)
+            return formatted
+    return '' if re.search('[0-9]', formatted) else formatted
+
+
+def redrawn_phone(number, rng):
+    """
+    number with all but its first PHONE_PREFIX_DIGITS digits redrawn (each value of a
+    multi-valued field on its own); spacing and punctuation are kept
+    """
+    parts = []
+    for part in number.split(MULTI_VALUE_SEPARATOR):
+        digits = itertools.count()
+        parts.append(re.sub('[0-9]', lambda m: m.group() if next(digits) < PHONE_PREFIX_DIGITS
+                            else str(rng.randrange(10)), part))
+    return MULTI_VALUE_SEPARATOR.join(parts)
+
+
+# the Obfuscator of a pool worker process
+_worker = None
+
+
+def _init_worker(seed, input_filter, ages):
+    global _worker
+    _worker = Obfuscator(seed, input_filter, ages)
+
+
+def _obfuscate_chunk(spec):
+    header, first_row, rows = spec
+    return _worker.chunk(header, first_row, rows)
+
+
+def sniff_encoding(filename, default='cp1252'):
+    """'utf-16' or 'utf-8-sig' if filename starts with a byte order mark, otherwise default"""
+    with open(filename, 'rb') as f:
+        start = f.read(4)
+    if start.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    if start.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    return default
+
+
+def chunks(reader, chunk_rows):
+    """(first row number, rows) for successive chunks of a csv reader"""
+    first_row = 0
+    while True:
+        rows = list(itertools.islice(reader, chunk_rows))
+        if not rows:
+            return
+        yield first_row, rows
+        first_row += len(rows)
+
+
+def obfuscate_file(source, destination, input_filter='OutlookCSV', encoding=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                   processes=1, seed=None, ages=None):
+    """
+    write an obfuscated copy of the CSV file source to destination
+    input_filter: incoming filter (translations.yaml) matching the source's layout
+    encoding: the source's encoding, if it has no byte order mark (default cp1252)
+    seed: makes the output repeatable (chosen at random if not given)
+    ages: distribution of birth years (see dates.py)
+
+    returns the number of rows written
+    """
+    if seed is None:
+        # all workers must share one seed
+        seed = random.SystemRandom().getrandbits(64)
+    encoding = sniff_encoding(source, encoding or 'cp1252')
+    rows_written = 0
+    with open(source, encoding=encoding, newline='') as infile, \
+            open(destination, 'w', encoding=encoding, newline='') as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        writer.writerow(header)
+        if processes > 1:
+            pool = multiprocessing.Pool(processes, _init_worker, (seed, input_filter, ages))
+            try:
+                # a few chunks in flight per process: enough to keep them busy, few enough
+                # to keep memory bounded however large the source
+                in_flight = collections.deque()
+                for first_row, rows in chunks(reader, chunk_rows):
+                    if len(in_flight) >= 2 * processes:
+                        rows_written += write_rows(writer, in_flight.popleft().get())
+                    in_flight.append(pool.apply_async(_obfuscate_chunk, ((header, first_row, rows),)))
+                while in_flight:
+                    rows_written += write_rows(writer, in_flight.popleft().get())
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            obfuscator = Obfuscator(seed, input_filter, ages)
+            for first_row, rows in chunks(reader, chunk_rows):
+                rows_written += write_rows(writer, obfuscator.chunk(header, first_row, rows))
+    return rows_written
+
+
+def write_rows(writer, rows):
+    writer.writerows(rows)
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Obfuscate a contact export (CSV)")
+    parser.add_argument('source')
+    parser.add_argument('destination')
+    parser.add_argument('--filter', default='OutlookCSV', help="incoming filter in translations.yaml")
+    parser.add_argument('--encoding', help="source encoding, if it has no byte order mark (default cp1252)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    rows = obfuscate_file(args.source, args.destination, args.filter, args.encoding, args.chunk_rows,
+                          args.processes, args.seed)
+    print("{0} rows obfuscated".format(rows))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
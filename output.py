@@ -1,56 +1,283 @@
+import os
+import random
+import shutil
+import multiprocessing
 import fieldmap
-import yaml
 import csv
 from exceptions import NegSampleSizeException
 from randomcontact import RandomContact
+from fixturewriter import FixtureWriter
+from sqlwriter import SQLiteWriter, CopyWriter
+from columnar import ColumnarWriter, ParquetWriter
+import compressed
+from instrumentation import Stats, OUTPUT_STAGES
+from time import perf_counter
 from filelinks import output_file
 
 
 class Output:
 
+    # output_filetype: FixtureWriter format
+    FIXTURE_FORMATS = {'django_yaml_fixture': 'yaml',
+                       'django_json_fixture': 'json',
+                       'jsonl': 'jsonl'}
+    # output_filetype: SQL writer (one column per field of the outgoing filter)
+    SQL_FORMATS = ('sqlite', 'postgres_copy')
+    # output_filetype: dictionary-encoded columnar writer (see columnar.py)
+    COLUMNAR_FORMATS = ('columnar', 'parquet')
+    # binary files, compressed once written (the others are compressed as they are written)
+    COMPRESSED_AFTER = ('sqlite', 'columnar', 'parquet')
+    OUTPUT_FORMATS = ('csv',) + tuple(FIXTURE_FORMATS) + SQL_FORMATS + COLUMNAR_FORMATS
+
+    @classmethod
+    def require_filetype(self, output_filetype):
+        if output_filetype not in self.OUTPUT_FORMATS:
+            raise ValueError("Unknown output_filetype '{0}' (expected one of {1})".format(
+                output_filetype, ', '.join(self.OUTPUT_FORMATS)))
+
     @classmethod
     def save(self, no_of_people, output_filename, output_filetype='django_yaml_fixture',
-        yaml_entity='Customer', id_start=1, id_step=1):
-        """compile a list of people and save to a file"""
+        yaml_entity='Customer', id_start=1, id_step=1, processes=1, shards=None, seed=None,
+        merge_parts=True, stats=None, on_complete=None, sql_table='customer', compression=None,
+        compression_level=None):
+        """
+        compile a list of people and save to a file
+
+        output_filetype: 'csv', 'django_yaml_fixture', 'django_json_fixture' or 'jsonl'
+        (one Django fixture object per line), 'sqlite' (a SQLite database, table sql_table)
+        or 'postgres_copy' (a PostgreSQL COPY script loading table sql_table; run with psql -f)
+        SQL tables have an 'id' primary key column and a column per field of the outgoing filter;
+        so do 'columnar' (native dictionary-encoded columnar file, read back with
+        columnar.ColumnarReader) and 'parquet' (needs pyarrow) files
+
+        processes > 1 generates in parallel: the records are split into shards (by default
+        one per process), each generated in its own process, straight from its own range
+        of record numbers. Shard outputs are merged in order into output_filename, or with
+        merge_parts=False left as numbered part files (each a complete file).
+        Records and primary keys come out exactly as in a single pass.
+
+        seed makes a run repeatable, whatever the number of shards
+
+        compression: 'gzip' or 'zstd' (needs zstandard) compresses the output on a pool of
+        threads, in independent blocks, while records are generated (see compressed.py);
+        the compression's suffix is added to the file names. SQLite, columnar and Parquet
+        files are compressed once written
+
+        stats: instrumentation.Stats to collect per-stage timings, counts and bytes written in
+        (shards' stats are added in); on_complete(stats) is called at the end of the job
+        (with a new Stats if none was given)
+
+        returns a list of the files written
+        """
         if no_of_people <= 0:
             raise NegSampleSizeException("Can't generate zero or negative sample sizes! (n = %d)" % (no_of_people))
-        contact = RandomContact.contact()
-        with open(output_filename, "wb") as outputfile:
-            new_contact = next(contact())
-            # swallow empty first instance
-            dontuse = list(next(new_contact).keys())
+        self.require_filetype(output_filetype)
+        if shards is None:
+            shards = processes
+        shards = max(1, min(shards, no_of_people))
+        if seed is None:
+            # all shards must share one seed, even when the caller doesn't choose it
+            seed = random.SystemRandom().getrandbits(64)
+        if stats is None and on_complete is not None:
+            stats = Stats()
+        sample_every = None if stats is None else stats.sample_every
+        if compression:
+            compressed.require_compression(compression)
+            output_filename = compressed.uncompressed_filename(output_filename, compression)
+        # compression as the shards are written, or of the finished files
+        streamed = None if output_filetype in self.COMPRESSED_AFTER else compression
+        compress_after = compression if compression != streamed else None
+        if shards == 1:
+            filename, shard_stats = self._save_shard((0, no_of_people,
+                                                      compressed.compressed_filename(output_filename, streamed),
+                                                      output_filetype, yaml_entity, id_start, id_step, seed,
+                                                      sample_every, sql_table, streamed, compression_level))
+            return self._complete([filename], stats, shard_stats and [shard_stats], on_complete,
+                                  compress_after, compression_level)
+        part_specs = []
+        first_record = 0
+        for shard_no in range(shards):
+            # spread any remainder over the first few shards
+            size = no_of_people // shards + (1 if shard_no < no_of_people % shards else 0)
+            part_specs.append((first_record, size,
+                               compressed.compressed_filename(self.part_filename(output_filename, shard_no),
+                                                              streamed),
+                               output_filetype, yaml_entity, id_start + first_record * id_step, id_step,
+                               seed, sample_every, sql_table, streamed, compression_level))
+            first_record += size
+        if processes > 1:
+            pool = multiprocessing.Pool(processes)
+            try:
+                shard_results = pool.map(self._save_shard, part_specs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            shard_results = [self._save_shard(spec) for spec in part_specs]
+        part_files = [filename for filename, shard_stats in shard_results]
+        all_shard_stats = [shard_stats for filename, shard_stats in shard_results if shard_stats]
+        if not merge_parts:
+            return self._complete(part_files, stats, all_shard_stats, on_complete, compress_after, compression_level)
+        started = perf_counter()
+        output_filename = compressed.compressed_filename(output_filename, streamed)
+        self.merge(part_files, output_filename, output_filetype, sql_table, streamed, compression_level)
+        if stats is not None:
+            stats.add_calls(['merge'])
+            stats.lap('merge', started)
+        return self._complete([output_filename], stats, all_shard_stats, on_complete, compress_after,
+                              compression_level)
+
+    @staticmethod
+    def _complete(files, stats, shard_stats, on_complete, compression=None, compression_level=None):
+        """gather up a job's stats (compressing files that weren't compressed as written); returns the files"""
+        if compression:
+            files = [compressed.compress_file(filename, compression, compression_level) for filename in files]
+        if stats is not None:
+            for one_shard in shard_stats or ():
+                stats.merge(one_shard)
+            stats.bytes_written = sum(os.path.getsize(filename) for filename in files)
+            if on_complete is not None:
+                on_complete(stats)
+        return files
+
+    @classmethod
+    def _save_shard(self, spec):
+        """
+        generate and write one shard of records
+        returns the filename written, and the shard's Stats (if sample_every is set)
+        """
+        (first_record, no_of_people, filename, output_filetype, yaml_entity, first_id, id_step, seed,
+         sample_every, sql_table, compression, compression_level) = spec
+        stats = None if sample_every is None else Stats(sample_every)
+        contact = RandomContact(seed=seed, stats=stats).contact(start=first_record)
+        # databases and Parquet files are opened by their writers; columnar files are binary
+        if output_filetype in ('sqlite', 'parquet'):
+            outputfile = open(os.devnull, "w")
+        else:
+            outputfile = compressed.open_output(filename, compression, compression_level,
+                                                binary=output_filetype == 'columnar')
+        with outputfile:
             if output_filetype == 'csv':
                 wtr = self.setup_csv(outputfile)
-            person_id = id_start
+            elif output_filetype in self.FIXTURE_FORMATS:
+                wtr = FixtureWriter(outputfile, yaml_entity, self.FIXTURE_FORMATS[output_filetype])
+            elif output_filetype == 'sqlite':
+                wtr = SQLiteWriter(filename, sql_table, self.csv_header())
+            elif output_filetype == 'postgres_copy':
+                wtr = CopyWriter(outputfile, sql_table, self.csv_header())
+            elif output_filetype == 'columnar':
+                wtr = ColumnarWriter(outputfile, self.csv_header())
+            elif output_filetype == 'parquet':
+                wtr = ParquetWriter(filename, self.csv_header())
+            translator = fieldmap.outgoing_translator('OutlookCSV')
+            person_id = first_id
+            timed = False
             for i in range(no_of_people):
+                if stats is not None:
+                    timed = stats.sample('output')
+                    if timed:
+                        started = perf_counter()
+                person = next(contact)
+                if timed:
+                    started = stats.lap('contact', started)
+                # compiled projection for this record layout (normally the same every time)
+                p = translator.schema(person)(person)
+                if timed:
+                    started = stats.lap('translate', started)
                 if output_filetype == 'csv':
-                    p = fieldmap.translateOut(next(new_contact))
                     wtr.writerow(p)
-                elif output_filetype == 'django_yaml_fixture':
-                    p = fieldmap.translateOut(next(new_contact))
-                    # print('map', p)
-                    outputfile.write(
-                        yaml.dump([{'model': yaml_entity,
-                                    'pk': person_id,
-                                    'fields': p}
-                                   ]
-                                  )
-                    )
+                else:
+                    wtr.write(person_id, p)
+                if timed:
+                    stats.lap('serialize', started)
                 person_id += id_step
+            if output_filetype != 'csv':
+                wtr.close()
+        if stats is not None:
+            stats.add_calls(OUTPUT_STAGES, no_of_people)
+            stats.rows_written += no_of_people
+        return filename, stats
 
     @classmethod
     def setup_csv(self, outputfile):
-        # Write heading row in order of original contacts table
-        # todo-nm outgoing translations passim
-        # print("fieldorder", self.fieldorder)
-        field_header = [fieldmap.OUTGOING_TRANSLATION[r]
-                        for r
-                        in self.fieldorder
-                        if fieldmap.OUTGOING_TRANSLATION[r]]
+        # Write heading row in order of the outgoing filter
+        field_header = self.csv_header()
         wtr = csv.DictWriter(outputfile, field_header, extrasaction='ignore')
         wtr.writeheader()
         return wtr
 
+    @staticmethod
+    def csv_header():
+        return [external
+                for external
+                in fieldmap.outgoing_filter(fieldmap.DEFAULT_FILTER).values()
+                if external]
+
+    @staticmethod
+    def part_filename(output_filename, part_no):
+        """e.g. people.csv -> people-0003.csv"""
+        root, ext = os.path.splitext(output_filename)
+        return "{0}-{1:04d}{2}".format(root, part_no, ext)
+
+    @staticmethod
+    def merge(part_files, output_filename, output_filetype, sql_table='customer', compression=None,
+              compression_level=None):
+        """
+        concatenate part files in order into output_filename, removing the parts
+        CSV keeps only the first part's heading row; JSON fixtures are merged into one list;
+        a COPY script keeps one COPY statement; SQLite parts are copied table to table;
+        columnar and Parquet files are merged row group by row group
+        compression: the compression of the parts (and of output_filename)
+        """
+        if output_filetype in ('sqlite', 'columnar', 'parquet'):
+            if output_filetype == 'sqlite':
+                SQLiteWriter.merge(part_files, output_filename, sql_table)
+            elif output_filetype == 'columnar':
+                with open(output_filename, "wb") as outputfile:
+                    ColumnarWriter.merge(part_files, outputfile)
+            else:
+                ParquetWriter.merge(part_files, output_filename)
+            for part_file in part_files:
+                os.unlink(part_file)
+            return
+        if compression and output_filetype in ('jsonl', 'django_yaml_fixture'):
+            # compressed blocks are independent: the parts are joined as they are
+            with open(output_filename, "wb") as outputfile:
+                for part_file in part_files:
+                    with open(part_file, "rb") as part:
+                        shutil.copyfileobj(part, outputfile)
+                    os.unlink(part_file)
+            return
+        with compressed.open_output(output_filename, compression, compression_level) as outputfile:
+            if output_filetype == 'django_json_fixture':
+                outputfile.write('[')
+            separator = '\n'
+            for part_no, part_file in enumerate(part_files):
+                with compressed.open_input(part_file, compression) as part:
+                    if output_filetype == 'django_json_fixture':
+                        # FixtureWriter puts '[' and ']' on lines of their own, one record per line
+                        for line in part:
+                            line = line.rstrip('\n').rstrip(',')
+                            if line not in ('[', ']'):
+                                outputfile.write(separator + line)
+                                separator = ',\n'
+                    elif output_filetype == 'postgres_copy':
+                        # only the first COPY statement, and only the last end-of-data marker
+                        if part_no:
+                            part.readline()
+                        for line in part:
+                            if line != '\\.\n':
+                                outputfile.write(line)
+                    else:
+                        if output_filetype == 'csv' and part_no:
+                            part.readline()
+                        shutil.copyfileobj(part, outputfile)
+                os.unlink(part_file)
+            if output_filetype == 'django_json_fixture':
+                outputfile.write('\n]\n')
+            elif output_filetype == 'postgres_copy':
+                outputfile.write('\\.\n')
+
 
 # todo optional primary key, currently only implemented for YAML fixture
 
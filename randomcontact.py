@@ -1,9 +1,16 @@
 import os
-import hashlib
-from dates import birthday
+import copy
+import random
+import itertools
+from counterrandom import CounterRandom
+from uniquesuffix import UniqueSuffix
+from dates import birthday, birthdays
 from filelinks import base_dir
 from namebuilder import NameBuilder
 from addressbuilder import AddressBuilder
+from record import contact_record_class
+from instrumentation import CONTACT_STAGES
+from time import perf_counter
 
 
 class RandomContact:
@@ -12,49 +19,146 @@ class RandomContact:
     """
 
     def __init__(self, lookup_root=os.path.normpath(os.path.join(base_dir(), "lookups")),
-                 email_prefix='rp_', email_domain='gmail.com', password='test123'):
+                 email_prefix='rp_', email_domain='gmail.com', password='test123', seed=None,
+                 compact=False, stats=None, ages=None, address_builder=None):
         """
         lookup_root specifies where to find lookup tables
+        seed: contacts are a repeatable function of seed and record number
+        (a seed is chosen at random if not given)
+        compact: contacts are ContactRecords (a slot per field) rather than dicts.
+        Much smaller when many contacts are held in memory at once
+        stats: instrumentation.Stats to collect per-stage timings in
+        ages: distribution of birth years (see dates.py: NormalAges, EmpiricalAges)
+        address_builder: AddressBuilder to draw addresses from (default: the standard
+        addresses, loaded into memory), e.g. AddressBuilder(filename, backend='indexed')
+        for a very large address file
         """
         self.lookup_root = lookup_root
         self.website_fld = "website"
         self.fieldorder = []
         self.name_builder = NameBuilder()
-        self.address_builder = AddressBuilder()
+        self.address_builder = address_builder or AddressBuilder()
         self.email_prefix = email_prefix
         self.email_domain = email_domain
         self.password = password
+        self.record_type = contact_record_class() if compact else dict
+        self.stats = stats
+        self.ages = ages
+        self.seed_streams(seed)
 
-    def contact(self):
+    def seed_streams(self, seed=None):
+        """start the random streams again from seed (a seed is chosen at random if not given)"""
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        self.seed = seed
+        # independent random streams for each part of the record
+        self.address_rng = CounterRandom(seed, field='address')
+        self.dob_rng = CounterRandom(seed, field='dob')
+        self.name_rng = CounterRandom(seed, field='name')
+        # usernames are unique by record number (for up to 2**40 records)
+        self.unique_suffix = UniqueSuffix(seed, field='username')
+        # record number of the next contact_batch's first contact
+        self.next_batch_start = 0
+
+    def reseeded(self, seed=None):
+        """
+        a copy with its own random streams, started from seed, sharing this
+        generator's lookup tables (so nothing is loaded again)
+        """
+        other = copy.copy(self)
+        other.seed_streams(seed)
+        return other
+
+    def contact(self, start=0):
         """
         generator returning random but fairly realistic personal contact details
         Data is modelled on an existing
         address list and name frequency tables, with various fields
-        obfuscated for privacy."""
-        id = 1
-        while True:
-            person = next(self.address_builder.obfuscated_address())
-            person.update(birthday())
-            # Override or insert surname and forename info
-            person.update(next(self.name_builder.gendered_name()))
-            username = self.email_address(person)
-            # Use username for email as well
-            # Email domain name could be more sophisticated...
-            person.update({"email": self.email_address(person),
-                           "username": username,
-                           "password": "test123"})
-            yield person
-            id += 1
+        obfuscated for privacy.
+        start: record number of the first contact"""
+        return (self.record(k) for k in itertools.count(start))
+
+    def records(self, start, stop):
+        """contacts numbered start to stop - 1, without generating those before them"""
+        return (self.record(k) for k in range(start, stop))
+
+    def record(self, k):
+        """
+        contact number k, generated directly
+        The same seed and k always give the same contact
+        """
+        stats = self.stats
+        timed = False
+        if stats is not None:
+            stats.records += 1
+            stats.add_calls(CONTACT_STAGES)
+            timed = stats.sample('contact')
+            if timed:
+                started = perf_counter()
+        for rng in (self.address_rng, self.dob_rng, self.name_rng):
+            rng.seek(k)
+        person = next(self.address_builder.obfuscated_address(self.address_rng, self.record_type))
+        if timed:
+            started = stats.lap('address', started)
+        person.update(birthday(self.dob_rng, self.ages))
+        if timed:
+            started = stats.lap('birthday', started)
+        # Override or insert surname and forename info
+        person.update(next(self.name_builder.gendered_name(self.name_rng)))
+        if timed:
+            started = stats.lap('names', started)
+        username = self.username(person, k)
+        # Use username for email as well
+        # Email domain name could be more sophisticated...
+        person.update({"email": self.email_from_username(username),
+                       "username": username,
+                       "password": self.password})
+        if timed:
+            stats.lap('username', started)
+        return person
 
-    def email_address(self, person):
+    def contact_batch(self, n, start=None):
+        """
+        n contacts in one batch, as a column-oriented block:
+        a dict with one list per field (the same fields contact() emits), each n long.
+        Each stage (addresses, birthdays, names, usernames and emails) runs over the
+        whole batch at once, so bulk writers need never build a dict per contact.
+        Batches draw from this generator's seeded streams: the block holds exactly the
+        contacts records(start, start + n) gives.
+        start: record number of the first contact (by default, carrying on from the last batch)
+        """
+        if start is None:
+            start = self.next_batch_start
+        self.next_batch_start = start + n
+        block = self.address_builder.obfuscated_addresses(n, self.address_rng, start)
+        block.update(birthdays(n, self.ages, self.dob_rng, start))
+        block.update(self.name_builder.gendered_names(n, self.name_rng, start))
+        usernames = self.usernames(block, start)
+        block.update({"email": [self.email_from_username(username) for username in usernames],
+                      "username": usernames,
+                      "password": [self.password] * n})
+        return block
+
+    def email_address(self, person, k):
+        """email address of person, contact number k"""
+        return self.email_from_username(self.username(person, k))
+
+    def email_from_username(self, username):
         return "{base}+{prefix}{username}@{domain}".format(prefix=self.email_prefix,
-                    base='thebalancepro', username=self.username(person),
+                    base='thebalancepro', username=username,
                     domain=self.email_domain)
 
-    @staticmethod
-    def username(person):
-        return "{name}-{hash}".format(name=person["first_name"],
-            hash=hashlib.md5(repr(person).encode()).hexdigest()[:5])
+    def usernames(self, block, start=0):
+        """usernames for a column-oriented block of contacts numbered from start (see contact_batch)"""
+        suffixes = self.unique_suffix.suffixes(start, len(block["first_name"]))
+        return [first_name + '-' + suffix for first_name, suffix in zip(block["first_name"], suffixes)]
+
+    def username(self, person, k):
+        """
+        username of person, contact number k: first name and a suffix unique to k,
+        so no two contacts numbered below 2**40 share a username (or an email)
+        """
+        return person["first_name"] + '-' + self.unique_suffix.suffix(k)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,128 @@
+"""
+Compact records
+
+A record class has one slot per field instead of a per-record dict, so a large
+buffer of contacts doesn't pay for a hash table and a set of keys in every row.
+Records behave as mutable mappings (r['first_name'], r.first_name, update(), items()
+etc.). Fields that have never been set are simply absent, as they would be from a dict.
+"""
+
+import itertools
+from collections.abc import MutableMapping
+
+import fieldmap
+
+
+class Record(MutableMapping):
+    """base class for record classes made by record_class()"""
+
+    __slots__ = ()
+    fields = ()
+    field_set = frozenset()
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self.field_set:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.field_set:
+            raise KeyError("{0} has no field '{1}'".format(type(self).__name__, key))
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        if key in self.field_set:
+            try:
+                return delattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __iter__(self):
+        return (name for name in self.fields if hasattr(self, name))
+
+    def __len__(self):
+        return sum(1 for name in self.fields if hasattr(self, name))
+
+    def __contains__(self, key):
+        return key in self.field_set and hasattr(self, key)
+
+    def update(self, other=(), **kwargs):
+        # setattr straight from the source, without the generic MutableMapping machinery
+        items = other.items() if hasattr(other, 'items') else other
+        for key, value in itertools.chain(items, kwargs.items()):
+            if key not in self.field_set:
+                raise KeyError("{0} has no field '{1}'".format(type(self).__name__, key))
+            setattr(self, key, value)
+
+    def as_dict(self):
+        """plain dict copy of the record"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, self.as_dict())
+
+    def __reduce__(self):
+        return _rebuild, (self.fields, self.as_dict())
+
+
+_record_classes = {}
+
+
+def record_class(fields, name='Record'):
+    """
+    compact record class with a slot for each of fields (cached: the same fields
+    always give the same class)
+    """
+    fields = tuple(fields)
+    cls = _record_classes.get(fields)
+    if cls is None:
+        cls = _record_classes[fields] = type(name, (Record,), {'__slots__': fields,
+                                                               'fields': fields,
+                                                               'field_set': frozenset(fields)})
+    return cls
+
+
+def _rebuild(fields, values):
+    return record_class(fields)(values)
+
+
+def contact_record_class():
+    """
+    record class for a contact: every internal field (see translations.yaml)
+    Built on first use, so importing this module doesn't load the translation tables
+    """
+    return record_class(fieldmap.INTERNAL_NAMES, name='ContactRecord')
+
+
+def __getattr__(name):
+    """ContactRecord, built on first use"""
+    if name == 'ContactRecord':
+        return contact_record_class()
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+if __name__ == '__main__':
+    """
+    bytes per buffered contact: dict against ContactRecord
+    """
+    import sys
+    from randomcontact import RandomContact
+
+    def container_bytes(records):
+        """memory taken by the records themselves (field values are shared with the lookups)"""
+        return sum(sys.getsizeof(r) for r in records) / float(len(records))
+
+    no_of_people = 10000
+    as_dicts = list(RandomContact(seed=1).records(0, no_of_people))
+    as_records = list(RandomContact(seed=1, compact=True).records(0, no_of_people))
+    assert as_dicts == as_records
+    print("bytes per contact, dict:          {0:.0f}".format(container_bytes(as_dicts)))
+    print("bytes per contact, ContactRecord: {0:.0f}".format(container_bytes(as_records)))
@@ -0,0 +1,322 @@
+"""
+Relational datasets
+
+Customers with their orders, and the orders' lines: related tables generated together,
+declared in datasets.yaml. Each table's rows have primary keys id_start, id_start + id_step...
+and a child table's foreign key is drawn from its parent's range of primary keys, so
+no table's rows are kept once written, however many millions there are:
+
+    per_parent  each parent row has a number of children drawn from a distribution (as a
+                schema column: lookup, e.g. a skewed WeightedChoice table of orders per
+                customer; choice; or distribution). Children are made straight after each
+                block of their parents, and point at them
+    rows        a fixed number of rows, each pointing at a parent drawn at random from the
+                parent's (fixed) number of rows
+
+Other columns are as in schemas.yaml (see schema.py), or the table is contacts: people
+from RandomContact, with the fields of the outgoing filter, as Output.save writes them.
+
+All the tables are written at once, as they are made:
+
+    csv                 a file per table (shop.csv: shop-customer.csv, shop-order.csv...),
+                        with an 'id' column and the foreign key first
+    sqlite              a table per table, in one database
+    postgres_copy, django_yaml_fixture, django_json_fixture, jsonl
+                        one file, tables in dependency order (parents first)
+
+    dataset = Dataset(load_datasets()['shop'], 'shop', seed=1, rows={'customer': 100000})
+    dataset.save('shop.db', 'sqlite')
+
+    python -m relational shop shop.db --format sqlite --rows customer=100000 --seed 1
+"""
+
+import os
+import csv
+import random
+import shutil
+import argparse
+
+import fieldmap
+import filelinks
+from schema import BadSchema, compile_schema, load_schemas, COMPILERS
+from randomcontact import RandomContact
+from fixturewriter import FixtureWriter
+from sqlwriter import SQLiteWriter, CopyWriter
+from output import Output
+
+# the standard datasets, alongside schemas.yaml
+datasets_path = os.path.join(filelinks.base_dir(), "datasets.yaml")
+
+DEFAULT_BATCH_ROWS = 1000
+FORMATS = ('csv', 'sqlite', 'postgres_copy', 'django_yaml_fixture', 'django_json_fixture', 'jsonl')
+# kinds of column that can give each parent's number of children
+FAN_OUT_KINDS = ('lookup', 'choice', 'distribution')
+
+
+def load_datasets(path=None):
+    """datasets (name: tables) from a YAML file (default datasets.yaml)"""
+    import yaml
+    with open(path or datasets_path) as f:
+        return yaml.safe_load(f)
+
+
+class Table:
+    """one table of a dataset: makes its rows a block at a time"""
+
+    def __init__(self, name, spec, parent=None, seed=None, lookup_root=None, schemas=None, rows=None):
+        if not isinstance(spec, dict):
+            raise BadSchema("table '{0}' has no definition".format(name))
+        self.name = name
+        self.table = spec.get('table', name)
+        self.model = spec.get('model', name)
+        self.parent = parent
+        self.id_start = spec.get('id_start', 1)
+        self.id_step = spec.get('id_step', 1)
+        self.rows = rows if rows is not None else spec.get('rows')
+        # random streams for the table's own draws, independent of the other tables'
+        self.rng = random.Random("{0}:{1}".format(seed, name))
+        self.next_record = 0
+        self.rows_written = 0
+        sources = [source for source in ('contacts', 'columns', 'schema') if spec.get(source)]
+        if len(sources) != 1:
+            raise BadSchema("table '{0}' needs exactly one of: contacts, columns, schema".format(name))
+        self.plan = self.contacts = None
+        if sources == ['contacts']:
+            self.contacts = RandomContact(seed=seed)
+            self.translator = fieldmap.outgoing_translator(fieldmap.DEFAULT_FILTER)
+            columns = Output.csv_header()
+        else:
+            if sources == ['schema']:
+                schemas = schemas if schemas is not None else load_schemas()
+                if spec['schema'] not in schemas:
+                    raise BadSchema("table '{0}': no schema '{1}'".format(name, spec['schema']))
+                schema = schemas[spec['schema']]
+            else:
+                schema = {'columns': spec['columns']}
+            self.plan = compile_schema(schema, name, "{0}:{1}:columns".format(seed, name), lookup_root)
+            columns = self.plan.columns
+        self.per_parent = None
+        if parent is None:
+            self.foreign_key = None
+            if self.rows is None or 'per_parent' in spec:
+                raise BadSchema("table '{0}' has no parent, so needs rows (and no per_parent)".format(name))
+        else:
+            self.foreign_key = spec.get('foreign_key', parent.name + '_id')
+            if ('per_parent' in spec) == (self.rows is not None):
+                raise BadSchema("table '{0}' needs exactly one of: per_parent, rows".format(name))
+            if 'per_parent' in spec:
+                self.per_parent = self.compile_fan_out(spec['per_parent'], lookup_root)
+            elif parent.rows is None:
+                raise BadSchema("table '{0}' draws its parents at random, so its parent '{1}' needs rows".format(
+                    name, parent.name))
+        self.columns = ([self.foreign_key] if self.foreign_key else []) + [c for c in columns if c != self.foreign_key]
+
+    def compile_fan_out(self, spec, lookup_root):
+        kinds = set(spec) & set(FAN_OUT_KINDS) if isinstance(spec, dict) else set()
+        if len(kinds) != 1:
+            raise BadSchema("per_parent of table '{0}' needs exactly one of: {1}".format(
+                self.name, ', '.join(FAN_OUT_KINDS)))
+        kind = kinds.pop()
+        try:
+            return COMPILERS[kind](spec[kind] or {}, lookup_root or filelinks.lookup_root())
+        except (KeyError, TypeError, ValueError) as e:
+            raise BadSchema("per_parent of table '{0}': bad {1} ({2})".format(self.name, kind, e))
+
+    def fan_out(self, n):
+        """number of children of each of n parent rows"""
+        return [max(0, int(float(count))) for count in self.per_parent(self.rng, 0, n, {})]
+
+    def random_parent_ids(self, n):
+        """n primary keys of the parent table, drawn at random from its range"""
+        rand = self.rng.random
+        parent = self.parent
+        return [parent.id_start + int(rand() * parent.rows) * parent.id_step for i in range(n)]
+
+    def batch(self, n, parent_ids=None):
+        """the next n rows: (primary keys, a dict of fields per row), children of parent_ids"""
+        start = self.next_record
+        self.next_record += n
+        pks = list(range(self.id_start + start * self.id_step, self.id_start + (start + n) * self.id_step,
+                         self.id_step)) if self.id_step else [self.id_start] * n
+        if self.contacts is not None:
+            translator = self.translator
+            rows = [translator.schema(person)(person) for person in self.contacts.records(start, start + n)]
+        else:
+            block = self.plan.batch(n)
+            columns = self.plan.columns
+            rows = [dict(zip(columns, values)) for values in zip(*[block[column] for column in columns])]
+        if parent_ids is not None:
+            foreign_key = self.foreign_key
+            rows = [dict({foreign_key: parent_id}, **row) for parent_id, row in zip(parent_ids, rows)]
+        self.rows_written += n
+        return pks, rows
+
+
+class Dataset:
+    """related tables, made together; see the module docstring"""
+
+    def __init__(self, spec, name='dataset', seed=None, lookup_root=None, schemas=None, rows=None,
+                 batch_rows=DEFAULT_BATCH_ROWS):
+        """
+        spec: tables (name: definition, parents first), as loaded from datasets.yaml
+        seed: makes the dataset repeatable (chosen at random if not given)
+        rows: number of rows of tables with a fixed number, overriding the spec's (table name: rows)
+        """
+        if not isinstance(spec, dict) or not spec:
+            raise BadSchema("dataset '{0}' has no tables".format(name))
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        rows = rows or {}
+        unknown = set(rows) - set(spec)
+        if unknown:
+            raise BadSchema("dataset '{0}' has no table(s): {1}".format(name, ', '.join(sorted(unknown))))
+        self.name = name
+        self.seed = seed
+        self.batch_rows = batch_rows
+        self.tables = {}
+        # children drawn per parent row, by parent
+        self.children = {}
+        for table_name, table_spec in spec.items():
+            parent_name = table_spec.get('parent') if isinstance(table_spec, dict) else None
+            if parent_name is not None and parent_name not in self.tables:
+                raise BadSchema("table '{0}' of dataset '{1}': parent '{2}' must come before it".format(
+                    table_name, name, parent_name))
+            table = Table(table_name, table_spec, self.tables.get(parent_name), seed, lookup_root, schemas,
+                          rows.get(table_name))
+            self.tables[table_name] = table
+            self.children[table_name] = []
+            if table.per_parent is not None:
+                self.children[parent_name].append(table)
+
+    def blocks(self):
+        """(table, primary keys, rows) a block at a time, each block of rows before its children"""
+        for table in self.tables.values():
+            if table.per_parent is not None:
+                # made along with its parent's rows
+                continue
+            for start in range(0, table.rows, self.batch_rows):
+                n = min(self.batch_rows, table.rows - start)
+                parent_ids = table.random_parent_ids(n) if table.parent is not None else None
+                yield from self.family(table, table.batch(n, parent_ids))
+
+    def family(self, table, block):
+        """a block of table's rows, then their children (and theirs...)"""
+        yield (table,) + block
+        pks = block[0]
+        for child in self.children[table.name]:
+            parent_ids = [pk for pk, count in zip(pks, child.fan_out(len(pks))) for i in range(count)]
+            for start in range(0, len(parent_ids), self.batch_rows):
+                chunk = parent_ids[start:start + self.batch_rows]
+                yield from self.family(child, child.batch(len(chunk), chunk))
+
+    def save(self, output_filename, output_filetype='csv'):
+        """
+        write all the tables (see the module docstring for the formats)
+        returns a list of the files written
+        """
+        if output_filetype not in FORMATS:
+            raise ValueError("Unknown output file type '{0}' (expected one of {1})".format(
+                output_filetype, ', '.join(FORMATS)))
+        connection = SQLiteWriter.connect(output_filename) if output_filetype == 'sqlite' else None
+        writers = {}
+        files = []
+        opened = []
+        try:
+            for table in self.tables.values():
+                if connection is not None:
+                    writers[table.name] = SQLiteWriter(output_filename, table.table, table.columns,
+                                                       connection=connection)
+                    continue
+                filename = table_filename(output_filename, table.name)
+                outputfile = open(filename, 'w', newline='')
+                opened.append(outputfile)
+                files.append(filename)
+                if output_filetype == 'csv':
+                    writers[table.name] = CSVTableWriter(outputfile, table.columns)
+                elif output_filetype == 'postgres_copy':
+                    writers[table.name] = CopyWriter(outputfile, table.table, table.columns)
+                else:
+                    writers[table.name] = FixtureWriter(outputfile, table.model,
+                                                        Output.FIXTURE_FORMATS[output_filetype])
+            for table, pks, rows in self.blocks():
+                write = writers[table.name].write
+                for pk, row in zip(pks, rows):
+                    write(pk, row)
+            for writer in writers.values():
+                writer.close()
+        finally:
+            for outputfile in opened:
+                outputfile.close()
+            if connection is not None:
+                connection.close()
+        if output_filetype == 'csv':
+            return files
+        if output_filetype == 'sqlite':
+            return [output_filename]
+        # one file, parents first
+        if output_filetype == 'postgres_copy':
+            # each table's COPY statement is complete: they go one after another
+            with open(output_filename, 'w', newline='') as outputfile:
+                for filename in files:
+                    with open(filename, newline='') as part:
+                        shutil.copyfileobj(part, outputfile)
+                    os.unlink(filename)
+        else:
+            Output.merge(files, output_filename, output_filetype)
+        return [output_filename]
+
+
+class CSVTableWriter:
+    """
+    write records to an open text file as CSV: a heading row of pk_column and columns,
+    then a row per record. Same interface as FixtureWriter
+    """
+
+    def __init__(self, outputfile, columns, pk_column='id'):
+        self.columns = tuple(columns)
+        self.writer = csv.writer(outputfile)
+        self.writer.writerow((pk_column,) + self.columns)
+        self.rows_written = 0
+
+    def write(self, pk, fields):
+        get = fields.get
+        self.writer.writerow([pk] + [get(column) for column in self.columns])
+        self.rows_written += 1
+
+    def close(self):
+        """(the file is left open)"""
+        pass
+
+
+def table_filename(output_filename, table_name):
+    """e.g. shop.csv, order -> shop-order.csv"""
+    root, ext = os.path.splitext(output_filename)
+    return "{0}-{1}{2}".format(root, table_name, ext)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate related tables (customers, orders...) together")
+    parser.add_argument('dataset', help="name of a dataset in the dataset file")
+    parser.add_argument('output', help="output file (for CSV, a file per table is named after it)")
+    parser.add_argument('--format', default='csv', choices=FORMATS)
+    parser.add_argument('--rows', action='append', default=[], metavar='TABLE=N',
+                        help="rows of a table with a fixed number of rows (repeatable)")
+    parser.add_argument('--datasets', help="dataset file (default datasets.yaml)")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    datasets = load_datasets(args.datasets)
+    if args.dataset not in datasets:
+        parser.error("no dataset '{0}' (datasets: {1})".format(args.dataset, ', '.join(sorted(datasets))))
+    try:
+        rows = {table: int(n) for table, n in (setting.split('=', 1) for setting in args.rows)}
+    except ValueError:
+        parser.error("--rows takes TABLE=N")
+    dataset = Dataset(datasets[args.dataset], args.dataset, args.seed, rows=rows)
+    dataset.save(args.output, args.format)
+    for table in dataset.tables.values():
+        print("{0}: {1} rows".format(table.name, table.rows_written))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""
+Schema-driven generation
+
+Contacts have their own pipeline (RandomContact); anything else (orders, grocery baskets,
+log lines...) can be described in a YAML schema (see schemas.yaml) and generated without
+writing any Python:
+
+    line_item:
+        columns:
+            line_id:  {sequence: {start: 1}}
+            item:     {lookup: {file: groceries.csv, field: name}}
+            quantity: {distribution: {type: integer, low: 1, high: 6}}
+            price:    {distribution: {type: normal, mean: 4.5, sd: 2.0, min: 0.5, round: 2}}
+            summary:  {template: "{quantity} x {item}"}
+
+Column kinds:
+
+    lookup          weighted lookup table (a CSV in the lookups directory, or a path), as
+                    for names: file, field, optional engine ('cumulative' or 'alias',
+                    see weighted.py), which draws the values
+    choice          values with optional weights, given in the schema
+    distribution    type 'normal' (mean, sd), 'uniform' (low, high), 'integer' (low, high,
+                    inclusive) or 'exponential' (mean); optional min, max, round
+                    (decimal places: 0 gives integers)
+    sequence        start (default 1), step (default 1): the record number, scaled
+    date            uniform between start and end (inclusive) as text: format (strftime,
+                    default %d/%m/%Y)
+    timestamp       uniform between start and end to the second: format (strftime,
+                    default ISO 8601)
+    template        str.format text using other columns by name
+
+Any column can have 'format' (a str.format pattern applied to each value, e.g. 'ORD-{0:06d}')
+and 'hidden: true' (generated for use in templates, but not output).
+
+A schema is compiled once into a Plan: the lookups are loaded, and each column becomes
+a function generating a whole batch of values at once.
+
+    plan = compile_schema(load_schemas()['line_item'], seed=1)
+    plan.batch(10000)               # dict of columns, 10000 values each
+    plan.rows(10000)                # dicts, one per record, generated in batches
+    plan.save('lines.csv', 10000)   # CSV or JSON Lines
+
+    python -m schema line_item 1000 lines.csv
+"""
+
+import os
+import re
+import csv
+import json
+import random
+import datetime
+import argparse
+import itertools
+
+import filelinks
+
+# the standard schemas, alongside translations.yaml
+schemas_path = os.path.join(filelinks.base_dir(), "schemas.yaml")
+
+DEFAULT_BATCH_ROWS = 10000
+KINDS = ('lookup', 'choice', 'distribution', 'sequence', 'date', 'timestamp', 'template')
+DISTRIBUTIONS = ('normal', 'uniform', 'integer', 'exponential')
+
+
+class BadSchema(Exception):
+    pass
+
+
+def load_schemas(path=None):
+    """schemas (name: schema) from a YAML file (default schemas.yaml)"""
+    import yaml
+    with open(path or schemas_path) as f:
+        return yaml.safe_load(f)
+
+
+class Plan:
+    """a compiled schema: column generators in the order they must run"""
+
+    def __init__(self, name, steps, output_columns, seed=None):
+        self.name = name
+        # (column name, function(rng, start, n, block) returning n values; block has
+        # the columns generated so far)
+        self.steps = steps
+        self.columns = output_columns
+        self.rng = random.Random(seed)
+        # record number of the next batch's first record
+        self.next_record = 0
+
+    def batch(self, n):
+        """the next n records, as a dict of columns (one list of n values per output column)"""
+        start = self.next_record
+        self.next_record += n
+        block = {}
+        for column, generate in self.steps:
+            block[column] = generate(self.rng, start, n, block)
+        return {column: block[column] for column in self.columns}
+
+    def rows(self, n, batch_rows=DEFAULT_BATCH_ROWS):
+        """the next n records, one dict per record, generated in batches"""
+        columns = self.columns
+        while n > 0:
+            size = min(n, batch_rows)
+            block = self.batch(size)
+            for values in zip(*[block[column] for column in columns]):
+                yield dict(zip(columns, values))
+            n -= size
+
+    def save(self, filename, n, output_filetype=None, batch_rows=DEFAULT_BATCH_ROWS):
+        """
+        write the next n records to filename as 'csv' or 'jsonl'
+        (by default, chosen by the file's extension)
+        returns the number of records written
+        """
+        if output_filetype is None:
+            output_filetype = 'jsonl' if filename.endswith(('.jsonl', '.json')) else 'csv'
+        if output_filetype not in ('csv', 'jsonl'):
+            raise ValueError("Unknown output file type '{0}' (expected csv or jsonl)".format(output_filetype))
+        columns = self.columns
+        with open(filename, 'w', newline='') as f:
+            if output_filetype == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(columns)
+            remaining = n
+            while remaining > 0:
+                size = min(remaining, batch_rows)
+                block = self.batch(size)
+                records = zip(*[block[column] for column in columns])
+                if output_filetype == 'csv':
+                    writer.writerows(records)
+                else:
+                    f.write(''.join([json.dumps(dict(zip(columns, values))) + '\n' for values in records]))
+                remaining -= size
+        return n
+
+
+def compile_schema(schema, name='schema', seed=None, lookup_root=None):
+    """
+    Plan from a schema (a dict, as loaded from YAML)
+    seed: makes the records repeatable (chosen at random if not given)
+    lookup_root: where lookup files named in the schema are found (default: the lookups directory)
+    """
+    if not isinstance(schema, dict) or not isinstance(schema.get('columns'), dict) or not schema['columns']:
+        raise BadSchema("schema '{0}' has no columns".format(name))
+    lookup_root = lookup_root or filelinks.lookup_root()
+    steps = []
+    templates = []
+    output_columns = []
+    for column, spec in schema['columns'].items():
+        if not isinstance(spec, dict) or len(set(spec) & set(KINDS)) != 1:
+            raise BadSchema("column '{0}' of schema '{1}' needs exactly one of: {2}".format(
+                column, name, ', '.join(KINDS)))
+        kind = (set(spec) & set(KINDS)).pop()
+        if not spec.get('hidden'):
+            output_columns.append(column)
+        try:
+            if kind == 'template':
+                # run after every other kind, so they can use any column
+                templates.append((column, spec))
+                continue
+            generate = COMPILERS[kind](spec[kind] or {}, lookup_root)
+        except (KeyError, TypeError, ValueError) as e:
+            raise BadSchema("column '{0}' of schema '{1}': bad {2} ({3})".format(column, name, kind, e))
+        steps.append((column, formatted(generate, spec.get('format'))))
+    # templates run in the order given, so each can use those before it
+    available = {column for column, generate in steps}
+    for column, spec in templates:
+        fields = template_fields(spec['template'])
+        missing = fields - available
+        if missing:
+            raise BadSchema("template column '{0}' of schema '{1}' uses unknown or later column(s): {2}".format(
+                column, name, ', '.join(sorted(missing))))
+        steps.append((column, formatted(compile_template(spec['template']), spec.get('format'))))
+        available.add(column)
+    return Plan(name, steps, output_columns, seed)
+
+
+def formatted(generate, pattern):
+    if not pattern:
+        return generate
+    format_value = pattern.format
+
+    def generate_formatted(rng, start, n, block):
+        return [format_value(value) for value in generate(rng, start, n, block)]
+    return generate_formatted
+
+
+def template_fields(template):
+    return set(re.findall(r'(?<!{){([A-Za-z_][A-Za-z0-9_]*)', template))
+
+
+def compile_lookup(spec, lookup_root):
+    from weighted import WeightedChoice
+    filename = spec['file']
+    if not os.path.isabs(filename):
+        filename = os.path.join(lookup_root, filename)
+    engine = spec.get('engine', 'cumulative')
+    if engine not in WeightedChoice.ENGINES:
+        raise ValueError("unknown engine '{0}'".format(engine))
+    lookup = WeightedChoice(filename, name_field=spec['field'], engine=engine)
+    values = list(lookup.name_list)
+    cum_weights = list(lookup.weight_ceiling)
+    if not values:
+        raise ValueError("{0} is empty".format(filename))
+
+    if engine == 'alias':
+        select = lookup._alias_select
+
+        def generate(rng, start, n, block):
+            return [values[select(rng)] for i in range(n)]
+        return generate
+
+    def generate(rng, start, n, block):
+        # the cumulative engine: a binary search of the cumulative weights per draw
+        return rng.choices(values, cum_weights=cum_weights, k=n)
+    return generate
+
+
+def compile_choice(spec, lookup_root):
+    if isinstance(spec, list):
+        spec = {'values': spec}
+    values = list(spec['values'])
+    weights = spec.get('weights')
+    cum_weights = list(itertools.accumulate(weights)) if weights else None
+    if cum_weights is not None and len(cum_weights) != len(values):
+        raise ValueError("values and weights differ in length")
+
+    def generate(rng, start, n, block):
+        return rng.choices(values, cum_weights=cum_weights, k=n)
+    return generate
+
+
+def compile_distribution(spec, lookup_root):
+    kind = spec['type']
+    if kind == 'normal':
+        mean, sd = float(spec['mean']), float(spec['sd'])
+        draw = lambda rng, n: [rng.gauss(mean, sd) for i in range(n)]
+    elif kind == 'uniform':
+        low, high = float(spec['low']), float(spec['high'])
+        draw = lambda rng, n: [rng.uniform(low, high) for i in range(n)]
+    elif kind == 'integer':
+        low, high = int(spec['low']), int(spec['high'])
+        span = high - low + 1
+        draw = lambda rng, n: [low + int(rng.random() * span) for i in range(n)]
+    elif kind == 'exponential':
+        rate = 1.0 / float(spec['mean'])
+        draw = lambda rng, n: [rng.expovariate(rate) for i in range(n)]
+    else:
+        raise ValueError("unknown distribution '{0}' (expected one of {1})".format(kind, ', '.join(DISTRIBUTIONS)))
+    floor = spec.get('min')
+    ceiling = spec.get('max')
+    places = spec.get('round')
+
+    def generate(rng, start, n, block):
+        values = draw(rng, n)
+        if floor is not None:
+            values = [floor if value < floor else value for value in values]
+        if ceiling is not None:
+            values = [ceiling if value > ceiling else value for value in values]
+        if places == 0:
+            values = [int(round(value)) for value in values]
+        elif places is not None:
+            values = [round(value, places) for value in values]
+        return values
+    return generate
+
+
+def compile_sequence(spec, lookup_root):
+    first = spec.get('start', 1)
+    step = spec.get('step', 1)
+
+    def generate(rng, start, n, block):
+        return list(range(first + start * step, first + (start + n) * step, step)) if step else [first] * n
+    return generate
+
+
+def as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(str(value))
+
+
+def compile_date(spec, lookup_root):
+    first = as_datetime(spec['start']).date()
+    last = as_datetime(spec['end']).date()
+    if last < first:
+        raise ValueError("end is before start")
+    date_format = spec.get('format', '%d/%m/%Y')
+    # every date in the range, formatted once
+    dates = [(first + datetime.timedelta(days=i)).strftime(date_format)
+             for i in range((last - first).days + 1)]
+    span = len(dates)
+
+    def generate(rng, start, n, block):
+        rand = rng.random
+        return [dates[int(rand() * span)] for i in range(n)]
+    return generate
+
+
+def compile_timestamp(spec, lookup_root):
+    first = as_datetime(spec['start'])
+    last = as_datetime(spec['end'])
+    span = int((last - first).total_seconds()) + 1
+    if span <= 0:
+        raise ValueError("end is before start")
+    timestamp_format = spec.get('format')
+    epoch = first.timestamp() if first.tzinfo else (first - datetime.datetime(1970, 1, 1)).total_seconds()
+    utc = datetime.timezone.utc
+
+    def generate(rng, start, n, block):
+        rand = rng.random
+        times = [datetime.datetime.fromtimestamp(epoch + int(rand() * span), utc) for i in range(n)]
+        if first.tzinfo is None:
+            times = [t.replace(tzinfo=None) for t in times]
+        if timestamp_format:
+            return [t.strftime(timestamp_format) for t in times]
+        return [t.isoformat() for t in times]
+    return generate
+
+
+def compile_template(template):
+    format_record = template.format_map
+    fields = sorted(template_fields(template))
+
+    def generate(rng, start, n, block):
+        columns = [block[field] for field in fields]
+        return [format_record(dict(zip(fields, values))) for values in zip(*columns)]
+    return generate
+
+
+COMPILERS = {'lookup': compile_lookup,
+             'choice': compile_choice,
+             'distribution': compile_distribution,
+             'sequence': compile_sequence,
+             'date': compile_date,
+             'timestamp': compile_timestamp}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate records from a YAML schema")
+    parser.add_argument('schema', help="name of a schema in the schema file")
+    parser.add_argument('rows', type=int)
+    parser.add_argument('output', help="output file (.csv, or .jsonl for JSON Lines)")
+    parser.add_argument('--schemas', help="schema file (default schemas.yaml)")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    schemas = load_schemas(args.schemas)
+    if args.schema not in schemas:
+        parser.error("no schema '{0}' (schemas: {1})".format(args.schema, ', '.join(sorted(schemas))))
+    plan = compile_schema(schemas[args.schema], args.schema, args.seed)
+    plan.save(args.output, args.rows)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
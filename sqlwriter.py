@@ -0,0 +1,177 @@
+"""
+SQL writers
+
+Load generated people straight into a database instead of going through a fixture:
+
+SQLiteWriter    inserts into a SQLite database: rows are buffered and inserted with
+                executemany, many batches to a transaction, with journalling and syncing
+                turned down while the table is loaded
+CopyWriter      writes a PostgreSQL COPY ... FROM STDIN script in text format, to load with
+                psql -f people.sql (or its data part with COPY ... FROM a file)
+
+Both have the same interface as FixtureWriter (write(pk, fields), flush(), close())
+and write one column per field name given, plus the primary key.
+Fields missing from a record are written as NULL.
+"""
+
+import sqlite3
+
+
+def quote_identifier(name):
+    """SQL identifier in double quotes (column names such as 'First name' have spaces)"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLiteWriter:
+    """
+    write records to a table in a SQLite database, e.g.
+
+        writer = SQLiteWriter('people.db', 'customer', ['First name', 'Last Name', ...])
+        writer.write(pk, fields)
+        ...
+        writer.close()
+
+    The table is created (a column of type TEXT for each field, and an INTEGER PRIMARY KEY
+    named pk_column), replacing any table of that name unless replace is False
+    connection: an open connection to the database (from connect()) to share with writers
+    of other tables, instead of the writer's own; it is left open on close
+    """
+
+    # the database is being bulk loaded, and is of no use if the load fails:
+    # no rollback journal or fsyncs, and a large page cache
+    PRAGMAS = ('PRAGMA journal_mode = OFF',
+               'PRAGMA synchronous = OFF',
+               'PRAGMA temp_store = MEMORY',
+               'PRAGMA cache_size = -65536')
+
+    def __init__(self, database, table, columns, pk_column='id', replace=True, batch_rows=5000,
+                 transaction_rows=500000, connection=None):
+        self.database = database
+        self.table = table
+        self.columns = tuple(columns)
+        self.batch_rows = batch_rows
+        self.transaction_rows = transaction_rows
+        self.own_connection = connection is None
+        self.connection = self.connect(database) if connection is None else connection
+        if replace:
+            self.connection.execute("DROP TABLE IF EXISTS " + quote_identifier(table))
+        all_columns = [quote_identifier(pk_column)] + [quote_identifier(c) for c in self.columns]
+        self.connection.execute("CREATE TABLE IF NOT EXISTS {0} ({1} INTEGER PRIMARY KEY, {2})".format(
+            quote_identifier(table), all_columns[0], ', '.join(c + ' TEXT' for c in all_columns[1:])))
+        self.insert = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            quote_identifier(table), ', '.join(all_columns), ', '.join('?' * len(all_columns)))
+        self.buffer = []
+        self.rows_written = 0
+        self.in_transaction = 0
+
+    @classmethod
+    def connect(cls, database):
+        """connection to database set up for bulk loading"""
+        connection = sqlite3.connect(database, isolation_level=None)
+        for pragma in cls.PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def write(self, pk, fields):
+        """add one record: pk (primary key) and a dict of field values"""
+        get = fields.get
+        self.buffer.append((pk,) + tuple([get(column) for column in self.columns]))
+        if len(self.buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        # (a shared connection may be in a transaction begun by another writer)
+        if not self.connection.in_transaction:
+            self.connection.execute('BEGIN')
+        self.connection.executemany(self.insert, self.buffer)
+        self.in_transaction += len(self.buffer)
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+        if self.in_transaction >= self.transaction_rows:
+            self.commit()
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+        self.in_transaction = 0
+
+    def close(self):
+        """write out any buffered records, commit and close the database (unless the connection is shared)"""
+        self.flush()
+        self.commit()
+        if self.own_connection:
+            self.connection.close()
+
+    @staticmethod
+    def merge(part_databases, database, table):
+        """copy table from each of part_databases in order into database (created if need be)"""
+        connection = SQLiteWriter.connect(database)
+        try:
+            for part_no, part in enumerate(part_databases):
+                connection.execute("ATTACH DATABASE ? AS part", (part,))
+                if part_no == 0:
+                    schema = connection.execute("SELECT sql FROM part.sqlite_master WHERE type = 'table' AND name = ?",
+                                                (table,)).fetchone()[0]
+                    # qualified: unqualified, a missing main table would resolve to the part's
+                    connection.execute("DROP TABLE IF EXISTS main." + quote_identifier(table))
+                    connection.execute(schema)
+                connection.execute('BEGIN')
+                connection.execute("INSERT INTO main.{0} SELECT * FROM part.{0}".format(quote_identifier(table)))
+                connection.execute('COMMIT')
+                connection.execute("DETACH DATABASE part")
+        finally:
+            connection.close()
+
+
+def copy_text(value):
+    """a value in PostgreSQL COPY text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+class CopyWriter:
+    """
+    write records to an open text file as a PostgreSQL COPY script:
+
+        COPY "customer" ("id", "First name", ...) FROM STDIN;
+        1<tab>Fred<tab>...
+        \\.
+
+    Rows are buffered and written in blocks
+    """
+
+    def __init__(self, outputfile, table, columns, pk_column='id', buffer_rows=1000):
+        self.outputfile = outputfile
+        self.columns = tuple(columns)
+        self.buffer_rows = buffer_rows
+        self.buffer = []
+        self.rows_written = 0
+        self.outputfile.write(self.copy_statement(table, self.columns, pk_column) + '\n')
+
+    @staticmethod
+    def copy_statement(table, columns, pk_column='id'):
+        return "COPY {0} ({1}) FROM STDIN;".format(
+            quote_identifier(table), ', '.join(quote_identifier(c) for c in (pk_column,) + tuple(columns)))
+
+    def write(self, pk, fields):
+        """add one record: pk (primary key) and a dict of field values"""
+        get = fields.get
+        self.buffer.append(str(pk) + '\t' + '\t'.join([copy_text(get(column)) for column in self.columns]))
+        if len(self.buffer) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.outputfile.write('\n'.join(self.buffer) + '\n')
+        self.rows_written += len(self.buffer)
+        self.buffer = []
+
+    def close(self):
+        """write out any buffered records and end the COPY data (the file is left open)"""
+        self.flush()
+        self.outputfile.write('\\.\n')
@@ -1,17 +1,80 @@
 import unittest
 import csv
 import os
-from exceptions import MissingPopularityException, NegSampleSizeException
+import re
+import io
+import json
+import pickle
+import codecs
+import sqlite3
+import asyncio
+import urllib.request
+import itertools
+import shutil
+import subprocess
+import sys
+from exceptions import MissingPopularityException, NegSampleSizeException, SamplingEngineException, \
+    LookupBackendException
 from randomcontact import RandomContact
 from weighted import WeightedChoice
-from filelinks import test_data_input_file, test_data_output_file
+from namebuilder import NameBuilder
+import fieldmap
+from output import Output
+from fixturewriter import FixtureWriter
+from counterrandom import CounterRandom
+from uniquesuffix import UniqueSuffix
+from record import ContactRecord
+import dates
+import datetime
+from addressbuilder import AddressBuilder, FirstlineTemplate
+import lookupcache
+import csvindex
+import benchmark
+from contactserver import ContactServer
+import obfuscate
+import columnar
+import checkpoint
+import compressed
+import fileio
+import gzip
+import schema
+import relational
+import validation
+import random
+from instrumentation import Stats, CONTACT_STAGES, OUTPUT_STAGES
+from filelinks import test_data_input_file, test_data_output_file, lookup_file
 from collections import Counter
+import yaml
 
 
 def numbered_sample_output_file(no):
     return test_data_output_file('sample-' + str(no) + '.csv')
 
 
+def make_test_output_dir():
+    """create the test data output directory if it isn't there yet; returns its path"""
+    output_dir = os.path.dirname(test_data_output_file('x'))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    return output_dir
+
+
+def cumulative_distribution(name_generator):
+    """exact probability of each item under the cumulative-weight engine"""
+    ceilings = list(name_generator.weight_ceiling)
+    floors = [0.0] + ceilings[:-1]
+    return [(c - f) / ceilings[-1] for c, f in zip(ceilings, floors)]
+
+
+def alias_distribution(name_generator):
+    """exact probability of each item implied by an alias table"""
+    n = len(name_generator.alias)
+    dist = [p / n for p in name_generator.alias_prob]
+    for column, alias in enumerate(name_generator.alias):
+        dist[alias] += (1.0 - name_generator.alias_prob[column]) / n
+    return dist
+
+
 class TestRandomContact(unittest.TestCase):
 
     def setUp(self):
@@ -74,6 +137,106 @@ class TestRandomContact(unittest.TestCase):
                              len(name_generator.items),
                              self.binary_check_sample_size))
 
+    def test_RN_batch_names(self):
+        """
+        WeightedChoice.names(n) returns n names, all from the lookup, and uses every name
+        """
+        test_fname = test_data_input_file("minimalweightedlookup.csv")
+        name_generator = WeightedChoice(test_fname, name_field="Forename")
+        names = name_generator.names(self.binary_check_sample_size)
+        self.assertEqual(len(names), self.binary_check_sample_size)
+        self.assertEqual(set(names), {"Aaron", "Zebedee"})
+        indices = name_generator.indices(self.medium_sample_size)
+        self.assertTrue(all(0 <= i < len(name_generator.items) for i in indices))
+        self.assertEqual(name_generator.names(0), [])
+
+    def test_RN_batch_gendered_names(self):
+        """
+        NameBuilder.gendered_names(n) gives n-long columns with forenames matching sex
+        """
+        name_builder = NameBuilder()
+        female_names = set(name_builder.female_forename.name_list)
+        male_names = set(name_builder.male_forename.name_list)
+        names = name_builder.gendered_names(self.medium_sample_size)
+        for column in names.values():
+            self.assertEqual(len(column), self.medium_sample_size)
+        for i in range(self.medium_sample_size):
+            forenames = female_names if names['sex_female'][i] else male_names
+            self.assertIn(names['first_name'][i], forenames)
+            self.assertIn(names['middle_name'][i], forenames)
+            self.assertEqual(names['sex'][i], 'female' if names['sex_female'][i] else 'male')
+            self.assertNotEqual(names['sex_female'][i], names['sex_male'][i])
+
+    def test_RN_alias_engine_matches_cumulative(self):
+        """
+        alias and cumulative engines give the same distribution, for both
+        rn_weight and rn_expweight lookups
+        """
+        for fname, name_field in ((test_data_input_file("weightedlookup.csv"), "Forename"),
+                                  (lookup_file("surnames.csv"), "surname"),
+                                  (lookup_file("female_forenames.csv"), "forename")):
+            cumulative = WeightedChoice(fname, name_field=name_field)
+            alias = WeightedChoice(fname, name_field=name_field, engine='alias')
+            self.assertEqual(list(alias.name_list), list(cumulative.name_list))
+            for p_alias, p_cumulative in zip(alias_distribution(alias), cumulative_distribution(cumulative)):
+                self.assertAlmostEqual(p_alias, p_cumulative, places=9)
+
+    def test_RN_alias_engine_samples(self):
+        """
+        sampled frequencies from the alias engine follow the weights
+        """
+        fname = test_data_input_file("weightedlookup.csv")
+        alias = WeightedChoice(fname, name_field="Forename", engine='alias')
+        expected = dict(zip(alias.name_list, cumulative_distribution(alias)))
+        sample_size = 20000
+        for names in (alias.names(sample_size), [alias.name() for i in range(sample_size)]):
+            counts = Counter(names)
+            self.assertEqual(counts["Dora"], 0)
+            for name, p in expected.items():
+                self.assertAlmostEqual(counts[name] / float(sample_size), p, delta=0.02)
+
+    def test_RN_lookup_cache(self):
+        """
+        a cached lookup loads the same as the CSV, and is rebuilt when the CSV changes
+        """
+        make_test_output_dir()
+        fname = test_data_output_file('cachedlookup.csv')
+        shutil.copyfile(test_data_input_file("weightedlookup.csv"), fname)
+        cache_filename = lookupcache.cache_filename(fname, 'WeightedChoice:Forename')
+        if os.path.exists(cache_filename):
+            os.unlink(cache_filename)
+        parsed = WeightedChoice(fname, name_field="Forename", cache=False)
+        first_load = WeightedChoice(fname, name_field="Forename")
+        self.assertTrue(os.path.isfile(cache_filename))
+        cached = WeightedChoice(fname, name_field="Forename")
+        self.assertIsInstance(cached.items, lookupcache.MappedRows)
+        # names are drawn over and over: decoded once, at load
+        self.assertIsInstance(cached.name_list, list)
+        for name_generator in (first_load, cached):
+            self.assertEqual(list(name_generator.name_list), list(parsed.name_list))
+            self.assertEqual(list(name_generator.weight_ceiling), list(parsed.weight_ceiling))
+            self.assertEqual(list(name_generator.items), list(parsed.items))
+        # another key's table has a cache of its own, and both stay good
+        by_weight = WeightedChoice(fname, name_field="rn_weight")
+        self.assertNotEqual(lookupcache.cache_filename(fname, 'WeightedChoice:rn_weight'), cache_filename)
+        self.assertIsNotNone(lookupcache.read_cache(fname, 'WeightedChoice:Forename'))
+        self.assertIsNotNone(lookupcache.read_cache(fname, 'WeightedChoice:rn_weight'))
+        self.assertEqual(list(by_weight.name_list), [item['rn_weight'] for item in parsed.items])
+        # same contents, new modification time: cache still good
+        os.utime(fname, (0, 0))
+        self.assertIsNotNone(lookupcache.read_cache(fname, 'WeightedChoice:Forename'))
+        # different contents: rebuilt
+        with open(fname, 'a') as f:
+            f.write('"Fenella",3\n')
+        self.assertIsNone(lookupcache.read_cache(fname, 'WeightedChoice:Forename'))
+        self.assertEqual(WeightedChoice(fname, name_field="Forename").name_list[-1], "Fenella")
+        # a cache built for a different name field isn't used
+        self.assertIsNone(lookupcache.read_cache(fname, 'WeightedChoice:Sex'))
+
+    def test_RN_unknown_engine(self):
+        with self.assertRaises(SamplingEngineException):
+            WeightedChoice(test_data_input_file("weightedlookup.csv"), name_field="Forename", engine='magic')
+
 
     def test_RP_save_zero_or_neg_sample(self):
         """
@@ -143,6 +306,1028 @@ class TestRandomContact(unittest.TestCase):
             sex_count['female'],
             delta=self.binary_check_sample_size * sexes_variation_percent / 100.0 + 1.0)
 
+    def test_RP_seekable_records(self):
+        """
+        seeded contacts are repeatable, and any record can be generated directly
+        """
+        contacts = RandomContact(seed=1234).contact()
+        stream = [next(contacts) for i in range(20)]
+        random_access = RandomContact(seed=1234)
+        self.assertEqual(random_access.record(17), stream[17])
+        self.assertEqual(list(random_access.records(5, 10)), stream[5:10])
+        self.assertEqual(next(random_access.contact(start=3)), stream[3])
+        self.assertNotEqual([RandomContact(seed=4321).record(k) for k in range(20)], stream)
+
+    def test_counter_random_seek(self):
+        rng = CounterRandom(99, field='test')
+        rng.seek(1000)
+        draws = [rng.random() for i in range(5)]
+        self.assertTrue(all(0.0 <= d < 1.0 for d in draws))
+        rng.seek(3)
+        rng.random()
+        rng.seek(1000)
+        self.assertEqual([rng.random() for i in range(5)], draws)
+        other_field = CounterRandom(99, field='other')
+        other_field.seek(1000)
+        self.assertNotEqual(other_field.random(), draws[0])
+
+    def test_RP_compact_records(self):
+        """
+        compact contacts hold the same data as dict contacts, and translate the same
+        """
+        as_dicts = list(RandomContact(seed=5).records(0, 20))
+        as_records = list(RandomContact(seed=5, compact=True).records(0, 20))
+        self.assertTrue(all(isinstance(r, ContactRecord) for r in as_records))
+        self.assertEqual(as_records, as_dicts)
+        self.assertEqual([fieldmap.translateOut(r) for r in as_records],
+                         [fieldmap.translateOut(p) for p in as_dicts])
+        record = as_records[0]
+        self.assertEqual(record['first_name'], record.first_name)
+        self.assertNotIn('mob', record)
+        with self.assertRaises(KeyError):
+            record['mob']
+        with self.assertRaises(KeyError):
+            record['not a field'] = 'x'
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+
+    def test_RP_contact_batch(self):
+        """
+        RandomContact.contact_batch(n) returns n-long columns for the same fields as contact()
+        """
+        random_contact = RandomContact()
+        contact_fields = set(next(random_contact.contact()).keys())
+        block = random_contact.contact_batch(self.medium_sample_size)
+        self.assertEqual(set(block.keys()), contact_fields)
+        for column in block.values():
+            self.assertEqual(len(column), self.medium_sample_size)
+        for dob in block['dob']:
+            self.assertTrue(re.match(r'^\d\d/\d\d/\d+$', dob), msg=dob)
+        for username, email in zip(block['username'], block['email']):
+            self.assertIn(username + '@', email)
+        self.assertTrue(all(block['street']))
+        self.assertEqual(random_contact.contact_batch(0)['first_name'], [])
+
+    def test_RP_seeded_contact_batch(self):
+        """
+        a seeded batch is repeatable and holds the same contacts as records();
+        so do the batch draws it is made from
+        """
+        for address_builder in (None, AddressBuilder(backend='indexed')):
+            block = RandomContact(seed=5, address_builder=address_builder).contact_batch(300, start=1000)
+            people = list(RandomContact(seed=5, address_builder=address_builder).records(1000, 1300))
+            self.assertEqual(block, {field: [p[field] for p in people] for field in people[0]})
+        surnames = WeightedChoice(lookup_file("surnames.csv"), name_field="surname", engine='alias')
+        rng = CounterRandom(5, field='name')
+        names = surnames.names(self.medium_sample_size, rng, start=7)
+        self.assertEqual(names, surnames.names(self.medium_sample_size, CounterRandom(5, field='name'), start=7))
+        rng.seek(8)
+        self.assertEqual(names[1], surnames.name(rng))
+        for ages in (dates.NormalAges(), dates.EmpiricalAges(test_data_input_file("agehistogram.csv"))):
+            years = ages.years(self.medium_sample_size, CounterRandom(5, field='dob'), start=3)
+            self.assertEqual(years, ages.years(self.medium_sample_size, CounterRandom(5, field='dob'), start=3))
+            self.assertEqual(years[2:], ages.years(self.medium_sample_size - 2, CounterRandom(5, field='dob'), start=5))
+
+    def test_RP_unique_usernames(self):
+        """
+        usernames (and emails) never repeat, in records or across batches
+        """
+        random_contact = RandomContact(seed=11)
+        people = list(random_contact.records(0, self.medium_sample_size))
+        self.assertEqual(len({p['username'] for p in people}), len(people))
+        self.assertEqual(len({p['email'] for p in people}), len(people))
+        batches = [random_contact.contact_batch(500) for i in range(4)]
+        suffixes = [u.rsplit('-', 1)[1] for batch in batches for u in batch['username']]
+        self.assertEqual(len(set(suffixes)), len(suffixes))
+        self.assertEqual(suffixes, [p['username'].rsplit('-', 1)[1] for p in people])
+
+    def test_RP_unique_suffix_is_a_permutation(self):
+        """
+        a UniqueSuffix permutes every record number of its range, and refuses those outside it
+        """
+        unique = UniqueSuffix(seed=4, bits=20)
+        self.assertEqual(sorted(unique.permute(k) for k in range(1 << 20)), list(range(1 << 20)))
+        self.assertEqual(len(unique.suffix(0)), 4)
+        self.assertEqual(len(UniqueSuffix(seed=4).suffix((1 << 40) - 1)), 8)
+        self.assertNotEqual(UniqueSuffix(seed=5).suffixes(0, 10), UniqueSuffix(seed=4, bits=40).suffixes(0, 10))
+        with self.assertRaises(ValueError):
+            unique.permute(1 << 20)
+
+    def test_RP_birthdays_are_real_dates(self):
+        """
+        birthdays, one at a time or in a batch, are valid dates with matching parts
+        """
+        block = dates.birthdays(self.medium_sample_size)
+        one_by_one = [dates.birthday() for i in range(self.medium_sample_size)]
+        for dob, day, month, year in itertools.chain(
+                zip(block['dob'], block['dob_day'], block['dob_month'], block['dob_year']),
+                ((b['dob'], b['dob_day'], b['dob_month'], b['dob_year']) for b in one_by_one)):
+            datetime.datetime.strptime(dob, '%d/%m/%Y')
+            self.assertEqual(dob, '/'.join((day, month, year)))
+        self.assertEqual(len(dates.year_table(2000)[1]), 29)
+        self.assertEqual(len(dates.year_table(1900)[1]), 28)
+        self.assertEqual(dates.date_fields('dob', 3, 4, 1999),
+                         {'dob': '03/04/1999', 'dob_day': '03', 'dob_month': '04', 'dob_year': '1999'})
+
+    def test_RP_empirical_ages(self):
+        """
+        birth years follow an age histogram: ages 20-24 three times as often as 30
+        """
+        ages = dates.EmpiricalAges(test_data_input_file('agehistogram.csv'), reference_year=2000, cache=False)
+        years = ages.years(self.medium_sample_size) + [ages.year() for i in range(self.medium_sample_size)]
+        self.assertEqual(set(years), {1976, 1977, 1978, 1979, 1980, 1970})
+        self.assertAlmostEqual(years.count(1970) / float(len(years)), 0.25, delta=0.05)
+        random_contact = RandomContact(seed=2, ages=ages)
+        self.assertTrue(all(p['dob_year'] in ('1970', '1976', '1977', '1978', '1979', '1980')
+                            for p in random_contact.records(0, 100)))
+
+    def test_RP_firstline_templates(self):
+        """
+        address first lines: house number, range end and other numbers are slots; the rest is kept
+        """
+        template = FirstlineTemplate('Shop 20 , CS Square, 13/19 Lake Street')
+        self.assertEqual(template.literals, ['Shop ', ' , CS Square, ', '/', ' Lake Street'])
+        self.assertEqual([kind for kind, span in template.slots], ['small', 'small', 'house'])
+        self.assertEqual(template.fill(house=7).split('/')[1], '7 Lake Street')
+        ranged = FirstlineTemplate('109-111 Lucan Street ')
+        for house in (1, 40, 226):
+            self.assertEqual(ranged.fill(house=house), '{0}-{1} Lucan Street '.format(house, house + 2))
+        self.assertEqual(FirstlineTemplate('1st Floor 386 Hargreaves Street').fill(house=4),
+                         '1st Floor 4 Hargreaves Street')
+        self.assertEqual(FirstlineTemplate('17a Hopetoun Street').fill(house=10), '10a Hopetoun Street')
+        self.assertEqual(FirstlineTemplate('Tower Road').fill(), 'Tower Road')
+
+    def test_RP_obfuscated_address_leaves_lookup_alone(self):
+        """
+        obfuscating works on copies: the loaded address rows are never changed
+        """
+        address_builder = AddressBuilder()
+        before = [dict(address) for address in address_builder.firstline_addresses]
+        for i in range(self.medium_sample_size):
+            address = next(address_builder.obfuscated_address())
+            self.assertTrue(address['street'])
+        address_builder.obfuscated_addresses(self.medium_sample_size)
+        self.assertEqual([dict(address) for address in address_builder.firstline_addresses], before)
+
+    def test_RP_indexed_csv(self):
+        """
+        an indexed CSV reads each row as csv.DictReader does (quoted newlines and blank lines too),
+        and its index is rebuilt when the CSV changes
+        """
+        make_test_output_dir()
+        fname = test_data_output_file('indexed.csv')
+        with open(fname, 'w', encoding='cp1252', newline='') as f:
+            f.write('Street,Suburb,Notes\r\n"12 High St",Carlton,"two\r\nlines"\r\n\r\n'
+                    '"3 ""The Mews""",Fitzroy,caf\xe9\r\n9 Low Rd,Kew\r\n')
+        if os.path.exists(csvindex.index_filename(fname)):
+            os.unlink(csvindex.index_filename(fname))
+        with open(fname, encoding='cp1252', newline='') as f:
+            expected = list(csv.DictReader(f))
+        indexed = csvindex.IndexedCSV(fname, encoding='cp1252')
+        self.assertTrue(os.path.isfile(csvindex.index_filename(fname)))
+        reread = csvindex.IndexedCSV(fname, encoding='cp1252')
+        self.assertIsInstance(reread.offsets, memoryview)
+        for rows in (indexed, reread):
+            self.assertEqual(len(rows), len(expected))
+            self.assertEqual([rows[i] for i in range(len(rows))], expected)
+            self.assertEqual(rows[-1], expected[-1])
+        with open(fname, 'a', encoding='cp1252', newline='') as f:
+            f.write('1 New St,Brunswick,\r\n')
+        self.assertEqual(csvindex.IndexedCSV(fname, encoding='cp1252')[3]['Suburb'], 'Brunswick')
+        for rows in (indexed, reread):
+            rows.close()
+
+    def test_RP_indexed_address_backend(self):
+        """
+        the indexed address backend gives addresses from the same file as the in-memory one
+        """
+        in_memory = AddressBuilder()
+        indexed = AddressBuilder(backend='indexed')
+        known = {(address['suburb_town'], address['postal_code']) for address in in_memory.firstline_addresses}
+        for i in range(self.no_of_small_samples):
+            address = next(indexed.obfuscated_address())
+            self.assertTrue(address['street'])
+            self.assertIn((address['suburb_town'], address['postal_code']), known)
+        columns = indexed.obfuscated_addresses(self.no_of_small_samples)
+        self.assertEqual(len(columns['street']), self.no_of_small_samples)
+        contacts = RandomContact(seed=3, compact=True, address_builder=indexed)
+        person = next(contacts.contact())
+        self.assertIn((person['suburb_town'], person['postal_code']), known)
+        with self.assertRaises(LookupBackendException):
+            AddressBuilder(backend='database')
+
+
+class TestFieldmap(unittest.TestCase):
+
+    def setUp(self):
+        self.people = list(RandomContact(seed=11).records(0, 20))
+        self.people[0]['unmapped'] = 'extra'
+
+    def test_translator_matches_transform(self):
+        for filters, translators in ((fieldmap.OUTGOING_FILTERS, fieldmap.OUTGOING_TRANSLATORS),
+                                     (fieldmap.INCOMING_FILTERS, fieldmap.INCOMING_TRANSLATORS)):
+            for filt, fieldmapping in filters.items():
+                for passthru in (False, True):
+                    for p in self.people:
+                        expected = fieldmap.transform(p, fieldmapping, passthru=passthru)
+                        self.assertEqual(translators[filt](p, passthru=passthru), expected)
+                        projection = translators[filt].schema(tuple(p), passthru=passthru)
+                        self.assertEqual(projection(p), expected)
+                        self.assertEqual(dict(zip(projection.output_fields, projection.row(tuple(p.values())))),
+                                         expected)
+
+    def test_config_cache(self):
+        """
+        translation tables are cached by hash of the YAML, and rebuilt when it changes
+        """
+        make_test_output_dir()
+        path = test_data_output_file('translations.yaml')
+        shutil.copyfile(fieldmap.cfgpath, path)
+        if os.path.exists(path + '.cache'):
+            os.unlink(path + '.cache')
+        cfg = fieldmap.load_config(path)
+        self.assertEqual(cfg['Outgoing'], fieldmap.OUTGOING_FILTERS)
+        self.assertTrue(os.path.isfile(path + '.cache'))
+        self.assertEqual(fieldmap.load_config(path), cfg)
+        with open(path, 'a') as f:
+            f.write('\n    ExtraCSV:\n        first_name: Given\n')
+        self.assertEqual(fieldmap.load_config(path)['Outgoing']['ExtraCSV'], {'first_name': 'Given'})
+        with open(path, 'a') as f:
+            f.write('        not_internal: Oops\n')
+        with self.assertRaises(fieldmap.BadTranslationTable):
+            fieldmap.load_config(path)
+
+    def test_atomic_write(self):
+        """
+        a file is replaced whole or not at all, and a failed write leaves no temporary file behind
+        """
+        output_dir = make_test_output_dir()
+        path = test_data_output_file('atomic.txt')
+        with fileio.atomic_write(path, 'w') as f:
+            f.write('whole')
+        before = set(os.listdir(output_dir))
+        with self.assertRaises(RuntimeError):
+            with fileio.atomic_write(path, 'w') as f:
+                f.write('half')
+                raise RuntimeError
+        with open(path) as f:
+            self.assertEqual(f.read(), 'whole')
+        self.assertEqual(set(os.listdir(output_dir)), before)
+
+    def test_lazy_loading(self):
+        """
+        importing the generators doesn't load the translation tables;
+        asking for one filter checks just that filter
+        """
+        code = ("import fieldmap, output, randomcontact, record, validation; loaded = fieldmap._config is not None; "
+                "fieldmap.outgoing_translator('OutlookCSV'); "
+                "print(loaded, sorted(fieldmap._incoming_filters), sorted(fieldmap._outgoing_filters))")
+        result = subprocess.check_output([sys.executable, '-c', code],
+                                         cwd=os.path.dirname(os.path.abspath(fieldmap.__file__)))
+        self.assertEqual(result.decode().split(), ['False', '[]', "['OutlookCSV']"])
+
+    def test_translator_columns(self):
+        random_contact = RandomContact()
+        block = random_contact.contact_batch(50)
+        translator = fieldmap.outgoing_translator('OutlookCSV')
+        columns = translator.columns(block)
+        rows = [dict(zip(block, values)) for values in zip(*block.values())]
+        for i, row in enumerate(rows):
+            self.assertEqual({k: column[i] for k, column in columns.items()}, translator(row))
+
+
+class TestOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.no_of_people = 103
+        make_test_output_dir()
+
+    def test_parallel_yaml_primary_keys(self):
+        """
+        sharded parallel save merges in order with contiguous primary keys
+        """
+        output_filename = test_data_output_file('parallel.yaml')
+        Output.save(self.no_of_people, output_filename, processes=2, shards=4,
+                    yaml_entity='Customer', id_start=10, id_step=3)
+        with open(output_filename) as f:
+            fixture = yaml.safe_load(f)
+        self.assertEqual([record['pk'] for record in fixture],
+                         list(range(10, 10 + 3 * self.no_of_people, 3)))
+        self.assertTrue(all(record['model'] == 'Customer' for record in fixture))
+
+    def test_sqlite_output(self):
+        """
+        SQLite output: a table with the outgoing filter's columns, the same rows in one or many shards
+        """
+        output_filename = test_data_output_file('people.db')
+        Output.save(self.no_of_people, output_filename, output_filetype='sqlite', seed=8, id_start=5)
+        sharded_filename = test_data_output_file('sharded.db')
+        Output.save(self.no_of_people, sharded_filename, output_filetype='sqlite', seed=8, id_start=5,
+                    processes=2, shards=3)
+        tables = []
+        for filename in (output_filename, sharded_filename):
+            connection = sqlite3.connect(filename)
+            cursor = connection.execute('SELECT * FROM customer ORDER BY id')
+            self.assertEqual([column[0] for column in cursor.description], ['id'] + Output.csv_header())
+            tables.append(cursor.fetchall())
+            connection.close()
+        self.assertEqual(tables[0], tables[1])
+        self.assertEqual([row[0] for row in tables[0]], list(range(5, 5 + self.no_of_people)))
+        Output.save(self.no_of_people, test_data_output_file('people.csv'), output_filetype='csv', seed=8)
+        with open(test_data_output_file('people.csv'), newline='') as f:
+            self.assertEqual([tuple(row.values()) for row in csv.DictReader(f)],
+                             [tuple('' if v is None else v for v in row[1:]) for row in tables[0]])
+
+    def test_postgres_copy_output(self):
+        """
+        COPY script: one COPY statement, a tab-separated line per record, one end marker
+        """
+        output_filename = test_data_output_file('people.sql')
+        Output.save(self.no_of_people, output_filename, output_filetype='postgres_copy', seed=8,
+                    processes=2, shards=3, sql_table='people')
+        with open(output_filename) as f:
+            lines = f.read().split('\n')
+        self.assertEqual(lines[0], 'COPY "people" ("id", ' +
+                         ', '.join('"{0}"'.format(c) for c in Output.csv_header()) + ') FROM STDIN;')
+        self.assertEqual(lines[-2:], ['\\.', ''])
+        rows = [line.split('\t') for line in lines[1:-2]]
+        self.assertEqual([int(row[0]) for row in rows], list(range(1, 1 + self.no_of_people)))
+        self.assertTrue(all(len(row) == 1 + len(Output.csv_header()) for row in rows))
+        self.assertTrue(all(row[1] == '\\N' for row in rows))
+
+    def test_unknown_output_filetype(self):
+        """an unknown output_filetype is refused before any file is written"""
+        output_filename = test_data_output_file('people.xml')
+        if os.path.exists(output_filename):
+            os.unlink(output_filename)
+        with self.assertRaises(ValueError):
+            Output.save(self.no_of_people, output_filename, output_filetype='xml', seed=8)
+        self.assertFalse(os.path.exists(output_filename))
+
+    def test_compressed_output(self):
+        """
+        compressed output reads back as the uncompressed output, in one or many shards;
+        SQLite databases are compressed once written
+        """
+        for output_filetype, suffix in (('csv', '.csv'), ('django_yaml_fixture', '.yaml'),
+                                        ('django_json_fixture', '.json')):
+            plain_filename = test_data_output_file('plain' + suffix)
+            Output.save(self.no_of_people, plain_filename, output_filetype=output_filetype, seed=8)
+            with open(plain_filename, newline='') as f:
+                expected = f.read()
+            for shards in (1, 3):
+                files = Output.save(self.no_of_people, test_data_output_file('people' + suffix), seed=8,
+                                    output_filetype=output_filetype, processes=shards, compression='gzip')
+                self.assertEqual(files, [test_data_output_file('people' + suffix + '.gz')])
+                with gzip.open(files[0], 'rt', newline='') as f:
+                    self.assertEqual(f.read(), expected)
+        files = Output.save(self.no_of_people, test_data_output_file('people.db.gz'), output_filetype='sqlite',
+                            seed=8, compression='gzip')
+        self.assertFalse(os.path.exists(test_data_output_file('people.db')))
+        with gzip.open(files[0], 'rb') as f:
+            self.assertTrue(f.read(16).startswith(b'SQLite format 3'))
+        with self.assertRaises(ValueError):
+            Output.save(self.no_of_people, test_data_output_file('people.csv'), output_filetype='csv',
+                        compression='lzma')
+
+    def test_compressed_file_blocks(self):
+        """
+        small blocks make many gzip members, which read back whole and in order
+        """
+        filename = test_data_output_file('blocks.txt.gz')
+        lines = ['line {0}\n'.format(i) for i in range(5000)]
+        with compressed.CompressedFile(filename, 'gzip', block_size=1000, threads=3) as f:
+            for line in lines:
+                f.write(line.encode())
+        with open(filename, 'rb') as f:
+            self.assertGreater(f.read().count(b'\x1f\x8b\x08'), 30)
+        with compressed.open_input(filename, 'gzip') as f:
+            self.assertEqual(f.read(), ''.join(lines))
+
+    @unittest.skipIf(compressed.zstandard is None, "zstandard is not installed")
+    def test_zstd_output(self):
+        files = Output.save(self.no_of_people, test_data_output_file('people.csv'), output_filetype='csv', seed=8,
+                            processes=3, compression='zstd')
+        with compressed.open_input(files[0], 'zstd') as f:
+            self.assertEqual(len(list(csv.DictReader(f))), self.no_of_people)
+
+    def test_columnar_output(self):
+        """
+        columnar files read back (row by row or in row groups) to the same records as CSV,
+        in one or many shards, and are smaller
+        """
+        csv_filename = test_data_output_file('people.csv')
+        Output.save(self.no_of_people, csv_filename, output_filetype='csv', seed=8)
+        with open(csv_filename, newline='') as f:
+            expected = list(csv.DictReader(f))
+        output_filename = test_data_output_file('people.dgc')
+        for shards in (1, 3):
+            Output.save(self.no_of_people, output_filename, output_filetype='columnar', seed=8, processes=shards,
+                        id_start=3)
+            rows = list(columnar.read_columnar(output_filename))
+            self.assertEqual([row.pop('id') for row in rows], list(range(3, 3 + self.no_of_people)))
+            self.assertEqual([{k: '' if v is None else v for k, v in row.items()} for row in rows], expected)
+        with columnar.ColumnarReader(output_filename) as reader:
+            groups = list(reader.row_groups())
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(sum(len(pks) for pks, columns in groups), self.no_of_people)
+        self.assertEqual(set(groups[0][1]), set(Output.csv_header()))
+        self.assertLess(os.path.getsize(output_filename), os.path.getsize(csv_filename))
+
+    @unittest.skipIf(columnar.pyarrow is None, "pyarrow is not installed")
+    def test_parquet_output(self):
+        output_filename = test_data_output_file('people.parquet')
+        Output.save(self.no_of_people, output_filename, output_filetype='parquet', seed=8, processes=2)
+        rows = list(columnar.read_parquet(output_filename))
+        self.assertEqual([row['id'] for row in rows], list(range(1, 1 + self.no_of_people)))
+        self.assertEqual([row['Email'] for row in rows],
+                         [p['email'] for p in RandomContact(seed=8).records(0, self.no_of_people)])
+
+    def test_parallel_csv_parts(self):
+        """
+        unmerged parts are each complete CSV files; merged output has a single heading row
+        """
+        output_filename = test_data_output_file('parallel.csv')
+        parts = Output.save(self.no_of_people, output_filename, output_filetype='csv',
+                            processes=2, shards=3, merge_parts=False)
+        self.assertEqual(len(parts), 3)
+        rows = []
+        for part in parts:
+            with open(part, newline='') as f:
+                rows.extend(csv.DictReader(f))
+            os.unlink(part)
+        self.assertEqual(len(rows), self.no_of_people)
+        Output.save(self.no_of_people, output_filename, output_filetype='csv', processes=2)
+        with open(output_filename, newline='') as f:
+            merged = list(csv.DictReader(f))
+        self.assertEqual(len(merged), self.no_of_people)
+        self.assertTrue(all(row['First name'] != 'First name' for row in merged))
+
+    def test_fixture_writer_matches_yaml_dump(self):
+        """
+        streamed YAML/JSON fixtures load to exactly what yaml.dump per record produces
+        """
+        people = [fieldmap.translateOut(p) for p in RandomContact(seed=7).records(0, self.no_of_people)]
+        people[0]['Street'] = 'Odd "quotes", {braces}: and \u00e9 \nnewline'
+        people[1]['Street'] = 'Beyond the BMP: \U0001F600 and a literal \\ud83d'
+        dumped = ''.join(yaml.dump([{'model': 'harv2.Customer', 'pk': pk, 'fields': p}])
+                         for pk, p in enumerate(people, 1))
+        expected = yaml.safe_load(dumped)
+        for output_format, load in (('yaml', yaml.safe_load), ('json', json.loads)):
+            streamed = io.StringIO()
+            writer = FixtureWriter(streamed, 'harv2.Customer', output_format=output_format, buffer_rows=10)
+            for pk, p in enumerate(people, 1):
+                writer.write(pk, p)
+            writer.close()
+            self.assertEqual(load(streamed.getvalue()), expected)
+        streamed = io.StringIO()
+        writer = FixtureWriter(streamed, 'harv2.Customer', output_format='jsonl')
+        for pk, p in enumerate(people, 1):
+            writer.write(pk, p)
+        writer.close()
+        self.assertEqual([json.loads(line) for line in streamed.getvalue().splitlines()], expected)
+
+    def test_parallel_json_fixture(self):
+        output_filename = test_data_output_file('parallel.json')
+        Output.save(self.no_of_people, output_filename, output_filetype='django_json_fixture',
+                    processes=2, shards=3, seed=3)
+        with open(output_filename) as f:
+            fixture = json.load(f)
+        self.assertEqual([record['pk'] for record in fixture], list(range(1, self.no_of_people + 1)))
+
+    def test_save_stats(self):
+        """
+        instrumented saves count every stage and the bytes written, and call back at the end
+        """
+        output_filename = test_data_output_file('instrumented.csv')
+        completed = []
+        stats = Stats(sample_every=7)
+        Output.save(self.no_of_people, output_filename, output_filetype='csv', processes=2,
+                    stats=stats, on_complete=completed.append)
+        self.assertEqual(completed, [stats])
+        self.assertEqual(stats.records, self.no_of_people)
+        self.assertEqual(stats.rows_written, self.no_of_people)
+        self.assertEqual(stats.bytes_written, os.path.getsize(output_filename))
+        for stage in CONTACT_STAGES + OUTPUT_STAGES:
+            self.assertEqual(stats.calls[stage], self.no_of_people)
+            self.assertTrue(0 < stats.timed[stage] < self.no_of_people)
+            self.assertGreater(stats.estimated_seconds(stage), 0.0)
+        self.assertEqual(stats.calls['merge'], 1)
+        completed = []
+        Output.save(10, output_filename, output_filetype='jsonl', on_complete=completed.append)
+        self.assertEqual(completed[0].rows_written, 10)
+        self.assertIn('serialize', str(completed[0]))
+
+    def test_seeded_shards_repeatable(self):
+        """
+        a seeded run gives the same file whether generated in one pass or in shards
+        """
+        output_filename = test_data_output_file('seeded.csv')
+        contents = []
+        for processes, shards in ((1, 1), (2, 2), (2, 5)):
+            Output.save(self.no_of_people, output_filename, output_filetype='csv',
+                        processes=processes, shards=shards, seed=42)
+            with open(output_filename) as f:
+                contents.append(f.read())
+        self.assertEqual(contents[0], contents[1])
+        self.assertEqual(contents[0], contents[2])
+
+    def test_checkpointed_job_resumes(self):
+        """
+        a job stopped part way and resumed (with a damaged part made again) writes the same
+        output as Output.save
+        """
+        output_filename = test_data_output_file('checkpointed.csv')
+        manifest_file = checkpoint.manifest_filename(output_filename)
+        reports = []
+
+        def stop_after_two_parts(report):
+            reports.append(report)
+            if report['parts_done'] == 2:
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            checkpoint.run_job(self.no_of_people, output_filename, 'csv', part_rows=40, seed=42,
+                               progress=stop_after_two_parts)
+        manifest = checkpoint.read_manifest(manifest_file)
+        self.assertEqual([(part['first_record'], part['rows']) for part in manifest['parts']], [(0, 40), (40, 40)])
+        self.assertFalse(manifest['complete'])
+        with open(manifest['parts'][1]['file'], 'a') as f:
+            f.write('damaged')
+        checkpoint.resume_job(manifest_file, progress=reports.append)
+        manifest = checkpoint.read_manifest(manifest_file)
+        self.assertTrue(manifest['complete'])
+        self.assertEqual(len(manifest['parts']), 3)
+        self.assertEqual(reports[-1]['rows_done'], self.no_of_people)
+        self.assertEqual(reports[-1]['parts_done'], 3)
+        checkpoint.resume_job(manifest_file, merge_parts=True)
+        Output.save(self.no_of_people, test_data_output_file('uninterrupted.csv'), output_filetype='csv', seed=42)
+        with open(output_filename) as resumed, open(test_data_output_file('uninterrupted.csv')) as uninterrupted:
+            self.assertEqual(resumed.read(), uninterrupted.read())
+        self.assertTrue(checkpoint.read_manifest(manifest_file)['merged'])
+
+    def test_checkpointed_job_part_bytes(self):
+        output_filename = test_data_output_file('checkpointed.jsonl')
+        manifest = checkpoint.run_job(self.no_of_people, output_filename, 'jsonl', part_bytes=5000, seed=3,
+                                      processes=2)
+        self.assertGreater(len(manifest['parts']), 1)
+        self.assertEqual(sum(part['rows'] for part in manifest['parts']), self.no_of_people)
+        for part in manifest['parts'][:-1]:
+            self.assertLess(abs(part['bytes'] - 5000), 1500)
+            self.assertEqual(checkpoint.file_checksum(part['file']), part['checksum'])
+
+    def test_checkpointed_job_compressed(self):
+        """
+        compression is kept in the manifest and applies to every part, resumed or not;
+        merged, the parts read back as Output.save's output
+        """
+        for output_filetype, suffix in (('csv', '.csv'), ('sqlite', '.db')):
+            output_filename = test_data_output_file('checkpointed-compressed' + suffix)
+            uninterrupted = test_data_output_file('uninterrupted' + suffix)
+            Output.save(self.no_of_people, uninterrupted, output_filetype=output_filetype, seed=42)
+
+            def stop_after_one_part(report):
+                raise KeyboardInterrupt
+
+            with self.assertRaises(KeyboardInterrupt):
+                checkpoint.run_job(self.no_of_people, output_filename + '.gz', output_filetype, part_rows=40,
+                                   seed=42, compression='gzip', progress=stop_after_one_part)
+            manifest_file = checkpoint.manifest_filename(output_filename)
+            self.assertEqual(checkpoint.read_manifest(manifest_file)['compression'], 'gzip')
+            manifest = checkpoint.resume_job(manifest_file, merge_parts=True)
+            self.assertEqual(len(manifest['parts']), 3)
+            self.assertTrue(all(part['file'].endswith(suffix + '.gz') for part in manifest['parts']))
+            self.assertEqual(manifest['merged_file'], os.path.abspath(output_filename + '.gz'))
+            if output_filetype == 'csv':
+                with gzip.open(output_filename + '.gz', 'rt', newline='') as merged, \
+                        open(uninterrupted, newline='') as expected:
+                    self.assertEqual(merged.read(), expected.read())
+            else:
+                compressed.decompress_file(output_filename + '.gz', 'gzip')
+                rows = [sqlite3.connect(filename).execute('SELECT * FROM customer ORDER BY id').fetchall()
+                        for filename in (output_filename, uninterrupted)]
+                self.assertEqual(rows[0], rows[1])
+                os.unlink(output_filename)
+        sized = checkpoint.run_job(self.no_of_people, test_data_output_file('checkpointed-sized.jsonl'), 'jsonl',
+                                   part_bytes=1500, seed=3, compression='gzip')
+        self.assertGreater(len(sized['parts']), 1)
+        for part in sized['parts'][:-1]:
+            self.assertLess(abs(part['bytes'] - 1500), 750)
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_run_and_compare(self):
+        measured = benchmark.run_one('weighted_name', 100)
+        self.assertGreater(measured['records_per_second'], 0)
+        results = {'results': {'weighted_name': {'100': measured}},
+                   'cold_start': {'import_seconds': 0.05, 'construct_seconds': 0.002}}
+        self.assertEqual(benchmark.compare(results, results), [])
+        faster = {'results': {'weighted_name': {'100': dict(measured, records_per_second=measured['records_per_second'] * 2)}},
+                  'cold_start': {'import_seconds': 0.01, 'construct_seconds': 0.001}}
+        regressions = benchmark.compare(results, faster)
+        self.assertEqual(len(regressions), 3)
+
+    def test_contact_batch_beats_records(self):
+        """a seeded batch draws its columns whole, so it is quicker than the same contacts record by record"""
+        def best(name):
+            return max(benchmark.run_one(name, 5000)['records_per_second'] for i in range(3))
+        self.assertGreater(best('contact_batch'), best('records'))
+
+
+class TestObfuscate(unittest.TestCase):
+
+    def setUp(self):
+        make_test_output_dir()
+
+    @staticmethod
+    def read(filename, encoding):
+        with open(filename, encoding=encoding, newline='') as f:
+            return list(csv.reader(f))
+
+    def test_outlook_csv(self):
+        """
+        names, house numbers, phone numbers and emails change; the layout and other fields don't
+        """
+        source = lookup_file('Addresses.csv')
+        destination = test_data_output_file('obfuscated.csv')
+        rows = obfuscate.obfuscate_file(source, destination, seed=6, chunk_rows=50)
+        original = self.read(source, 'cp1252')
+        obfuscated = self.read(destination, 'cp1252')
+        self.assertEqual(rows, len(original) - 1)
+        self.assertEqual(obfuscated[0], original[0])
+        header = original[0]
+        for before, after in zip(original[1:], obfuscated[1:]):
+            before, after = dict(zip(header, before)), dict(zip(header, after))
+            for field in ('Company', 'Suburb', 'State', 'Postcode', 'Website'):
+                self.assertEqual(after[field], before[field])
+            self.assertEqual(re.sub('[0-9]+', '#', after['Street']), re.sub('[0-9]+', '#', before['Street']))
+            self.assertEqual(bool(after['Email']), bool(before['Email']))
+            if before['Email']:
+                self.assertTrue(after['Email'].startswith('thebalancepro+rp_'), msg=after['Email'])
+            for field in obfuscate.PHONE_FIELDS['OutlookCSV']:
+                self.assertEqual(re.sub('[0-9]', '#', after[field]), re.sub('[0-9]', '#', before[field]))
+                self.assertEqual(re.sub('[^0-9]', '', after[field])[:2], re.sub('[^0-9]', '', before[field])[:2])
+        # a name may be redrawn by chance, but not most of them
+        same_names = sum(1 for before, after in zip(original[1:], obfuscated[1:]) if before[1] and before[1] == after[1])
+        self.assertLess(same_names, len(original) / 10)
+        for field in obfuscate.PHONE_FIELDS['OutlookCSV']:
+            column = header.index(field)
+            phones = [(before[column], after[column]) for before, after in zip(original[1:], obfuscated[1:])
+                      if before[column].strip()]
+            self.assertTrue(phones)
+            self.assertLess(sum(1 for before, after in phones if before == after), len(phones) / 10)
+
+    def test_google_csv_parallel_chunks_in_order(self):
+        """
+        UTF-16 Google export: same output in parallel small chunks as in one pass
+        """
+        source = lookup_file('google.csv')
+        one_pass = test_data_output_file('obfuscated-google.csv')
+        parallel = test_data_output_file('obfuscated-google-parallel.csv')
+        obfuscate.obfuscate_file(source, one_pass, input_filter='Google Contacts', seed=6)
+        obfuscate.obfuscate_file(source, parallel, input_filter='Google Contacts', seed=6, processes=2,
+                                 chunk_rows=97)
+        with open(parallel, 'rb') as f:
+            self.assertTrue(f.read(2) in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE))
+        obfuscated = self.read(parallel, 'utf-16')
+        self.assertEqual(obfuscated, self.read(one_pass, 'utf-16'))
+        original = self.read(source, 'utf-16')
+        self.assertEqual(len(obfuscated), len(original))
+        given_name = original[0].index('Given Name')
+        named = [(before, after) for before, after in zip(original[1:], obfuscated[1:]) if before[given_name]]
+        self.assertTrue(named)
+        self.assertTrue(all(after[given_name] != before[given_name] for before, after in named[:20]))
+
+    def test_google_csv_addresses_and_birthdays(self):
+        """
+        Google export: house numbers change in the street and in the formatted address,
+        the second address, other names, emails and notes are blanked, phone numbers
+        are redrawn, birthdays keep yyyy-mm-dd
+        """
+        source = lookup_file('google.csv')
+        destination = test_data_output_file('obfuscated-google.csv')
+        obfuscate.obfuscate_file(source, destination, input_filter='Google Contacts', seed=6)
+        original = self.read(source, 'utf-16')
+        obfuscated = self.read(destination, 'utf-16')
+        header = original[0]
+        numbered = unchanged = phones = unchanged_phones = 0
+        for before, after in zip(original[1:], obfuscated[1:]):
+            before, after = dict(zip(header, before)), dict(zip(header, after))
+            street, formatted = before['Address 1 - Street'], before['Address 1 - Formatted']
+            self.assertEqual(re.sub('[0-9]+', '#', after['Address 1 - Street']), re.sub('[0-9]+', '#', street))
+            if re.search('[0-9]', street):
+                numbered += 1
+                # a house number may be redrawn by chance, but not most of them
+                unchanged += after['Address 1 - Street'] == street
+                self.assertEqual(after['Address 1 - Formatted'] == formatted, after['Address 1 - Street'] == street)
+                self.assertTrue(not after['Address 1 - Formatted']
+                                or after['Address 1 - Street'].split(' ::: ')[0] in after['Address 1 - Formatted'])
+            self.assertTrue(all(not value for field, value in after.items() if field.startswith('Address 2 - ')))
+            self.assertTrue(all(not after[field] for field in ('Nickname', 'Notes', 'E-mail 2 - Value')))
+            for field in obfuscate.PHONE_FIELDS['Google Contacts']:
+                self.assertEqual(re.sub('[0-9]', '#', after[field]), re.sub('[0-9]', '#', before[field]))
+                phones += len(re.findall('[0-9]', before[field])) > 4
+                unchanged_phones += len(re.findall('[0-9]', before[field])) > 4 and after[field] == before[field]
+            self.assertEqual(bool(after['Birthday']), bool(before['Birthday']))
+            if before['Birthday']:
+                self.assertRegex(after['Birthday'], r'^\d{4}-\d{2}-\d{2}$')
+                self.assertNotEqual(after['Birthday'], before['Birthday'])
+        self.assertGreater(numbered, 50)
+        self.assertLess(unchanged, numbered / 10)
+        self.assertGreater(phones, 500)
+        self.assertLess(unchanged_phones, phones / 100)
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_standard_schemas(self):
+        """
+        every schema in schemas.yaml compiles and generates full columns, repeatably from a seed
+        """
+        for name, definition in schema.load_schemas().items():
+            plan = schema.compile_schema(definition, name, seed=3)
+            block = plan.batch(50)
+            self.assertEqual(list(block), plan.columns)
+            self.assertTrue(all(len(column) == 50 for column in block.values()))
+            self.assertEqual(list(schema.compile_schema(definition, name, seed=3).rows(50)),
+                             [dict(zip(block, values)) for values in zip(*block.values())])
+
+    def test_column_kinds(self):
+        plan = schema.compile_schema({'columns': {
+            'id': {'sequence': {'start': 10, 'step': 5}, 'format': 'X{0}'},
+            'item': {'lookup': {'file': 'groceries.csv', 'field': 'name'}},
+            'sex': {'choice': {'values': ['f', 'm'], 'weights': [0, 1]}},
+            'n': {'distribution': {'type': 'integer', 'low': 1, 'high': 3}},
+            'price': {'distribution': {'type': 'normal', 'mean': 0, 'sd': 5, 'min': 0, 'round': 2}},
+            'day': {'date': {'start': '2024-02-28', 'end': '2024-03-01', 'format': '%Y%m%d'}, 'hidden': True},
+            'label': {'template': '{n} x {item} on {day}'}}}, seed=1)
+        first = plan.batch(300)
+        self.assertEqual(plan.columns, ['id', 'item', 'sex', 'n', 'price', 'label'])
+        self.assertEqual(first['id'][:3], ['X10', 'X15', 'X20'])
+        self.assertEqual(plan.batch(1)['id'], ['X1510'])
+        self.assertEqual(set(first['sex']), {'m'})
+        self.assertEqual(set(first['n']), {1, 2, 3})
+        self.assertTrue(all(price >= 0 for price in first['price']))
+        self.assertEqual({label.rsplit(' ', 1)[1] for label in first['label']}, {'20240228', '20240229', '20240301'})
+
+    def test_lookup_engines(self):
+        """
+        lookups draw through the chosen engine: both follow the weights, repeatably from a seed
+        """
+        groceries = WeightedChoice(lookup_file('groceries.csv'), name_field='name')
+        expected = dict(zip(groceries.name_list, cumulative_distribution(groceries)))
+        sample_size = 20000
+        for engine in ('cumulative', 'alias'):
+            definition = {'columns': {'item': {'lookup': {'file': 'groceries.csv', 'field': 'name',
+                                                          'engine': engine}}}}
+            items = schema.compile_schema(definition, seed=4).batch(sample_size)['item']
+            self.assertEqual(items, schema.compile_schema(definition, seed=4).batch(sample_size)['item'])
+            counts = Counter(items)
+            for item, probability in expected.items():
+                tolerance = 5 * (probability * (1 - probability) / sample_size) ** 0.5 + 1e-9
+                self.assertAlmostEqual(counts[item] / sample_size, probability, delta=tolerance)
+
+    def test_bad_schemas(self):
+        for bad in ({'columns': {}},
+                    {'columns': {'a': {'lookup': {'file': 'groceries.csv', 'field': 'name', 'engine': 'magic'}}}},
+                    {'columns': {'a': {'sequence': {}, 'choice': ['x']}}},
+                    {'columns': {'a': {'distribution': {'type': 'zipf'}}}},
+                    {'columns': {'a': {'template': '{b}'}}}):
+            with self.assertRaises(schema.BadSchema):
+                schema.compile_schema(bad)
+
+
+class TestValidation(unittest.TestCase):
+
+    @staticmethod
+    def columns(n, name_builder):
+        """n contacts' names, sexes and birth years, drawn in batches as the generator draws them"""
+        columns = name_builder.gendered_names(n)
+        columns['dob_year'] = dates.birthdays(n)['dob_year']
+        return columns
+
+    def test_statistics(self):
+        # textbook 5% critical values
+        self.assertAlmostEqual(validation.chi_square_p_value(3.841, 1), 0.05, places=3)
+        self.assertAlmostEqual(validation.chi_square_p_value(124.342, 100), 0.05, places=3)
+        self.assertAlmostEqual(validation.ks_p_value(1.358 / 100, 10000), 0.05, places=2)
+        # the last two bins, expected 1.6 rows each, are pooled
+        statistic, df = validation.chi_square([10, 20, 1, 1], [0.4, 0.5, 0.05, 0.05])
+        self.assertAlmostEqual(statistic, 2.8 ** 2 / 12.8 + 4 ** 2 / 16 + 1.2 ** 2 / 3.2)
+        self.assertEqual(df, 2)
+        sketch = validation.CountMinSketch(width=64, depth=3)
+        values = ['v{0}'.format(i % 500) for i in range(5000)]
+        for value in values:
+            sketch.add(value)
+        self.assertTrue(all(sketch.estimate(value) >= count for value, count in Counter(values).items()))
+
+    def test_age_distributions(self):
+        """the exact distributions of birth years that generated years are tested against"""
+        self.assertAlmostEqual(sum(dates.NormalAges().distribution().values()), 1.0)
+        ages = dates.EmpiricalAges(test_data_input_file("agehistogram.csv"), reference_year=2020)
+        expected = {1990: 0.25, 1996: 0.15, 1997: 0.15, 1998: 0.15, 1999: 0.15, 2000: 0.15}
+        for year, probability in ages.distribution().items():
+            self.assertAlmostEqual(probability, expected[year])
+        self.assertEqual(set(ages.distribution()), set(expected))
+
+    def test_generated_contacts_pass(self):
+        """
+        a large sample of names, sexes and birth years fits the lookups' weights;
+        skewed samples don't
+        """
+        random.seed(2025)
+        name_builder = NameBuilder()
+        validator = validation.ContactValidator(name_builder)
+        for i in range(5):
+            validator.add_columns(self.columns(40000, name_builder))
+        self.assertEqual(validator.rows, 200000)
+        self.assertEqual(validator.failures(), [])
+        skewed = validation.ContactValidator(name_builder)
+        columns = self.columns(40000, name_builder)
+        # too many women, surnames equally likely, everyone born in one decade
+        columns['sex'] = ['female' if i % 5 < 3 else 'male' for i in range(40000)]
+        surnames = sorted(set(name_builder.surname_generator.name_list))
+        columns['last_name'] = [surnames[i % len(surnames)] for i in range(40000)]
+        columns['dob_year'] = [str(1950 + i % 10) for i in range(40000)]
+        skewed.add_columns(columns)
+        self.assertEqual({check['check'] for check in skewed.failures()}, {'sex', 'last_name', 'dob_year'})
+
+    def test_output_file(self):
+        """
+        contacts read back from an output file (compressed too) are counted by field;
+        values not in the lookups are counted apart
+        """
+        output_filename = test_data_output_file('validated.csv')
+        files = Output.save(500, output_filename, output_filetype='csv', seed=8, compression='gzip')
+        validator = validation.ContactValidator()
+        self.assertEqual(validator.add_file(files[0]), 500)
+        validator.add({'first_name': 'Zzyzx', 'middle_name': 'Ann', 'last_name': 'SMITH', 'sex': 'female',
+                       'dob_year': '1970'})
+        report = {check['check']: check for check in validator.report()}
+        self.assertEqual(report['sex']['rows'], 501)
+        self.assertEqual(report['dob_year']['rows'], 501)
+        self.assertEqual(report['first_name (female)']['unexpected_rows'], 1)
+        self.assertEqual(report['first_name (female)']['unexpected_examples'], ['Zzyzx'])
+        self.assertIn('ks_p_value', report['dob_year'])
+
+
+class TestRelational(unittest.TestCase):
+
+    def setUp(self):
+        make_test_output_dir()
+        self.spec = relational.load_datasets()['shop']
+        self.rows = {'customer': 300, 'review': 50}
+
+    @staticmethod
+    def read(filename):
+        with open(filename, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_foreign_keys(self):
+        """
+        every foreign key is a primary key of the parent table; fan-out follows the weights;
+        the same seed gives the same tables
+        """
+        files = relational.Dataset(self.spec, 'shop', seed=4, rows=self.rows).save(
+            test_data_output_file('shop.csv'))
+        self.assertEqual(files, [test_data_output_file('shop-' + table + '.csv')
+                                 for table in ('customer', 'order', 'order_line', 'review')])
+        customers, orders, lines, reviews = [self.read(filename) for filename in files]
+        self.assertEqual([row['id'] for row in customers], [str(i) for i in range(1, 301)])
+        self.assertEqual(orders[0]['id'], '1000001')
+        self.assertEqual(len(reviews), 50)
+        for children, parents, foreign_key in ((orders, customers, 'customer_id'), (lines, orders, 'order_id'),
+                                               (reviews, customers, 'customer_id')):
+            parent_ids = {row['id'] for row in parents}
+            self.assertTrue(all(row[foreign_key] in parent_ids for row in children))
+        # orders follow their customers
+        self.assertEqual([int(row['customer_id']) for row in orders], sorted(int(row['customer_id']) for row in orders))
+        orders_per_customer = Counter(row['customer_id'] for row in orders)
+        # mean of the orders_per_customer weights is about 3
+        self.assertTrue(1.5 < len(orders) / 300.0 < 5.0)
+        self.assertGreater(max(orders_per_customer.values()), 10)
+        self.assertTrue(all(count >= 1 for count in Counter(row['order_id'] for row in lines).values()))
+        again = relational.Dataset(self.spec, 'shop', seed=4, rows=self.rows).save(test_data_output_file('again.csv'))
+        self.assertEqual([self.read(filename) for filename in again], [customers, orders, lines, reviews])
+
+    def test_one_file_formats(self):
+        """
+        SQLite gets a table per table; fixtures are one file with parents first
+        """
+        database = test_data_output_file('shop.db')
+        relational.Dataset(self.spec, 'shop', seed=4, rows=self.rows).save(database, 'sqlite')
+        connection = sqlite3.connect(database)
+        try:
+            orphans = connection.execute('SELECT COUNT(*) FROM order_line l LEFT JOIN "order" o '
+                                         'ON o.id = l.order_id WHERE o.id IS NULL').fetchone()[0]
+            self.assertEqual(orphans, 0)
+            self.assertEqual(connection.execute('SELECT COUNT(*) FROM customer').fetchone()[0], 300)
+        finally:
+            connection.close()
+        fixture = test_data_output_file('shop.yaml')
+        self.assertEqual(relational.Dataset(self.spec, 'shop', seed=4, rows=self.rows).save(
+            fixture, 'django_yaml_fixture'), [fixture])
+        with open(fixture) as f:
+            models = [record['model'] for record in yaml.safe_load(f)]
+        self.assertEqual(list(dict.fromkeys(models)), ['shop.Customer', 'shop.Order', 'shop.OrderLine', 'shop.Review'])
+        self.assertEqual(models, sorted(models, key=list(dict.fromkeys(models)).index))
+
+    def test_bad_datasets(self):
+        columns = {'n': {'sequence': {}}}
+        for bad in ({'child': {'parent': 'missing', 'rows': 3, 'columns': columns}},
+                    {'root': {'columns': columns}},
+                    {'root': {'rows': 3, 'columns': columns},
+                     'child': {'parent': 'root', 'columns': columns}},
+                    {'root': {'rows': 3, 'columns': columns},
+                     'child': {'parent': 'root', 'per_parent': {'sequence': {}}, 'columns': columns}}):
+            with self.assertRaises(schema.BadSchema):
+                relational.Dataset(bad, seed=1)
+
+
+class TestContactServer(unittest.TestCase):
+
+    def serve(self, client):
+        """run client(server) against a fresh server on a free port; returns its result"""
+        async def run():
+            server = ContactServer(port=0, batch_rows=7)
+            await server.start()
+            try:
+                return await client(server)
+            finally:
+                await server.stop()
+        return asyncio.run(run())
+
+    def test_tcp_jsonl_matches_seeded_records(self):
+        async def client(server):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'rows=20&seed=9&start=5\n')
+            data = await reader.read()
+            writer.close()
+            return data
+        lines = self.serve(client).decode().splitlines()
+        expected = [fieldmap.translateOut(p) for p in RandomContact(seed=9).records(5, 25)]
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+    def test_http_chunked_csv(self):
+        async def client(server):
+            url = 'http://127.0.0.1:{0}/contacts?rows=30&format=csv&seed=4'.format(server.port)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: urllib.request.urlopen(url).read())
+        rows = list(csv.DictReader(io.StringIO(self.serve(client).decode())))
+        self.assertEqual(len(rows), 30)
+        self.assertEqual([row['Email'] for row in rows],
+                         [p['email'] for p in RandomContact(seed=4).records(0, 30)])
+
+    def test_bad_requests(self):
+        async def client(server):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'rows=ten\n')
+            tcp = await reader.read()
+            writer.close()
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'GET /contacts?format=xml HTTP/1.1\r\nHost: x\r\n\r\n')
+            http = await reader.read()
+            writer.close()
+            return tcp, http
+        tcp, http = self.serve(client)
+        self.assertEqual(tcp, b'ERROR rows must be a number\n')
+        self.assertTrue(http.startswith(b'HTTP/1.1 400 '))
+
+    def test_out_of_range_requests(self):
+        """
+        rates that aren't finite, and record numbers beyond the usernames' range, are refused;
+        an endless stream stops at the end of the range
+        """
+        requests = (b'rate=nan', b'rate=inf', b'start=' + str(2 ** 40).encode(),
+                    b'rows=10&start=' + str(2 ** 40 - 5).encode(), b'start=' + str(2 ** 40 - 3).encode())
+
+        async def client(server):
+            replies = []
+            for request in requests:
+                reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+                writer.write(request + b'\n')
+                replies.append(await reader.read())
+                writer.close()
+            return replies
+        replies = self.serve(client)
+        for reply in replies[:4]:
+            self.assertTrue(reply.startswith(b'ERROR '), msg=reply)
+        self.assertEqual(replies[4].count(b'\n'), 3)
+
+    def test_rate_limit(self):
+        async def client(server):
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(b'rows=30&rate=100\n')
+            data = await reader.read()
+            writer.close()
+            return data, loop.time() - started
+        data, elapsed = self.serve(client)
+        self.assertEqual(data.count(b'\n'), 30)
+        # batches of 7 at 100 rows/s: the last leaves 0.28 s after the first
+        self.assertGreater(elapsed, 0.25)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestRandomContact)
@@ -0,0 +1,89 @@
+"""
+Unique suffixes
+
+Usernames (and so emails) must be unique, or loading the contacts into a database with
+unique constraints fails. A hash of the contact cut down to a few characters collides
+within a few thousand records; remembering every suffix issued costs memory.
+
+Instead each record number is put through a keyed permutation of 0 .. 2**40 - 1 (a
+Feistel network) and the result written in base 32. Different record numbers always
+give different suffixes, with nothing stored, and the suffixes look random: neighbouring
+records don't get neighbouring suffixes.
+"""
+
+from counterrandom import splitmix64, stable_hash, MASK64
+
+ALPHABET = '0123456789abcdefghijklmnopqrstuv'
+
+
+class UniqueSuffix:
+    """
+    suffix(k): short text, different for every record number k in 0 .. 2**bits - 1
+
+    The permutation depends on seed (and field), so runs with different seeds
+    get different suffixes. bits must be a multiple of 10 (two halves of whole base 32 digits)
+    """
+
+    ROUNDS = 4
+
+    def __init__(self, seed=0, field='username', bits=40):
+        if bits % 10:
+            raise ValueError("bits must be a multiple of 10, not {0}".format(bits))
+        self.bits = bits
+        self.limit = 1 << bits
+        self.half_bits = bits // 2
+        self.half_mask = (1 << self.half_bits) - 1
+        self.digits = bits // 5
+        base = splitmix64(stable_hash(seed) ^ splitmix64(stable_hash(field)))
+        self.round_keys = []
+        for i in range(self.ROUNDS):
+            base = splitmix64(base)
+            self.round_keys.append(base)
+
+    def permute(self, k):
+        """k's position in the permutation: a bijection of 0 .. 2**bits - 1"""
+        if not 0 <= k < self.limit:
+            raise ValueError("record number {0} is outside 0 .. 2**{1} - 1".format(k, self.bits))
+        half_bits, half_mask = self.half_bits, self.half_mask
+        left, right = k >> half_bits, k & half_mask
+        for key in self.round_keys:
+            # any round function keeps a Feistel network invertible; a multiply-xorshift is cheap
+            mixed = ((right ^ key) * 0x9E3779B97F4A7C15) & MASK64
+            left, right = right, left ^ ((mixed ^ (mixed >> 29)) >> (64 - half_bits))
+        return (left << half_bits) | right
+
+    def suffix(self, k):
+        """record number k's suffix: bits / 5 base 32 digits"""
+        value = self.permute(k)
+        digits = []
+        for i in range(self.digits):
+            digits.append(ALPHABET[value & 31])
+            value >>= 5
+        return ''.join(reversed(digits))
+
+    def suffixes(self, start, n):
+        """suffixes of records start .. start + n - 1"""
+        return [self.suffix(k) for k in range(start, start + n)]
+
+
+if __name__ == '__main__':
+    """
+    benchmark: unique suffix against the old per-record MD5 of the contact
+    """
+    import time
+    import hashlib
+    from randomcontact import RandomContact
+
+    no_of_people = 20000
+    people = list(RandomContact(seed=1).records(0, no_of_people))
+    start = time.perf_counter()
+    for person in people:
+        hashlib.md5(repr(sorted(person.items())).encode()).hexdigest()[:5]
+    md5_time = time.perf_counter() - start
+    unique = UniqueSuffix(seed=1)
+    start = time.perf_counter()
+    for k in range(no_of_people):
+        unique.suffix(k)
+    suffix_time = time.perf_counter() - start
+    print("md5 of contact: {0:10.0f} records/s".format(no_of_people / md5_time))
+    print("UniqueSuffix:   {0:10.0f} records/s".format(no_of_people / suffix_time))
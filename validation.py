@@ -0,0 +1,373 @@
+"""
+Validating output at scale
+
+Do millions of generated contacts really follow the lookups? A ContactValidator takes
+contacts as they stream past (from RandomContact, or read back from a CSV file, compressed
+or not) and keeps running counts in memory that doesn't grow with the number of rows:
+
+    forenames (by sex), surnames    an exact count per name in the lookup table
+    sex                             female and male counts
+    birth years                     an exact count per year (MIN_YEAR to MAX_YEAR)
+
+Values that aren't in a lookup at all are counted in a count-min sketch, so a stream of
+unexpected values can't grow memory either. The report compares each count with the
+distribution the lookup's weights give:
+
+    chi-square  goodness of fit, every check (bins expected fewer than MIN_EXPECTED rows
+                are pooled into one)
+    KS          Kolmogorov-Smirnov distance between the observed and expected cumulative
+                distributions, for birth years (the only ordered check); the p-value is the
+                continuous one, so conservative for whole years
+
+    validator = ContactValidator()
+    validator.add_file('people.csv')                    # or validator.add(contact) for each contact
+    for check in validator.report():
+        print(check['check'], check['p_value'])
+
+    python -m validation people.csv
+
+Rows are counted a batch at a time, with collections.Counter, so files are checked at
+several hundred thousand rows a second.
+"""
+
+import csv
+import math
+import hashlib
+import argparse
+import itertools
+import collections
+from array import array
+
+import fieldmap
+import compressed
+from dates import DEFAULT_AGES
+from namebuilder import NameBuilder
+
+DEFAULT_BATCH_ROWS = 10000
+# chi-square bins expected fewer rows than this are pooled
+MIN_EXPECTED = 5.0
+# chance of a female contact (see NameBuilder.gendered_name: randint(0, 1986) > 986)
+FEMALE_PROBABILITY = 1000.0 / 1987.0
+SEXES = ('female', 'male')
+FIELDS = ('first_name', 'middle_name', 'last_name', 'sex', 'dob_year')
+
+
+class CountMinSketch:
+    """
+    approximate counts of any number of distinct values in width * depth counters:
+    estimate(value) is never below the true count, and above it by at most about
+    2 / width of all counts, with probability 1 - 2 ** -depth
+    """
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('q', bytes(8 * width)) for i in range(depth)]
+        self.total = 0
+
+    def _columns(self, value):
+        # a stable hash (not hash(), which differs from process to process), so sketches
+        # made in different processes can be merged
+        digest = hashlib.blake2b(repr(value).encode('utf-8'), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4 * row:4 * row + 4], 'little') % self.width for row in range(self.depth)]
+
+    def add(self, value, count=1):
+        for row, column in zip(self.rows, self._columns(value)):
+            row[column] += count
+        self.total += count
+
+    def estimate(self, value):
+        return min(row[column] for row, column in zip(self.rows, self._columns(value)))
+
+    def merge(self, other):
+        """add in another sketch of the same size"""
+        for row, other_row in zip(self.rows, other.rows):
+            for column, count in enumerate(other_row):
+                row[column] += count
+        self.total += other.total
+
+
+class Tally:
+    """counts of the values of a known domain (exact), and of anything else (sketched)"""
+
+    # unexpected values kept (the first seen) to show in reports
+    EXAMPLES = 10
+
+    def __init__(self, name, expected, ordered=False, sketch_width=2048, sketch_depth=4):
+        """expected: probability of each value (value: probability); ordered: values are in order (for KS)"""
+        self.name = name
+        self.values = list(expected)
+        self.expected = [expected[value] for value in self.values]
+        self.ordered = ordered
+        self.index = {value: i for i, value in enumerate(self.values)}
+        self.counts = [0] * len(self.values)
+        self.unexpected = CountMinSketch(sketch_width, sketch_depth)
+        self.examples = []
+
+    def update(self, counter):
+        """add in the counts of a Counter (or dict) of values"""
+        index = self.index
+        counts = self.counts
+        for value, count in counter.items():
+            i = index.get(value)
+            if i is not None:
+                counts[i] += count
+            else:
+                self.unexpected.add(value, count)
+                if len(self.examples) < self.EXAMPLES and value not in self.examples:
+                    self.examples.append(value)
+
+    def report(self):
+        n = sum(self.counts)
+        statistic, df = chi_square(self.counts, self.expected)
+        result = {'check': self.name,
+                  'rows': n,
+                  'unexpected_rows': self.unexpected.total,
+                  'unexpected_examples': list(self.examples),
+                  'chi_square': statistic,
+                  'degrees_of_freedom': df,
+                  'p_value': chi_square_p_value(statistic, df)}
+        if self.ordered:
+            d = ks_statistic(self.counts, self.expected)
+            result['ks_statistic'] = d
+            result['ks_p_value'] = ks_p_value(d, n)
+        return result
+
+
+def chi_square(counts, probabilities, min_expected=MIN_EXPECTED):
+    """
+    (chi-square statistic, degrees of freedom) of counts against probabilities;
+    bins expected fewer than min_expected rows are pooled into one
+    """
+    n = sum(counts)
+    total_probability = sum(probabilities)
+    if not n or not total_probability:
+        return 0.0, 0
+    statistic = 0.0
+    bins = 0
+    pooled_count = 0
+    pooled_expected = 0.0
+    for count, probability in zip(counts, probabilities):
+        expected = n * probability / total_probability
+        if expected < min_expected:
+            pooled_count += count
+            pooled_expected += expected
+        else:
+            statistic += (count - expected) ** 2 / expected
+            bins += 1
+    if pooled_expected > 0:
+        statistic += (pooled_count - pooled_expected) ** 2 / pooled_expected
+        bins += 1
+    return statistic, max(bins - 1, 0)
+
+
+def chi_square_p_value(statistic, df):
+    """chance of a chi-square statistic at least this large with df degrees of freedom"""
+    if df <= 0:
+        return 1.0
+    return regularized_gamma_q(df / 2.0, statistic / 2.0)
+
+
+def regularized_gamma_q(a, x):
+    """Q(a, x), the upper regularized incomplete gamma function (series or continued fraction)"""
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # series for P(a, x)
+        term = total = 1.0 / a
+        for n in range(1, 10000):
+            term *= x / (a + n)
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # Lentz's continued fraction for Q(a, x)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1.0 / tiny
+    d = 1.0 / b
+    h = d
+    for n in range(1, 10000):
+        an = -n * (n - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+
+def ks_statistic(counts, probabilities):
+    """largest distance between the observed and expected cumulative distributions"""
+    n = sum(counts)
+    total_probability = sum(probabilities)
+    if not n:
+        return 0.0
+    observed = expected = 0.0
+    distance = 0.0
+    for count, probability in zip(counts, probabilities):
+        observed += count / n
+        expected += probability / total_probability
+        distance = max(distance, abs(observed - expected))
+    return distance
+
+
+def ks_p_value(d, n):
+    """chance of a Kolmogorov-Smirnov distance at least d from n rows (asymptotic, with Stephens' correction)"""
+    if not n or d <= 0:
+        return 1.0
+    root_n = math.sqrt(n)
+    z = (root_n + 0.12 + 0.11 / root_n) * d
+    if z < 0.2:
+        return 1.0
+    total = sum((-1) ** (k - 1) * math.exp(-2 * k * k * z * z) for k in range(1, 101))
+    return min(1.0, max(0.0, 2 * total))
+
+
+def lookup_distribution(lookup):
+    """probability of each name of a WeightedChoice (names listed twice are added together)"""
+    probabilities = {}
+    floor = 0.0
+    total = lookup.weight_ceiling[-1]
+    for name, ceiling in zip(lookup.name_list, lookup.weight_ceiling):
+        probabilities[name] = probabilities.get(name, 0.0) + (ceiling - floor) / total
+        floor = ceiling
+    return probabilities
+
+
+class ContactValidator:
+    """
+    running checks of contacts against the lookups they were drawn from (see the module docstring)
+
+    name_builder: NameBuilder whose lookups the contacts came from (default: the standard lookups)
+    ages: distribution the birth years came from (default dates.DEFAULT_AGES)
+    """
+
+    def __init__(self, name_builder=None, ages=None, batch_rows=DEFAULT_BATCH_ROWS):
+        name_builder = name_builder or NameBuilder()
+        forenames = {'female': lookup_distribution(name_builder.female_forename),
+                     'male': lookup_distribution(name_builder.male_forename)}
+        self.tallies = collections.OrderedDict()
+        for field in ('first_name', 'middle_name'):
+            for sex in SEXES:
+                self.tallies[(field, sex)] = Tally('{0} ({1})'.format(field, sex), forenames[sex])
+        self.tallies['last_name'] = Tally('last_name', lookup_distribution(name_builder.surname_generator))
+        self.tallies['sex'] = Tally('sex', {'female': FEMALE_PROBABILITY, 'male': 1.0 - FEMALE_PROBABILITY})
+        self.tallies['dob_year'] = Tally('dob_year', (ages or DEFAULT_AGES).distribution(), ordered=True)
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self._start_batch()
+
+    def _start_batch(self):
+        self.batch = {field: [] for field in FIELDS}
+
+    def add(self, person):
+        """one contact (a dict with internal field names, as RandomContact makes)"""
+        for field, values in self.batch.items():
+            values.append(person.get(field))
+        if len(self.batch['sex']) >= self.batch_rows:
+            self.flush()
+
+    def add_all(self, people):
+        for person in people:
+            self.add(person)
+        self.flush()
+
+    def add_columns(self, columns):
+        """a batch of contacts as columns (field: list of values), as RandomContact.contact_batch makes"""
+        sexes = columns['sex']
+        tallies = self.tallies
+        for field in ('first_name', 'middle_name'):
+            by_sex = collections.Counter(zip(sexes, columns[field]))
+            for sex in SEXES:
+                tallies[(field, sex)].update({name: count for (name_sex, name), count in by_sex.items()
+                                              if name_sex == sex})
+            # forenames of contacts with neither sex: checked with the sex, not here
+        tallies['last_name'].update(collections.Counter(columns['last_name']))
+        tallies['sex'].update(collections.Counter(sexes))
+        years = collections.Counter(columns['dob_year'])
+        tallies['dob_year'].update({int(year) if isinstance(year, str) and year.isdigit() else year: count
+                                    for year, count in years.items()})
+        self.rows += len(sexes)
+
+    def flush(self):
+        if self.batch['sex']:
+            self.add_columns(self.batch)
+            self._start_batch()
+
+    def add_file(self, filename, output_filter=None, encoding=None):
+        """
+        contacts from a CSV file as Output.save writes it (outgoing filter output_filter,
+        by default translations.yaml's Default_filter);
+        .gz and .zst files are decompressed as they are read. Returns the number of rows read
+        """
+        if output_filter is None:
+            output_filter = fieldmap.DEFAULT_FILTER
+        compression = next((name for name, suffix in compressed.SUFFIXES.items() if filename.endswith(suffix)), None)
+        internal = {external: field for field, external in fieldmap.outgoing_filter(output_filter).items()
+                    if external}
+        rows = 0
+        with compressed.open_input(filename, compression, encoding=encoding) as f:
+            reader = csv.reader(f)
+            header = [internal.get(name) for name in next(reader, [])]
+            positions = {field: header.index(field) for field in ('first_name', 'middle_name', 'last_name',
+                                                                  'sex', 'dob') if field in header}
+            while True:
+                block = list(itertools.islice(reader, self.batch_rows))
+                if not block:
+                    break
+                columns = {field: [row[i] if i < len(row) else None for row in block]
+                           for field, i in positions.items()}
+                # 'dd/mm/yyyy'
+                columns['dob_year'] = [dob[-4:] if dob else None for dob in columns.pop('dob', [None] * len(block))]
+                for field in FIELDS:
+                    columns.setdefault(field, [None] * len(block))
+                self.add_columns(columns)
+                rows += len(block)
+        return rows
+
+    def report(self):
+        """a result (dict) per check: rows, chi-square and its p-value, KS for birth years..."""
+        self.flush()
+        return [tally.report() for tally in self.tallies.values()]
+
+    def failures(self, significance=1e-4):
+        """checks with a p-value (chi-square or KS) below significance"""
+        return [check for check in self.report()
+                if check['rows'] and (check['p_value'] < significance or
+                                      check.get('ks_p_value', 1.0) < significance)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check generated contacts against the lookups' distributions")
+    parser.add_argument('files', nargs='+', help="CSV files written by Output.save (.gz or .zst too)")
+    parser.add_argument('--filter', help="outgoing filter the files were written with "
+                                         "(default: translations.yaml's Default_filter)")
+    parser.add_argument('--significance', type=float, default=1e-4)
+    args = parser.parse_args(argv)
+    output_filter = args.filter or fieldmap.DEFAULT_FILTER
+    validator = ContactValidator()
+    for filename in args.files:
+        validator.add_file(filename, output_filter)
+    failures = {check['check'] for check in validator.failures(args.significance)}
+    for check in validator.report():
+        line = "{check:24s} {rows:>10d} rows  chi2 {chi_square:12.1f} df {degrees_of_freedom:5d}  p {p_value:.4g}".format(
+            **check)
+        if 'ks_statistic' in check:
+            line += "  KS {0:.5f} p {1:.4g}".format(check['ks_statistic'], check['ks_p_value'])
+        if check['unexpected_rows']:
+            line += "  {0} unexpected, e.g. {1}".format(check['unexpected_rows'], check['unexpected_examples'][:3])
+        if check['check'] in failures:
+            line += "  FAIL"
+        print(line)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    main()
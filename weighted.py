@@ -1,56 +1,182 @@
 import csv
 import math
-from random import uniform
+import random
+import itertools
 from bisect import bisect_left
-from exceptions import MissingPopularityException
+from exceptions import MissingPopularityException, SamplingEngineException
+import lookupcache
+
+try:
+    import numpy
+except ImportError:
+    # batch draws fall back to pure Python
+    numpy = None
 
 
 class WeightedChoice:
     """
     Generates a stream of random weighted choices (could be surname, forename, shopping cart item, log entry etc.)
     based on a popularity table. More common choices are returned more frequently.
+
+    Two sampling engines are available:
+    'cumulative' (default): binary search of cumulative weights, O(log n) per draw
+    'alias': Walker/Vose alias table built once at load, O(1) per draw. Worth it for
+    lookup tables with hundreds of thousands of rows
     """
 
-    def __init__(self, filename, name_field="Name"):
-        """populate name lookup table and prepare word weightings"""
-        item_list = list(csv.DictReader(open(filename)))
+    ENGINES = ('cumulative', 'alias')
+
+    def __init__(self, filename, name_field="Name", engine='cumulative', cache=True):
+        """
+        populate name lookup table and prepare word weightings
+        cache: load the parsed table from (and save it to) a binary cache beside filename
+        (see lookupcache.py)
+        """
+        if engine not in self.ENGINES:
+            raise SamplingEngineException(
+                "Unknown sampling engine '{0}' (expected one of {1})".format(engine, ', '.join(self.ENGINES)))
+        self.engine = engine
         self.name_field = name_field
         self.filename = filename
-        # Weed out rows with blank name field (e.g. empty lines at end of file)
+        table = lookupcache.load(filename, key='WeightedChoice:' + name_field, build=self._parse,
+                                 use_cache=cache)
+        self.items = table.rows
+        self.weight_ceiling = table.weight_ceiling
+        self.name_list = table.column(self.name_field)
+        if numpy is not None:
+            self._ceiling_array = numpy.asarray(self.weight_ceiling, dtype=float)
+        if self.engine == 'alias':
+            self._build_alias_table()
+
+    def _build_alias_table(self):
+        """
+        Vose's alias method: split the weights into n equal-sized columns, each holding
+        at most two items: the column's own item (with probability alias_prob[i])
+        and one 'alias' item that tops the column up
+        """
+        n = len(self.weight_ceiling)
+        total = self.weight_ceiling[-1]
+        weights = [ceiling - floor for ceiling, floor in zip(self.weight_ceiling,
+                                                             itertools.chain([0.0], self.weight_ceiling))]
+        scaled = [weight * n / total for weight in weights]
+        self.alias_prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.alias_prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # anything left over is (to within rounding) a full column
+        if numpy is not None:
+            self._alias_prob_array = numpy.array(self.alias_prob)
+            self._alias_array = numpy.array(self.alias)
+
+    def _parse(self):
+        """read the lookup file: rows with a name, and their cumulative weights"""
         with open(self.filename) as f:
-            item_list = [item for item in csv.DictReader(f) if item[self.name_field].strip(' \t\n\r')]
-        self.items = []
-        self.weight_ceiling = []
+            reader = csv.DictReader(f)
+            # Weed out rows with blank name field (e.g. empty lines at end of file)
+            items = [item for item in reader if item[self.name_field].strip(' \t\n\r')]
+            fields = reader.fieldnames or ()
+        weight_ceiling = []
         running_weight = 0.0
-        for item in item_list:
+        for item in items:
             running_weight += self.item_weight(item)
-            self.items.append(item)
-            self.weight_ceiling.append(running_weight)
+            weight_ceiling.append(running_weight)
+        return lookupcache.LookupTable(fields, items, weight_ceiling)
 
     def item_weight(self, item):
         prefix = 'rn_'
         expweight = prefix + 'expweight'
         weight = prefix + 'weight'
-        if expweight in item:
-            return math.exp(float(item[expweight]))
-        elif weight in item:
-            return float(item[weight])
-        else:
+        try:
+            if expweight in item:
+                return math.exp(float(item[expweight]))
+            elif weight in item:
+                return float(item[weight])
+        except (TypeError, ValueError):
             raise MissingPopularityException(
-                "No weight field on name {0} in file {1}".format(
-                    (item[self.name_field], self.filename)))
+                "Malformed weight on name {0} in file {1}".format(item[self.name_field], self.filename))
+        raise MissingPopularityException(
+            "No weight field on name {0} in file {1}".format(item[self.name_field], self.filename))
 
-    def name(self):
+    def name(self, rng=random):
         """
         returns a random name with frequency based on a popularity
         rating held in two files, one for male, one for female
         e.g. for male forenames, "John" will be emitted often,
         "Bartholomew" rarely
+
+        rng: source of random numbers (the random module or a random.Random instance)
+        """
+        return self.name_list[self._select(rng)]
+
+    def names(self, n, rng=None, start=0):
+        """
+        returns a list of n random names, drawn in one batch
+        Same distribution as calling .name() n times, but much cheaper per name
+        rng, start: see indices()
+        """
+        return [self.name_list[i] for i in self.indices(n, rng, start)]
+
+    def indices(self, n, rng=None, start=0):
+        """
+        returns n random indices into self.items, weighted by popularity
+        All n pins are dropped at once and resolved against weight_ceiling in a single
+        search (vectorised if numpy is installed)
+
+        rng: a CounterRandom to draw from, making the batch repeatable: index i is then
+        the one .name(rng) picks for record start + i
         """
-        return self.items[self._select()][self.name_field]
+        if rng is not None:
+            return self.drawn_indices(rng.batch(start, n))
+        if self.engine == 'alias':
+            return self._alias_indices(n)
+        if numpy is not None:
+            pindrops = numpy.random.uniform(0.0, self.weight_ceiling[-1], n)
+            return numpy.searchsorted(self._ceiling_array, pindrops, side='left').tolist()
+        top = self.weight_ceiling[-1]
+        ceiling = self.weight_ceiling
+        return [bisect_left(ceiling, random.uniform(0.0, top)) for i in range(n)]
+
+    def _alias_indices(self, n):
+        if numpy is not None:
+            columns = numpy.random.randint(0, len(self.alias), n)
+            own_item = numpy.random.uniform(0.0, 1.0, n) < self._alias_prob_array[columns]
+            return numpy.where(own_item, columns, self._alias_array[columns]).tolist()
+        return [self._alias_select(random) for i in range(n)]
+
+    def drawn_indices(self, draws, rows=None):
+        """
+        indices picked by the records of a CounterBatch (or those at the positions in rows),
+        each exactly the one _select() picks from that record's stream.
+        Every pin is drawn first, then all are resolved in one search
+        """
+        if self.engine == 'alias':
+            columns = draws.randbelow(len(self.alias), rows)
+            alias, alias_prob = self.alias, self.alias_prob
+            return [column if r < alias_prob[column] else alias[column]
+                    for column, r in zip(columns, draws.randoms(rows))]
+        pindrops = draws.uniforms(0.0, self.weight_ceiling[-1], rows)
+        if numpy is not None:
+            return numpy.searchsorted(self._ceiling_array, pindrops, side='left').tolist()
+        ceiling = self.weight_ceiling
+        return [bisect_left(ceiling, pindrop) for pindrop in pindrops]
+
+    def _alias_select(self, rng):
+        column = rng.randrange(len(self.alias))
+        return column if rng.random() < self.alias_prob[column] else self.alias[column]
 
-    def _select(self):
-        pindrop = uniform(0.0, self.weight_ceiling[-1])
+    def _select(self, rng=random):
+        if self.engine == 'alias':
+            return self._alias_select(rng)
+        pindrop = rng.uniform(0.0, self.weight_ceiling[-1])
         i = bisect_left(self.weight_ceiling, pindrop)
         if i != len(self.weight_ceiling):
             return i